@@ -0,0 +1,5 @@
+"""Performance benchmarks of the ledger.
+
+Benchmarks create and drop the schema the same way tests do, so they run against
+the test database (see `TEST_DB_*` settings) and never touch the working one.
+"""
@@ -0,0 +1,74 @@
+"""Latency of authenticated `/balance` requests under concurrent load.
+
+Every request carries its own token, so each one requires a signature check. The same
+load is applied with signatures checked on the event loop and in the worker pools.
+
+Usage::
+
+    python -m benchmarks.auth_load [REQUESTS [CONCURRENCY]]
+"""
+import asyncio
+import sys
+import time
+
+from Cryptodome.PublicKey import RSA
+
+from benchmarks.common import app_client, report
+from yaaccu.cache import clear_caches
+from yaaccu.models import Account
+from yaaccu.signature import configure_executor, shutdown_executor
+from yaaccu.utils import KEY_SIZE, create_token, pub_key_to_account
+
+REQUESTS = 2000
+CONCURRENCY = 50
+EXECUTORS = ('none', 'thread', 'process')
+
+
+async def load(client, tokens, concurrency):
+    """Send requests with given tokens using `concurrency` parallel clients.
+
+    :return: list of request timings in milliseconds
+    """
+    pending = iter(tokens)
+    timings = []
+
+    async def worker():
+        for token in pending:
+            started = time.perf_counter()
+            response = await client.get('/balance', headers={'X-Token': token})
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.content
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return timings
+
+
+async def run(requests, concurrency):
+    async with app_client() as client:
+        key = RSA.generate(KEY_SIZE)
+        pub_key = key.publickey().export_key().decode()
+        await Account.create(address=pub_key_to_account(pub_key), pub_key=pub_key)
+
+        # tokens differ by timestamp only (and must not expire during the benchmark)
+        now = int(time.time())
+        tokens = [create_token(key, t=now - i).decode() for i in range(requests)]
+
+        for executor in EXECUTORS:
+            configure_executor(executor)
+            clear_caches()
+            started = time.perf_counter()
+            timings = await load(client, tokens, concurrency)
+            elapsed = time.perf_counter() - started
+            report("/balance, %s executor" % executor, timings)
+            print("%-40s %9.1f requests/s" % ("", requests / elapsed))
+            shutdown_executor()
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    requests, concurrency = (args + [REQUESTS, CONCURRENCY][len(args):])[:2]
+    asyncio.run(run(requests, concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Throughput of `/transfer/batch/` versus the same number of `/transfer/` calls.
+
+Usage::
+
+    python -m benchmarks.batch [TRANSFERS [BATCH_SIZE]]
+"""
+import asyncio
+import sys
+import time
+
+from Cryptodome.PublicKey import RSA
+
+from benchmarks.common import app_client, create_accounts
+from yaaccu.models import Account, AccountType, Currency
+from yaaccu.utils import KEY_SIZE, create_token
+
+TRANSFERS = 2000
+BATCH_SIZE = 200
+RECEIVERS = 100
+
+
+def transfer(index):
+    return {
+        'receiver': 'bench-active-%s' % (index % RECEIVERS + 1),
+        'currency': 'USD',
+        'amount': '1.00',
+    }
+
+
+async def single_calls(client, headers, transfers):
+    for index in range(transfers):
+        response = await client.post('/transfer/', json=transfer(index), headers=headers)
+        assert response.status_code == 200, response.content
+
+
+async def batch_calls(client, headers, transfers, batch_size):
+    for start in range(0, transfers, batch_size):
+        response = await client.post('/transfer/batch/', json={'transfers': [
+            transfer(index) for index in range(start, min(start + batch_size, transfers))
+        ]}, headers=headers)
+        assert response.status_code == 200, response.content
+        assert all(result['status'] == 'committed' for result in response.json()['results'])
+
+
+async def run(transfers, batch_size):
+    async with app_client() as client:
+        await Currency.create(name='US Dollar', symbol='USD')
+        key = RSA.generate(KEY_SIZE)
+        await Account.create(
+            address='bench-source',
+            pub_key=key.publickey().export_key().decode(),
+            type=AccountType.passive,
+        )
+        await create_accounts(RECEIVERS)
+        headers = {'X-Token': create_token(key).decode()}
+
+        for name, calls in (
+                ("/transfer/", single_calls(client, headers, transfers)),
+                ("/transfer/batch/", batch_calls(client, headers, transfers, batch_size)),
+        ):
+            started = time.perf_counter()
+            await calls
+            elapsed = time.perf_counter() - started
+            print("%-40s %9.1f transfers/s" % (name, transfers / elapsed))
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    transfers, batch_size = (args + [TRANSFERS, BATCH_SIZE][len(args):])[:2]
+    asyncio.run(run(transfers, batch_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+from decimal import Decimal
+
+from starlette.config import environ
+
+if 'yaaccu.settings' not in sys.modules:  # pragma: no cover
+    # run as a script: switch to the test database before settings are read
+    environ["TESTING"] = "TRUE"
+    if "TEST_DB_HOST" in environ:
+        environ["DB_HOST"] = environ["TEST_DB_HOST"]
+
+# pylint: disable=wrong-import-position
+from alembic.config import main as alembic  # noqa
+from async_asgi_testclient import TestClient  # noqa
+
+import yaaccu.settings as config  # noqa
+from yaaccu.app import create_app  # noqa
+from yaaccu.db import db  # noqa
+from yaaccu.models import Account, AccountType, Currency  # noqa
+from yaaccu.partitions import ensure_partitions  # noqa
+
+#: amount of every seeded operation
+SEED_AMOUNT = Decimal('1.00')
+
+
+def reset_schema():
+    alembic(["--raiseerr", "downgrade", "base"])
+    alembic(["--raiseerr", "upgrade", "head"])
+
+
+@asynccontextmanager
+async def database():
+    """Recreate schema of the test database and bind `db` to it.
+    """
+    reset_schema()
+    await db.set_bind(config.DB_DSN, **db.config['kwargs'])
+    try:
+        yield db
+    finally:
+        await db.pop_bind().close()
+
+
+@asynccontextmanager
+async def app_client():
+    """Recreate schema of the test database and start the application.
+
+    The application binds `db` itself, so don't use it together with `database()`.
+    """
+    reset_schema()
+    async with TestClient(create_app()) as client:
+        yield client
+
+
+async def create_accounts(count: int, account_type: AccountType = AccountType.active):
+    """Create `count` accounts with sequential ids using a single statement.
+
+    :return: id of the first created account
+    """
+    return await db.scalar(db.text(
+        "WITH created AS ("
+        "  INSERT INTO accounts (address, type) "
+        "  SELECT :prefix || n, CAST(:type AS account_type) "
+        "  FROM generate_series(1, :count) AS n "
+        "  RETURNING id"
+        ") SELECT min(id) FROM created"
+    ), prefix='bench-%s-' % account_type.value, type=account_type.value, count=count)
+
+
+async def seed_operations(operations: int,
+                          source: Account,
+                          first_account: int,
+                          accounts: int,
+                          currency: Currency):
+    """Append committed transfers from `source` to the range of accounts.
+
+    Each document holds two operations, so `operations // 2` documents are created.
+    Materialized balances are updated as well.
+    """
+    await ensure_partitions(reserve=operations // 2)
+    await db.status(db.text(
+        "WITH docs AS ("
+        "  INSERT INTO documents (committed, created_at) "
+        "  SELECT true, now() FROM generate_series(1, :documents) "
+        "  RETURNING id"
+        "), ops AS ("
+        "  INSERT INTO operations (document, account, currency, amount) "
+        "  SELECT docs.id, leg.account, :currency, leg.amount FROM docs, LATERAL (VALUES "
+        "    (CAST(:source AS bigint), -CAST(:amount AS numeric)), "
+        "    (:first_account + docs.id % :accounts, CAST(:amount AS numeric))"
+        "  ) AS leg(account, amount) "
+        "  RETURNING document, account, currency, amount"
+        ") "
+        "INSERT INTO balances (account, currency, committed, pending, last_document) "
+        "SELECT account, currency, sum(amount), 0, max(document) FROM ops "
+        "GROUP BY account, currency "
+        "ON CONFLICT (account, currency) DO UPDATE "
+        "SET committed = balances.committed + excluded.committed, "
+        "last_document = greatest(balances.last_document, excluded.last_document)"
+    ), documents=operations // 2, currency=currency.id, source=source.id,
+        first_account=first_account, accounts=accounts, amount=SEED_AMOUNT)
+    await db.status(db.text("ANALYZE"))
+
+
+async def measure(func, repeat: int):
+    """Await `func()` `repeat` times and return a list of timings in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def percentile(timings, percent: float):
+    """Nearest-rank percentile of timings.
+    """
+    ordered = sorted(timings)
+    return ordered[max(0, int(round(percent / 100 * len(ordered))) - 1)]
+
+
+def summary(timings):
+    """Latency percentiles of timings in milliseconds.
+    """
+    return {
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'max': max(timings),
+    }
+
+
+def report(name: str, timings):
+    print("%-40s median %9.3f ms  p99 %9.3f ms  max %9.3f ms" % (
+        name, statistics.median(timings), percentile(timings, 99), max(timings)
+    ))
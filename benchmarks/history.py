@@ -0,0 +1,71 @@
+"""First-byte latency and throughput of `/history` streaming depending on its length.
+
+The source account takes part in every seeded document, so its history is half of
+the ledger. Peak memory of the process is reported to show it doesn't grow with
+the history length.
+
+Usage::
+
+    python -m benchmarks.history [LEDGER_SIZE ...]
+"""
+import asyncio
+import resource
+import sys
+import time
+
+from Cryptodome.PublicKey import RSA
+
+from benchmarks.common import app_client, create_accounts, seed_operations
+from yaaccu.models import Account, AccountType, Currency
+from yaaccu.utils import KEY_SIZE, create_token, pub_key_to_account
+
+LEDGER_SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+ACCOUNTS = 10_000
+
+
+async def stream_history(client, headers):
+    """Read the whole history.
+
+    :return: seconds to the first chunk, total seconds and the number of rows
+    """
+    started = time.perf_counter()
+    first_byte = None
+    rows = 0
+    response = await client.get('/history', headers=headers, stream=True)
+    assert response.status_code == 200, response.content
+    async for chunk in response.iter_content(64 * 1024):
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        rows += chunk.count(b'\n')
+    return first_byte, time.perf_counter() - started, rows
+
+
+async def run(ledger_sizes):
+    async with app_client() as client:
+        currency = await Currency.create(name='US Dollar', symbol='USD')
+        key = RSA.generate(KEY_SIZE)
+        pub_key = key.publickey().export_key().decode()
+        source = await Account.create(
+            address=pub_key_to_account(pub_key), pub_key=pub_key, type=AccountType.passive
+        )
+        first_account = await create_accounts(ACCOUNTS)
+        headers = {'X-Token': create_token(key).decode()}
+
+        seeded = 0
+        for size in ledger_sizes:
+            await seed_operations(size - seeded, source, first_account, ACCOUNTS, currency)
+            seeded = size
+            first_byte, elapsed, rows = await stream_history(client, headers)
+            peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+            print("/history, %-10s first byte %9.3f ms  %10.0f rows/s  peak rss %6s MB" % (
+                rows, first_byte * 1000, rows / elapsed, peak_memory
+            ))
+
+
+def main():
+    ledger_sizes = [int(size) for size in sys.argv[1:]] or LEDGER_SIZES
+    asyncio.run(run(ledger_sizes))
+
+
+if __name__ == '__main__':
+    main()
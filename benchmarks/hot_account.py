@@ -0,0 +1,79 @@
+"""Goodput of concurrent transfers from a single hot account with and without sequencer.
+
+The hot account is funded for half of the transfers, so exactly half of them should
+succeed. Without the sequencer concurrent documents see each other's pending
+operations and reject each other, so fewer transfers are committed.
+
+Usage::
+
+    python -m benchmarks.hot_account [TRANSFERS [CONCURRENCY]]
+"""
+import asyncio
+import sys
+import time
+from decimal import Decimal
+
+from Cryptodome.PublicKey import RSA
+
+from benchmarks.common import app_client, create_accounts
+import yaaccu.settings as config
+from yaaccu.models import Account, AccountType, Currency, Document
+from yaaccu.utils import KEY_SIZE, create_token, pub_key_to_account
+
+TRANSFERS = 1000
+CONCURRENCY = 20
+RECEIVERS = 100
+
+
+async def run_transfers(client, headers, transfers, concurrency):
+    pending = iter(range(transfers))
+    statuses = []
+
+    async def worker():
+        for index in pending:
+            response = await client.post('/transfer/', json={
+                'receiver': 'bench-active-%s' % (index % RECEIVERS + 1),
+                'currency': 'USD',
+                'amount': '1.00',
+            }, headers=headers)
+            statuses.append(response.status_code)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return statuses
+
+
+async def run(transfers, concurrency):
+    for enabled in (False, True):
+        config.SEQUENCER = enabled
+        async with app_client() as client:
+            currency = await Currency.create(name='US Dollar', symbol='USD')
+            source = await Account.create(address='bench-source', type=AccountType.passive)
+            await create_accounts(RECEIVERS)
+            key = RSA.generate(KEY_SIZE)
+            pub_key = key.publickey().export_key().decode()
+            hot = await Account.create(address=pub_key_to_account(pub_key), pub_key=pub_key)
+            doc = await Document.create_transfer(
+                source, hot, Decimal(transfers // 2), currency
+            )
+            await doc.commit()
+
+            started = time.perf_counter()
+            statuses = await run_transfers(
+                client, {'X-Token': create_token(key).decode()}, transfers, concurrency
+            )
+            elapsed = time.perf_counter() - started
+            committed = statuses.count(200)
+            print("%-20s committed %5s of %5s possible, goodput %9.1f transfers/s" % (
+                "sequencer %s" % ('on' if enabled else 'off'),
+                committed, transfers // 2, committed / elapsed
+            ))
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    transfers, concurrency = (args + [TRANSFERS, CONCURRENCY][len(args):])[:2]
+    asyncio.run(run(transfers, concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Throughput of batch verification of signed documents.
+
+A batch of documents signed by several clients is verified with
+`check_signatures_async` using every kind of executor. Results are reported as
+verifications per second, in total and per core (worker).
+
+Usage::
+
+    python -m benchmarks.signatures [SIGNATURES [WORKERS]]
+"""
+import asyncio
+import os
+import sys
+import time
+from decimal import Decimal
+
+from Cryptodome.PublicKey import RSA
+
+from yaaccu.cache import clear_caches
+from yaaccu.signature import (
+    canonical_document,
+    check_signatures_async,
+    configure_executor,
+    create_signature,
+    shutdown_executor,
+)
+from yaaccu.utils import KEY_SIZE
+
+SIGNATURES = 2000
+#: number of clients signing documents of the batch
+KEYS = 20
+EXECUTORS = ('none', 'thread', 'process')
+
+
+def signed_documents(count: int, keys: int):
+    """Sign transfers of distinct amounts by `keys` clients.
+
+    :return: list of (content, signature, public key) tuples
+    """
+    pairs = []
+    for _ in range(keys):
+        key = RSA.generate(KEY_SIZE)
+        pairs.append((key.export_key().decode(), key.publickey().export_key().decode()))
+    items = []
+    for index in range(count):
+        private_key, pub_key = pairs[index % keys]
+        amount = Decimal(index + 1).scaleb(-2)
+        content = canonical_document([
+            ('sender-%s' % (index % keys), 'USD', -amount),
+            ('receiver', 'USD', amount),
+        ], str(index))
+        items.append((content, create_signature(content, private_key), pub_key))
+    return items
+
+
+async def run(signatures: int, workers: int):
+    items = signed_documents(signatures, KEYS)
+    for executor in EXECUTORS:
+        configure_executor(executor, workers)
+        clear_caches()
+        # start workers before measuring
+        await check_signatures_async(items[:workers * 2])
+        started = time.perf_counter()
+        valid = await check_signatures_async(items)
+        elapsed = time.perf_counter() - started
+        assert all(valid), "Signatures must be valid"
+        cores = 1 if executor == 'none' else min(workers, os.cpu_count() or 1)
+        print("%-30s %9.1f verifies/s %9.1f verifies/s per core" % (
+            "%s executor, %s workers" % (executor, 1 if executor == 'none' else workers),
+            signatures / elapsed,
+            signatures / elapsed / cores,
+        ))
+        shutdown_executor()
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    signatures, workers = (args + [SIGNATURES, os.cpu_count() or 1][len(args):])[:2]
+    asyncio.run(run(signatures, workers))
+
+
+if __name__ == '__main__':
+    main()
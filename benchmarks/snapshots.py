@@ -0,0 +1,56 @@
+"""Committed balance query time: full history versus the latest snapshot.
+
+Seeds the ledger, takes a snapshot and appends a tail of operations after it, then
+compares the balance of a single account summed over the whole history with the
+balance calculated as the snapshot plus operations after it.
+
+Usage::
+
+    python -m benchmarks.snapshots [LEDGER_SIZE [TAIL_SIZE]]
+"""
+import asyncio
+import sys
+
+from benchmarks.common import (
+    create_accounts,
+    database,
+    measure,
+    report,
+    seed_operations,
+)
+from yaaccu.db import db
+from yaaccu.models import Account, AccountType, BalanceSnapshot, Currency
+
+LEDGER_SIZE = 1_000_000
+TAIL_SIZE = 10_000
+ACCOUNTS = 1000
+REPEAT = 20
+
+
+async def run(ledger_size, tail_size):
+    async with database():
+        currency = await Currency.create(name='US Dollar', symbol='USD')
+        source = await Account.create(address='bench-source', type=AccountType.passive)
+        first_account = await create_accounts(ACCOUNTS)
+
+        await seed_operations(ledger_size, source, first_account, ACCOUNTS, currency)
+        await BalanceSnapshot.take(interval=1, grace_interval=0)
+        await seed_operations(tail_size, source, first_account, ACCOUNTS, currency)
+
+        for full in (True, False):
+            balances = BalanceSnapshot.committed_balances(full=full)
+            query = db.select([balances.c.balance]).where(balances.c.account == first_account)
+            timings = await measure(query.gino.scalar, REPEAT)
+            report("%s, %s + %s operations" % (
+                "full history" if full else "snapshot", ledger_size, tail_size
+            ), timings)
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    ledger_size, tail_size = (args + [LEDGER_SIZE, TAIL_SIZE][len(args):])[:2]
+    asyncio.run(run(ledger_size, tail_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Load test of the HTTP API and the ledger producing results comparable across commits.
+
+For every ledger size the test database is recreated and seeded with committed
+transfers. Then for every contention level concurrent clients send `/transfer/` and
+`/balance` requests:
+
+* ``hot`` - all requests involve a couple of senders and receivers;
+* ``uniform`` - senders and receivers are chosen uniformly.
+
+`Document.is_valid` of a single transfer is measured as well. Random choices are
+seeded, so runs with the same parameters send the same requests.
+
+Usage::
+
+    python -m yaaccu bench --help
+"""
+import asyncio
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from Cryptodome.PublicKey import RSA
+
+from benchmarks.common import app_client, create_accounts, seed_operations, summary
+from yaaccu.metrics import phase_totals
+from yaaccu.models import Account, AccountType, Currency, Document
+from yaaccu.utils import KEY_SIZE, create_token, pub_key_to_account
+
+LEDGER_SIZES = (10_000, 1_000_000)
+CONTENTION = ('hot', 'uniform')
+CONCURRENCY = 20
+REQUESTS = 1000
+SENDERS = 20
+RECEIVERS = 1000
+#: number of senders and receivers involved into requests under the hot contention
+HOT_ACCOUNTS = 2
+#: initial balance of each sender, enough to never run out of funds
+SENDER_FUNDS = Decimal('1000000.00')
+TRANSFER_AMOUNT = '0.01'
+SEED = 42
+
+
+async def drive(concurrency: int, requests: int, send):
+    """Await `send(index)` for each request index using `concurrency` parallel clients.
+
+    :param send: coroutine function returning True if the request succeeded
+    :return: throughput, latency percentiles (ms) and db queries made per request
+    """
+    pending = iter(range(requests))
+    timings = []
+    failures = 0
+
+    async def client():
+        nonlocal failures
+        for index in pending:
+            started = time.perf_counter()
+            if not await send(index):
+                failures += 1
+            timings.append((time.perf_counter() - started) * 1000)
+
+    queries_before, db_seconds_before = phase_totals('db')
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    queries_after, db_seconds_after = phase_totals('db')
+    queries = queries_after - queries_before
+    db_seconds = db_seconds_after - db_seconds_before
+    return {
+        'requests': requests,
+        'failures': failures,
+        'throughput': requests / elapsed,
+        'queries_per_request': queries / requests,
+        'db_ms_per_request': db_seconds * 1000 / requests,
+        **summary(timings),
+    }
+
+
+async def create_senders(source: Account, currency: Currency, count: int):
+    """Create funded accounts owned by generated keys.
+
+    :return: list of (account, auth headers) pairs
+    """
+    senders = []
+    for _ in range(count):
+        key = RSA.generate(KEY_SIZE)
+        pub_key = key.publickey().export_key().decode()
+        account = await Account.create(address=pub_key_to_account(pub_key), pub_key=pub_key)
+        senders.append((account, {'X-Token': create_token(key).decode()}))
+    docs = await Document.create_transfers(
+        source, [(account, SENDER_FUNDS, currency) for account, _ in senders]
+    )
+    created = [doc for doc in docs if doc is not None]
+    assert len(created) == len(docs), "Unable to fund senders"
+    assert all(await Document.commit_many(created)), "Unable to fund senders"
+    return senders
+
+
+def plan_requests(rng: random.Random, senders, receivers, contention: str, requests: int):
+    """Choose sender headers and receiver address of each request.
+    """
+    if contention == 'hot':
+        senders, receivers = senders[:HOT_ACCOUNTS], receivers[:HOT_ACCOUNTS]
+    return [
+        (rng.choice(senders)[1], rng.choice(receivers)) for _ in range(requests)
+    ]
+
+
+async def run_transfers(client, plan, concurrency: int):
+    async def send(index):
+        headers, receiver = plan[index]
+        response = await client.post('/transfer/', json={
+            'receiver': receiver,
+            'currency': 'USD',
+            'amount': TRANSFER_AMOUNT,
+        }, headers=headers)
+        return response.status_code == 200
+    return await drive(concurrency, len(plan), send)
+
+
+async def run_balances(client, plan, concurrency: int):
+    async def send(index):
+        headers, _ = plan[index]
+        response = await client.get('/balance', headers=headers)
+        return response.status_code == 200
+    return await drive(concurrency, len(plan), send)
+
+
+async def run_ledger(ledger_size: int, contention_levels, concurrency: int, requests: int):
+    """Seed the ledger of the given size and run all benchmarks against it.
+    """
+    rng = random.Random(SEED)
+    results = []
+    async with app_client() as client:
+        currency = await Currency.create(name='US Dollar', symbol='USD')
+        source = await Account.create(address='bench-source', type=AccountType.passive)
+        first_receiver = await create_accounts(RECEIVERS)
+        await seed_operations(ledger_size, source, first_receiver, RECEIVERS, currency)
+        senders = await create_senders(source, currency, SENDERS)
+        receivers = ['bench-active-%s' % (n + 1) for n in range(RECEIVERS)]
+
+        for contention in contention_levels:
+            plan = plan_requests(rng, senders, receivers, contention, requests)
+            for benchmark, send_requests in (
+                    ('/transfer/', run_transfers),
+                    ('/balance', run_balances),
+            ):
+                results.append({
+                    'benchmark': benchmark,
+                    'ledger_size': ledger_size,
+                    'contention': contention,
+                    'concurrency': concurrency,
+                    **await send_requests(client, plan, concurrency),
+                })
+
+        doc = await Document.create_transfer(
+            source, senders[0][0], Decimal(TRANSFER_AMOUNT), currency
+        )
+        results.append({
+            'benchmark': 'Document.is_valid',
+            'ledger_size': ledger_size,
+            'contention': None,
+            'concurrency': 1,
+            **await drive(1, requests, lambda index: doc.is_valid()),
+        })
+    return results
+
+
+def environment():
+    """Describe the code being benchmarked to compare results across commits.
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'started_at': datetime.utcnow().isoformat(),
+    }
+
+
+async def run(ledger_sizes=LEDGER_SIZES,
+              contention_levels=CONTENTION,
+              concurrency: int = CONCURRENCY,
+              requests: int = REQUESTS):
+    """Run the suite and return json-serializable results.
+    """
+    report = {
+        'environment': environment(),
+        'parameters': {
+            'ledger_sizes': list(ledger_sizes),
+            'contention': list(contention_levels),
+            'concurrency': concurrency,
+            'requests': requests,
+            'senders': SENDERS,
+            'receivers': RECEIVERS,
+            'seed': SEED,
+        },
+        'results': [],
+    }
+    for ledger_size in ledger_sizes:
+        report['results'] += await run_ledger(
+            ledger_size, contention_levels, concurrency, requests
+        )
+    return report
@@ -0,0 +1,55 @@
+"""Latency of a single transfer: document creation, validation and commit.
+
+Transfers are made sequentially from the passive source account to random receivers
+on top of a seeded ledger, so the numbers reflect round trips made by the transfer
+rather than lock contention.
+
+Usage::
+
+    python -m benchmarks.transfer [TRANSFERS [LEDGER_SIZE]]
+"""
+import asyncio
+import random
+import sys
+from decimal import Decimal
+
+from benchmarks.common import (
+    create_accounts,
+    database,
+    measure,
+    report,
+    seed_operations,
+)
+from yaaccu.models import Account, AccountType, Currency, Document
+
+TRANSFERS = 1000
+LEDGER_SIZE = 100_000
+ACCOUNTS = 1000
+
+
+async def run(transfers, ledger_size):
+    async with database():
+        currency = await Currency.create(name='US Dollar', symbol='USD')
+        source = await Account.create(address='bench-source', type=AccountType.passive)
+        first_account = await create_accounts(ACCOUNTS)
+        receivers = await Account.query.where(Account.id >= first_account).gino.all()
+        await seed_operations(ledger_size, source, first_account, ACCOUNTS, currency)
+
+        async def transfer():
+            doc = await Document.create_transfer(
+                source, random.choice(receivers), Decimal('1.00'), currency
+            )
+            assert doc and await doc.commit()
+
+        timings = await measure(transfer, transfers)
+        report("transfer, %s operations" % ledger_size, timings)
+
+
+def main():
+    transfers = int(sys.argv[1]) if len(sys.argv) > 1 else TRANSFERS
+    ledger_size = int(sys.argv[2]) if len(sys.argv) > 2 else LEDGER_SIZE
+    asyncio.run(run(transfers, ledger_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Document validation latency depending on the ledger size.
+
+Grows the ledger from 10k to 10M operations and measures `Document.is_valid` of a
+small transfer document at each step. Validation cost should depend on the document
+size only, so timings should stay flat.
+
+Usage::
+
+    python -m benchmarks.validation [LEDGER_SIZE ...]
+"""
+import asyncio
+import sys
+from decimal import Decimal
+
+from benchmarks.common import (
+    create_accounts,
+    database,
+    measure,
+    report,
+    seed_operations,
+)
+from yaaccu.models import Account, AccountType, Currency, Document
+
+LEDGER_SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+ACCOUNTS = 10_000
+REPEAT = 50
+
+
+async def run(ledger_sizes):
+    async with database():
+        currency = await Currency.create(name='US Dollar', symbol='USD')
+        source = await Account.create(address='bench-source', type=AccountType.passive)
+        first_account = await create_accounts(ACCOUNTS)
+        receiver = await Account.get(first_account)
+
+        doc = await Document.create()
+        await doc.transfer(source, receiver, Decimal('1.00'), currency)
+
+        seeded = 0
+        for size in ledger_sizes:
+            await seed_operations(size - seeded, source, first_account, ACCOUNTS, currency)
+            seeded = size
+            timings = await measure(doc.is_valid, REPEAT)
+            report("is_valid, %s operations" % size, timings)
+
+
+def main():
+    ledger_sizes = [int(size) for size in sys.argv[1:]] or LEDGER_SIZES
+    asyncio.run(run(ledger_sizes))
+
+
+if __name__ == '__main__':
+    main()
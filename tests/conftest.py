@@ -15,8 +15,11 @@ environ["DB_HOST"] = environ["TEST_DB_HOST"]
 @pytest.fixture(autouse=True)
 def app():
     from yaaccu.app import create_app
+    from yaaccu.cache import clear_caches
 
     app = create_app()
+    # cached objects (e.g. accounts) don't survive database recreation
+    clear_caches()
 
     main(["--raiseerr", "upgrade", "head"])
 
@@ -62,3 +65,15 @@ def create_account(client):
             type=type,
         )
     return _inner
+
+
+@pytest.fixture
+async def replica(client):
+    """The test database connected as a replica.
+    """
+    import yaaccu.settings as config
+    from yaaccu.replica import replicas
+
+    await replicas.connect([config.DB_DSN])
+    yield replicas.engines[0]
+    await replicas.close()
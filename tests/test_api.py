@@ -1,13 +1,18 @@
 import asyncio
+import json
 import time
+from decimal import Decimal
 from functools import wraps
 
 import pytest
 from Cryptodome.PublicKey import RSA
 from Cryptodome.Hash import SHA3_256
 from Cryptodome.Signature import pss
+from starlette.datastructures import Secret
 
-from yaaccu.models import Account, AccountType
+import yaaccu.settings as config
+from yaaccu.models import Account, AccountType, Document
+from yaaccu.signature import canonical_document, create_signature
 from yaaccu.utils import create_token, pub_key_to_account
 
 test_deposit_key = RSA.generate(1024)
@@ -73,7 +78,7 @@ async def test_balance(client, create_account, make_transfer, currency):
         'X-Token': create_token(test_key).decode()
     })
     assert response.status_code == 200
-    assert response.json()['balance'] == 0
+    assert response.json()['balances'] == {}
 
     # fill acc1
     await Account.create(
@@ -89,7 +94,75 @@ async def test_balance(client, create_account, make_transfer, currency):
         'X-Token': create_token(test_key).decode()
     })
     assert response.status_code == 200
-    assert response.json()['balance'] == 1
+    assert response.json()['balances'] == {currency.symbol: 1}
+    etag = response.headers['etag']
+
+    # unchanged balances are not sent again
+    response = await client.get('/balance', headers={
+        'X-Token': create_token(test_key).decode(),
+        'If-None-Match': etag,
+    })
+    assert response.status_code == 304
+
+    response = await make_transfer(test_deposit_key, acc1, '2.00', currency)
+    assert response.status_code == 200
+    response = await client.get('/balance', query_string={'pending': 'true'}, headers={
+        'X-Token': create_token(test_key).decode(),
+        'If-None-Match': etag,
+    })
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert response.json()['balances'] == {currency.symbol: 3}
+    assert response.json()['pending'] == {currency.symbol: 0}
+
+
+@pytest.mark.asyncio
+async def test_balance_by_currency(client, create_account, make_transfer, currency, currency2):
+    acc1 = await create_account(test_key)
+    await Account.create(
+        address='deposit',
+        pub_key=test_deposit_key.publickey().export_key().decode(),
+        type=AccountType.passive
+    )
+    await make_transfer(test_deposit_key, acc1, '1.00', currency)
+    await make_transfer(test_deposit_key, acc1, '2.00', currency2)
+
+    response = await client.get('/balance', headers={
+        'X-Token': create_token(test_key).decode()
+    })
+    assert response.json()['balances'] == {currency.symbol: 1, currency2.symbol: 2}
+
+    response = await client.get('/balance', query_string={'currency': currency2.symbol}, headers={
+        'X-Token': create_token(test_key).decode()
+    })
+    assert response.json()['balances'] == {currency2.symbol: 2}
+
+    response = await client.get('/balance', query_string={'currency': 'INVALID'}, headers={
+        'X-Token': create_token(test_key).decode()
+    })
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_read_from_replica(client, replica, create_account, make_transfer, currency):
+    acc1 = await create_account(test_key)
+    await Account.create(
+        address='deposit',
+        pub_key=test_deposit_key.publickey().export_key().decode(),
+        type=AccountType.passive
+    )
+    response = await make_transfer(test_deposit_key, acc1, '1.00', currency)
+    document = response.json()['id']
+
+    headers = {'X-Token': create_token(test_key).decode(), 'X-Min-Document': str(document)}
+    response = await client.get('/balance', headers=headers)
+    assert response.status_code == 200
+    assert response.json()['balances'] == {currency.symbol: 1}
+    assert response.json()['last_document'] == document
+
+    response = await client.get('/history', headers=headers)
+    assert response.status_code == 200
+    assert [json.loads(line)['document'] for line in response.text.splitlines()] == [document]
 
 
 @pytest.mark.asyncio
@@ -213,6 +286,7 @@ async def test_success_transfer(make_transfer, create_account, currency):
 
     response = await make_transfer(test_key, acc2, '1.00', currency)
     assert response.status_code == 200, "Invalid status code %s" % response.content
+    assert response.headers['x-attempts'] == '1'
 
 
 @pytest.mark.asyncio
@@ -240,13 +314,33 @@ async def test_race_condition(make_transfer, create_account, currency, client):
         'X-Token': create_token(test_key).decode()
     })
     assert response.status_code == 200, "Wrong status %s" % response.content
-    assert response.json()['balance'] == 0
+    assert response.json()['balances'] == {currency.symbol: 0}
 
     response = await client.get('/balance', headers={
         'X-Token': create_token(test_key2).decode()
     })
     assert response.status_code == 200, "Wrong status %s" % response.content
-    assert response.json()['balance'] == 1
+    assert response.json()['balances'] == {currency.symbol: 1}
+
+
+@pytest.mark.asyncio
+async def test_sequenced_race_condition(monkeypatch, make_transfer, create_account, currency):
+    """Ensure concurrent transfers from the same account don't reject each other.
+    """
+    monkeypatch.setattr(config, 'SEQUENCER', True)
+    acc1 = await create_account(test_key)
+    acc2 = await create_account(test_key2)
+    await Account.create(
+        address='deposit',
+        pub_key=test_deposit_key.publickey().export_key().decode(),
+        type=AccountType.passive
+    )
+    await make_transfer(test_deposit_key, acc1, '5.00', currency)
+
+    responses = await asyncio.gather(*[
+        make_transfer(test_key, acc2, '1.00', currency, ignore_failed=True) for _ in range(10)
+    ])
+    assert [response.status_code for response in responses].count(200) == 5
 
 
 @pytest.mark.asyncio
@@ -256,3 +350,268 @@ async def test_transfer_insufficient_funds(create_account, currency, make_transf
 
     with pytest.raises(AssertionError):
         await make_transfer(test_key, acc, '1.00', currency)
+
+
+@pytest.mark.asyncio
+async def test_auth_cache(client, monkeypatch, create_account):
+    await create_account(test_key)
+    token = create_token(test_key).decode()
+    for _ in range(2):
+        response = await client.get('/balance', headers={'X-Token': token})
+        assert response.status_code == 200, "Wrong status %s" % response.content
+
+    response = await client.get('/stats')
+    assert response.status_code == 403
+
+    monkeypatch.setattr(config, 'STATS_TOKEN', Secret('secret'))
+    response = await client.get('/stats', headers={'X-Stats-Token': 'invalid'})
+    assert response.status_code == 403
+    response = await client.get('/stats', headers={'X-Stats-Token': 'secret'})
+    assert response.status_code == 200
+    caches = response.json()['caches']
+    assert caches['tokens']['hits'] == 1
+    assert caches['accounts']['hits'] == 1
+
+
+@pytest.mark.asyncio
+async def test_transfer_batch(client, create_account, make_transfer, currency):
+    acc1 = await create_account(test_key)
+    acc2 = await create_account(test_key2)
+    await Account.create(
+        address='deposit',
+        pub_key=test_deposit_key.publickey().export_key().decode(),
+        type=AccountType.passive
+    )
+    await make_transfer(test_deposit_key, acc1, '2.00', currency)
+
+    response = await client.post('/transfer/batch/', json={'transfers': [
+        {'receiver': acc2, 'currency': currency.symbol, 'amount': '1.50'},
+        # insufficient funds
+        {'receiver': acc2, 'currency': currency.symbol, 'amount': '1.00'},
+        {'receiver': acc2, 'currency': 'INVALID', 'amount': '0.10'},
+        {'receiver': 'INVALID', 'currency': currency.symbol, 'amount': '0.10'},
+        # the receiver can't be charged
+        {'receiver': acc2, 'currency': currency.symbol, 'amount': '-1.50'},
+        {'receiver': acc2, 'currency': currency.symbol, 'amount': '0'},
+        {'receiver': acc2, 'currency': currency.symbol, 'amount': '0.50'},
+    ]}, headers={
+        'X-Token': create_token(test_key).decode()
+    })
+    assert response.status_code == 200, "Wrong status %s" % response.content
+    results = response.json()['results']
+    statuses = [result['status'] for result in results]
+    assert statuses == ['committed', 'error', 'error', 'error', 'error', 'error', 'committed']
+    assert results[4]['detail'] == results[5]['detail'] == 'Invalid amount'
+
+    response = await client.get('/balance', headers={
+        'X-Token': create_token(test_key2).decode()
+    })
+    assert response.json()['balances'] == {currency.symbol: 2}
+
+
+@pytest.mark.asyncio
+async def test_create_document(client, create_account, make_transfer, currency):
+    acc1 = await create_account(test_key)
+    acc2 = await create_account(test_key2)
+    await Account.create(
+        address='deposit',
+        pub_key=test_deposit_key.publickey().export_key().decode(),
+        type=AccountType.passive
+    )
+    await make_transfer(test_deposit_key, acc1, '1.00', currency)
+
+    # transfer with a fee charged to the deposit account
+    response = await client.post('/documents/', json={'operations': [
+        {'account': acc1, 'currency': currency.symbol, 'amount': '-1.00'},
+        {'account': acc2, 'currency': currency.symbol, 'amount': '0.90'},
+        {'account': 'deposit', 'currency': currency.symbol, 'amount': '0.10'},
+    ]}, headers={
+        'X-Token': create_token(test_key).decode()
+    })
+    assert response.status_code == 200, "Wrong status %s" % response.content
+
+    response = await client.get('/balance', headers={
+        'X-Token': create_token(test_key2).decode()
+    })
+    assert response.json()['balances'] == {currency.symbol: 0.9}
+
+    # only the current account may be charged
+    response = await client.post('/documents/', json={'operations': [
+        {'account': acc2, 'currency': currency.symbol, 'amount': '-0.90'},
+        {'account': acc1, 'currency': currency.symbol, 'amount': '0.90'},
+    ]}, headers={
+        'X-Token': create_token(test_key).decode()
+    })
+    assert response.status_code == 403
+
+    # imbalanced document
+    response = await client.post('/documents/', json={'operations': [
+        {'account': acc2, 'currency': currency.symbol, 'amount': '-0.90'},
+        {'account': acc1, 'currency': currency.symbol, 'amount': '0.80'},
+    ]}, headers={
+        'X-Token': create_token(test_key2).decode()
+    })
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_signed_documents(client, create_account, make_transfer, currency):
+    acc1 = await create_account(test_key)
+    acc2 = await create_account(test_key2)
+    await Account.create(
+        address='deposit',
+        pub_key=test_deposit_key.publickey().export_key().decode(),
+        type=AccountType.passive
+    )
+    await make_transfer(test_deposit_key, acc1, '2.00', currency)
+    private_key = test_key.export_key().decode()
+    headers = {'X-Token': create_token(test_key).decode()}
+
+    def sign(amount, nonce):
+        return create_signature(canonical_document([
+            (acc1, currency.symbol, -Decimal(amount)),
+            (acc2, currency.symbol, Decimal(amount)),
+        ], nonce), private_key)
+
+    def transfer(amount, signature, nonce):
+        return {'receiver': acc2, 'currency': currency.symbol, 'amount': amount,
+                'signature': signature, 'nonce': nonce}
+
+    signature = sign('1.00', 'nonce-1')
+
+    response = await client.post(
+        '/transfer/', json=transfer('1.00', sign('1.00', 'nonce-2'), 'nonce-1'), headers=headers
+    )
+    assert response.status_code == 400
+    assert response.json()['detail'] == 'Invalid signature'
+
+    response = await client.post(
+        '/transfer/', json=transfer('1.00', signature, None), headers=headers
+    )
+    assert response.status_code == 400
+    assert response.json()['detail'] == 'Signed documents require a single line nonce'
+
+    response = await client.post(
+        '/transfer/', json=transfer('1.00', signature, 'nonce-1'), headers=headers
+    )
+    assert response.status_code == 200, "Wrong status %s" % response.content
+    assert response.json()['signature'] == signature
+    assert response.json()['nonce'] == 'nonce-1'
+
+    for replayed in (signature, signature.upper(), ' '.join([signature[:2], signature[2:]])):
+        response = await client.post(
+            '/transfer/', json=transfer('1.00', replayed, 'nonce-1'), headers=headers
+        )
+        assert response.status_code == 400, "Signatures can't be replayed"
+        assert response.json()['detail'] == 'Nonce is already used'
+
+    batch_signature = sign('0.50', 'nonce-3')
+    response = await client.post('/transfer/batch/', json={'transfers': [
+        transfer('1.00', signature, 'nonce-1'),
+        transfer('0.50', batch_signature, 'nonce-3'),
+        transfer('0.50', batch_signature, 'nonce-3'),
+        # the signature of another transfer
+        transfer('0.25', batch_signature, 'nonce-3'),
+    ]}, headers=headers)
+    assert response.status_code == 200, "Wrong status %s" % response.content
+    results = response.json()['results']
+    assert [result['status'] for result in results] == ['error', 'committed', 'error', 'error']
+    assert results[0]['detail'] == 'Nonce is already used'
+    assert results[1]['document']['signature'] == batch_signature
+    assert results[2]['detail'] == 'Nonce is already used'
+    assert results[3]['detail'] == 'Invalid signature'
+
+    operations = [
+        {'account': acc1, 'currency': currency.symbol, 'amount': '-0.25'},
+        {'account': acc2, 'currency': currency.symbol, 'amount': '0.25'},
+    ]
+    response = await client.post('/documents/', json={
+        'operations': operations, 'signature': signature, 'nonce': 'nonce-1'
+    }, headers=headers)
+    assert response.status_code == 400
+    assert response.json()['detail'] == 'Invalid signature'
+
+    document_signature = sign('0.25', 'nonce-4')
+    for status_code in (200, 400):
+        response = await client.post('/documents/', json={
+            'operations': operations, 'signature': document_signature.upper(), 'nonce': 'nonce-4'
+        }, headers=headers)
+        assert response.status_code == status_code, "Wrong status %s" % response.content
+        if status_code == 200:
+            assert response.json()['signature'] == document_signature, \
+                "Signatures are stored normalized"
+
+
+@pytest.mark.asyncio
+async def test_metrics(client, monkeypatch, create_account):
+    await create_account(test_key)
+    response = await client.get('/balance', headers={
+        'X-Token': create_token(test_key).decode()
+    })
+    assert response.status_code == 200
+    server_timing = response.headers['server-timing']
+    for phase in ('db', 'crypto', 'total'):
+        assert '%s;' % phase in server_timing, server_timing
+
+    response = await client.get('/metrics')
+    assert response.status_code == 403
+
+    monkeypatch.setattr(config, 'STATS_TOKEN', Secret('secret'))
+    response = await client.get('/metrics', headers={'X-Stats-Token': 'secret'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'yaaccu_requests_total{method="GET",path="/balance",status="200"}' in response.text
+    assert 'yaaccu_phase_calls_total{phase="db"}' in response.text
+    assert 'yaaccu_cache_hits_total{cache="tokens"}' in response.text
+    assert 'yaaccu_pool_in_use{pool=' in response.text
+    assert 'yaaccu_pool_wait_seconds_count{pool=' in response.text
+
+
+@pytest.mark.asyncio
+async def test_history(client, create_account, make_transfer, currency):
+    acc1 = await create_account(test_key)
+    acc2 = await create_account(test_key2)
+    await Account.create(
+        address='deposit',
+        pub_key=test_deposit_key.publickey().export_key().decode(),
+        type=AccountType.passive
+    )
+    await make_transfer(test_deposit_key, acc1, '4.00', currency)
+    for amount in ('1.00', '2.00'):
+        await make_transfer(test_key, acc2, amount, currency)
+    headers = {'X-Token': create_token(test_key).decode()}
+
+    response = await client.get('/history', headers=headers)
+    assert response.status_code == 200, "Wrong status %s" % response.content
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    operations = [json.loads(line) for line in response.text.splitlines()]
+    assert [operation['amount'] for operation in operations] == ['4.0000', '-1.0000', '-2.0000']
+    assert all(operation['currency'] == currency.symbol for operation in operations)
+
+    # the next page
+    response = await client.get('/history', query_string={
+        'after_commit': operations[0]['commit_seq'], 'after': operations[0]['id'], 'limit': 1,
+        'currency': currency.symbol,
+    }, headers=headers)
+    assert [json.loads(line) for line in response.text.splitlines()] == operations[1:2]
+
+    # documents committed out of the order of ids are not skipped by next pages
+    sender = await Account.query.where(Account.address == acc1).gino.first()
+    receiver = await Account.query.where(Account.address == acc2).gino.first()
+    earlier = await Document.create_transfer(sender, receiver, Decimal('0.50'), currency)
+    later = await Document.create_transfer(sender, receiver, Decimal('0.25'), currency)
+    for doc in (later, earlier):
+        assert await doc.commit()
+        response = await client.get('/history', query_string={
+            'after_commit': operations[-1]['commit_seq'], 'after': operations[-1]['id'],
+        }, headers=headers)
+        page = [json.loads(line) for line in response.text.splitlines()]
+        assert [operation['document'] for operation in page] == [doc.id]
+        operations += page
+
+    response = await client.get('/history', query_string={'currency': 'INVALID'},
+                                headers=headers)
+    assert response.status_code == 400
+    for limit in (0, -1, config.HISTORY_MAX_LIMIT + 1):
+        response = await client.get('/history', query_string={'limit': limit}, headers=headers)
+        assert response.status_code == 422, "Limit %s must be rejected" % limit
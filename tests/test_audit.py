@@ -0,0 +1,75 @@
+from decimal import Decimal
+
+import pytest
+
+from yaaccu.models import AccountType, Document, Operation
+
+np = pytest.importorskip('numpy')
+
+# pylint: disable=wrong-import-position
+from yaaccu.audit import audit  # noqa: E402
+
+
+@pytest.fixture
+async def passive_acc(create_account):
+    return await create_account(AccountType.passive)
+
+
+@pytest.fixture
+async def active_acc(create_account):
+    return await create_account(AccountType.active)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('chunk_size', [1, 1000])
+async def test_audit(passive_acc, active_acc, currency, chunk_size):
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert await doc.commit() is True
+    # pending documents are not audited against account types
+    await Document.create_transfer(passive_acc, active_acc, Decimal('2.00'), currency)
+
+    report = await audit(workers=2, chunk_size=chunk_size)
+    assert (report['documents'], report['operations']) == (1, 4)
+    assert report['unbalanced_documents'] == []
+    assert report['invalid_balances'] == []
+    assert report['mismatched_balances'] == []
+
+
+@pytest.mark.asyncio
+async def test_audit_commit_order(passive_acc, active_acc, currency):
+    withdrawal = await Document.create(committed=True, commit_seq=2)
+    deposit = await Document.create(committed=True, commit_seq=1)
+    for doc, amount in ((withdrawal, Decimal('-1.00')), (deposit, Decimal('1.00'))):
+        await Operation.create(document=doc.id, account=active_acc.id, currency=currency.id,
+                               amount=amount)
+        await Operation.create(document=doc.id, account=passive_acc.id, currency=currency.id,
+                               amount=-amount)
+
+    report = await audit(workers=1, chunk_size=1)
+    assert report['invalid_balances'] == [], \
+        "Documents are applied in commit order, the withdrawal is committed after the deposit"
+
+
+@pytest.mark.asyncio
+async def test_audit_corrupted(passive_acc, active_acc, currency):
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert await doc.commit() is True
+    # operations created bypassing documents break the ledger
+    await Operation.create(document=doc.id, account=active_acc.id, currency=currency.id,
+                           amount=Decimal('1.00'))
+    overdraft = await Document.create(committed=True)
+    await Operation.create(document=overdraft.id, account=active_acc.id, currency=currency.id,
+                           amount=Decimal('-5.00'))
+    await Operation.create(document=overdraft.id, account=passive_acc.id, currency=currency.id,
+                           amount=Decimal('5.00'))
+
+    report = await audit(workers=2, chunk_size=2)
+    assert report['unbalanced_documents'] == [(doc.id, currency.id, Decimal('1.0000'))]
+    assert report['invalid_balances'] == sorted([
+        (active_acc.id, currency.id, overdraft.id, Decimal('-3.0000')),
+        (passive_acc.id, currency.id, overdraft.id, Decimal('4.0000')),
+    ])
+    assert report['mismatched_balances'] == sorted([
+        (active_acc.id, currency.id, Decimal('1.0000'), 0, Decimal('-3.0000'), 0),
+        (passive_acc.id, currency.id, Decimal('-1.0000'), 0, Decimal('4.0000'), 0),
+    ])
@@ -0,0 +1,24 @@
+import time
+
+from yaaccu.cache import LRUCache, cache_stats
+
+
+def test_lru_eviction():
+    cache = LRUCache('test_lru', maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None, "Least recently used entry should be evicted"
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache_stats()['test_lru'] == {'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1}
+
+
+def test_expiration():
+    cache = LRUCache('test_expiration', maxsize=10, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2, expires_at=time.time() - 1)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert len(cache) == 1
@@ -0,0 +1,124 @@
+from decimal import Decimal
+
+import pytest
+from Cryptodome.PublicKey import RSA
+
+from yaaccu.chain import (
+    GENESIS,
+    chain_hash,
+    inclusion_proof,
+    leaf_hash,
+    seal,
+    verify,
+    verify_inclusion,
+)
+from yaaccu.db import db
+from yaaccu.models import (
+    Account,
+    AccountType,
+    BalanceSnapshot,
+    Document,
+    HashCheckpoint,
+    Operation,
+)
+from yaaccu.utils import create_token, pub_key_to_account
+
+
+async def create_documents(create_account, currency, count: int):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    documents = []
+    for _ in range(count):
+        doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+        assert await doc.commit()
+        documents.append(doc)
+    return documents
+
+
+def check_proof(proof) -> bool:
+    document_hash = bytes.fromhex(proof['hash'])
+    return chain_hash(
+        bytes.fromhex(proof['previous']), proof['content'].encode()
+    ) == document_hash and verify_inclusion(
+        leaf_hash(document_hash),
+        proof['index'],
+        proof['size'],
+        [bytes.fromhex(node) for node in proof['path']],
+        bytes.fromhex(proof['root']),
+    )
+
+
+@pytest.mark.asyncio
+async def test_seal(create_account, currency):
+    documents = await create_documents(create_account, currency, 3)
+    assert await seal() is None, "Documents are sealed behind the snapshot horizon only"
+
+    await BalanceSnapshot.take(interval=1, grace_interval=0)
+    checkpoint = await seal(batch_size=2)
+    assert (checkpoint.document, checkpoint.size) == (documents[1].id, 2)
+    checkpoint = await seal(batch_size=2)
+    assert (checkpoint.document, checkpoint.size) == (documents[2].id, 3)
+    assert await seal() is None
+
+    previous = GENESIS
+    for doc in documents:
+        proof = await inclusion_proof(doc.id)
+        assert proof['previous'] == previous.hex()
+        assert proof['root'] == checkpoint.root.hex()
+        assert check_proof(proof)
+        previous = bytes.fromhex(proof['hash'])
+    assert previous == checkpoint.hash
+
+
+@pytest.mark.asyncio
+async def test_verify(create_account, currency):
+    documents = await create_documents(create_account, currency, 5)
+    await BalanceSnapshot.take(interval=1, grace_interval=0)
+    while await seal(batch_size=2):
+        pass
+
+    report = await verify()
+    assert (report['documents'], report['checkpoints']) == (5, 3)
+    assert (report['invalid_documents'], report['invalid_checkpoints']) == ([], [])
+
+    # verification continues from the latest verified checkpoint
+    report = await verify()
+    assert (report['documents'], report['checkpoints']) == (0, 0)
+
+    await Operation.update.values(amount=Decimal('2.00')).where(db.and_(
+        Operation.document == documents[2].id, Operation.amount > 0
+    )).gino.status()
+    report = await verify()
+    assert report['invalid_documents'] == [], "Verified documents are not rehashed"
+    report = await verify(full=True)
+    assert report['invalid_documents'] == [documents[2].id]
+    checkpoints = await HashCheckpoint.query.order_by(HashCheckpoint.document).gino.all()
+    assert report['invalid_checkpoints'] == [checkpoints[1].document]
+
+
+@pytest.mark.asyncio
+async def test_proof_api(client, create_account, currency):
+    key = RSA.generate(1024)
+    pub_key = key.publickey().export_key().decode()
+    sender = await Account.create(
+        address=pub_key_to_account(pub_key), pub_key=pub_key, type=AccountType.normal
+    )
+    receiver = await create_account(AccountType.active)
+    doc = await Document.create_transfer(sender, receiver, Decimal('1.00'), currency)
+    assert await doc.commit()
+    headers = {'X-Token': create_token(key).decode()}
+
+    response = await client.get('/proof/%s' % doc.id, headers=headers)
+    assert response.status_code == 404
+
+    await BalanceSnapshot.take(interval=1, grace_interval=0)
+    await seal()
+    response = await client.get('/proof/%s' % doc.id, headers=headers)
+    assert response.status_code == 200
+    assert check_proof(response.json())
+
+    other = (await create_documents(create_account, currency, 1))[0]
+    await BalanceSnapshot.take(interval=1, grace_interval=0)
+    await seal()
+    response = await client.get('/proof/%s' % other.id, headers=headers)
+    assert response.status_code == 404, "Documents of other accounts are not available"
@@ -1,7 +1,11 @@
+import asyncio
+import json
 from unittest import mock
 
 import typer
+from typer.testing import CliRunner
 
+from benchmarks import suite
 from yaaccu import __main__
 
 
@@ -12,3 +16,63 @@ def test_cli_simple():
     with mock.patch.object(__main__, "app"):
         with mock.patch.object(__main__, "__name__", "__main__"):
             __main__.init()
+
+
+def test_check_balances():
+    result = CliRunner().invoke(__main__.app, ['check-balances'])
+    assert result.exit_code == 0, result.output
+
+
+def test_bench(tmp_path):
+    calls = []
+
+    async def run(**kwargs):
+        calls.append(kwargs)
+        return {'results': []}
+
+    output = tmp_path / 'report.json'
+    with mock.patch.object(suite, 'run', run):
+        result = CliRunner().invoke(__main__.app, [
+            'bench', '--ledger-size', '100', '--ledger-size', '200', '--contention', 'hot',
+            '--concurrency', '2', '--requests', '10', '--output', str(output),
+        ])
+    assert result.exit_code == 0, result.output
+    assert calls == [{
+        'ledger_sizes': [100, 200],
+        'contention_levels': ['hot'],
+        'concurrency': 2,
+        'requests': 10,
+    }]
+    assert json.loads(output.read_text()) == {'results': []}
+
+
+def test_bench_drive():
+    async def send(index):
+        return index % 2 == 0
+
+    report = asyncio.run(suite.drive(concurrency=2, requests=10, send=send))
+    assert (report['requests'], report['failures']) == (10, 5)
+    assert {'throughput', 'queries_per_request', 'db_ms_per_request'} <= set(report)
+
+
+def test_bench_invalid_contention():
+    result = CliRunner().invoke(__main__.app, ['bench', '--contention', 'INVALID'])
+    assert result.exit_code != 0
+
+
+def test_import(tmp_path):
+    ledger = tmp_path / 'ledger.csv'
+    ledger.write_text('document,account,currency,amount\n'
+                      'a,unknown,USD,1.00\n')
+    result = CliRunner().invoke(__main__.app, ['import', str(ledger)])
+    assert result.exit_code == 1
+    assert 'unknown account unknown' in result.output
+
+    result = CliRunner().invoke(__main__.app, ['import', str(ledger), '--format', 'INVALID'])
+    assert result.exit_code != 0
+
+
+def test_audit():
+    result = CliRunner().invoke(__main__.app, ['audit', '--workers', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'The ledger is consistent' in result.output
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import gino
+import pytest
+from async_asgi_testclient import TestClient
+from Cryptodome.PublicKey import RSA
+
+import yaaccu.settings as config
+from yaaccu.app import create_app
+from yaaccu.db import InstrumentedPool, db
+from yaaccu.models import Account, AccountType
+from yaaccu.utils import create_token, pub_key_to_account
+
+
+@pytest.mark.asyncio
+async def test_pool_stats():
+    engine = await gino.create_engine(
+        config.DB_DSN, min_size=1, max_size=1, pool_class=InstrumentedPool
+    )
+    stats = engine._pool.stats  # pylint: disable=protected-access
+    in_use, waits = stats.in_use, stats.wait.count
+    try:
+        first = await engine.acquire()
+        second = asyncio.ensure_future(engine.acquire())
+        await asyncio.sleep(0.1)
+        assert (stats.in_use, stats.waiting) == (in_use + 1, 1)
+
+        await first.release()
+        await (await second).release()
+        assert (stats.in_use, stats.waiting) == (in_use, 0)
+        assert stats.wait.count == waits + 2
+        assert stats.max_size == 1
+    finally:
+        await engine.close()
+
+
+def test_transaction_pool_mode_settings():
+    result = subprocess.run(
+        [sys.executable, '-c', 'from yaaccu.db import db; '
+                               'print(db.config["use_connection_for_request"])'],
+        env=dict(os.environ, DB_POOL_MODE='transaction'),
+        stdout=subprocess.PIPE, check=True,
+    )
+    assert result.stdout.decode().strip() == 'False'
+
+
+@pytest.mark.asyncio
+async def test_transaction_pool_mode(monkeypatch):
+    monkeypatch.setitem(db.config, 'use_connection_for_request', False)
+    async with TestClient(create_app()) as client:
+        key = RSA.generate(1024)
+        pub_key = key.publickey().export_key().decode()
+        account = await Account.create(
+            address=pub_key_to_account(pub_key), pub_key=pub_key, type=AccountType.active
+        )
+        response = await client.get('/balance', headers={'X-Token': create_token(key).decode()})
+        assert response.status_code == 200, response.content
+        assert response.json()['account'] == account.address
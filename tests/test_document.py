@@ -2,10 +2,14 @@ from decimal import Decimal
 
 import pytest
 
+import yaaccu.settings as config
 from yaaccu.models import (
     AccountType,
+    Balance,
     Document,
+    Operation,
 )
+from yaaccu.models.document import DocumentConflict, InvalidDocumentException, NonceReused
 
 
 @pytest.fixture
@@ -25,7 +29,10 @@ async def test_simple_valid_document(passive_acc, active_acc, currency):
     doc = await Document.create()
     assert await doc.is_valid()
 
-    await doc.add_operation(passive_acc, currency, Decimal('-1.00'))
+    operation = await doc.add_operation(passive_acc, currency, Decimal('-1.00'))
+    assert (operation.document, operation.account, operation.amount) == (
+        doc.id, passive_acc.id, Decimal('-1.00')
+    )
     await doc.add_operation(active_acc, currency, Decimal('1.00'))
     assert await doc.is_valid() is True
 
@@ -88,3 +95,158 @@ async def test_passive_account_positive_balance(create_account, passive_acc, cur
     await doc.add_operation(passive_acc, currency, Decimal('1.00'))
     await doc.add_operation(passive_acc2, currency, Decimal('-1.00'))
     assert await doc.is_valid() is False
+
+
+@pytest.mark.asyncio
+async def test_unrelated_accounts_are_not_validated(create_account, passive_acc, active_acc,
+                                                   currency):
+    """Ensure only accounts involved into the document are validated.
+    """
+    broken_acc = await create_account(AccountType.active)
+    broken_doc = await Document.create(committed=True)
+    await broken_doc.add_operation(broken_acc, currency, Decimal('-1.00'))
+
+    doc = await Document.create()
+    await doc.add_operation(passive_acc, currency, Decimal('-1.00'))
+    await doc.add_operation(active_acc, currency, Decimal('1.00'))
+    assert await doc.is_valid() is True
+
+
+@pytest.mark.asyncio
+async def test_materialized_balances(passive_acc, active_acc, currency):
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    balance = await Balance.get((active_acc.id, currency.id))
+    assert (balance.committed, balance.pending) == (0, Decimal('1.00'))
+
+    assert await doc.commit() is True
+    assert await doc.commit() is False, "Document can't be committed twice"
+    balance = await Balance.get((active_acc.id, currency.id))
+    assert (balance.committed, balance.pending) == (Decimal('1.00'), 0)
+    assert await Balance.find_mismatches() == []
+
+    # operations created bypassing the document are not reflected in balances
+    await Operation.create(
+        document=doc.id,
+        account=active_acc.id,
+        currency=currency.id,
+        amount=Decimal('1.00')
+    )
+    assert len(await Balance.find_mismatches()) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('copy_threshold', [1000, 1], ids=['insert', 'copy'])
+async def test_add_operations(monkeypatch, create_account, passive_acc, currency, copy_threshold):
+    monkeypatch.setattr(config, 'OPERATIONS_COPY_THRESHOLD', copy_threshold)
+    receivers = [await create_account(AccountType.active) for _ in range(3)]
+
+    doc = await Document.create()
+    await doc.add_operations(
+        [(passive_acc, currency, Decimal('-3.00'))] +
+        [(receiver, currency, Decimal('1.00')) for receiver in receivers]
+    )
+    assert await doc.is_valid() is True
+    operations = await Operation.query.where(Operation.document == doc.id).gino.all()
+    assert len(operations) == 4
+    assert await Balance.find_mismatches() == []
+
+
+@pytest.mark.asyncio
+async def test_create_with_operations(create_account, passive_acc, active_acc, currency,
+                                      currency2):
+    fee_acc = await create_account(AccountType.active)
+    doc = await Document.create_with_operations([
+        (passive_acc, currency, Decimal('-1.00')),
+        (active_acc, currency, Decimal('0.90')),
+        (fee_acc, currency, Decimal('0.10')),
+        (passive_acc, currency2, Decimal('-2.00')),
+        (active_acc, currency2, Decimal('2.00')),
+    ])
+    assert doc is not None
+    assert await doc.commit() is True
+
+    doc = await Document.create_with_operations([
+        (passive_acc, currency, Decimal('-1.00')),
+        (active_acc, currency2, Decimal('1.00')),
+    ])
+    assert doc is None, "Imbalanced document should not be created"
+    assert await Balance.find_mismatches() == []
+
+
+@pytest.mark.asyncio
+async def test_conflict_and_abort(create_account, passive_acc, active_acc, currency):
+    receiver = await create_account(AccountType.active)
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert await doc.commit() is True
+
+    pending_doc = await Document.create_transfer(active_acc, receiver, Decimal('1.00'), currency)
+    doc = await Document.create()
+    await doc.add_operations([
+        (active_acc, currency, Decimal('-1.00')),
+        (receiver, currency, Decimal('1.00')),
+    ])
+    with pytest.raises(DocumentConflict):
+        await doc.validate()
+
+    assert await pending_doc.abort() is True
+    assert await pending_doc.abort() is False, "Document can't be aborted twice"
+    assert await pending_doc.commit() is False, "Aborted document can't be committed"
+    assert await doc.commit(raise_exception=True) is True
+    assert await doc.abort() is False, "Committed document can't be aborted"
+    assert await Balance.find_mismatches() == []
+
+    # invalid against committed balances
+    with pytest.raises(InvalidDocumentException) as exc_info:
+        await Document.create_with_operations([
+            (active_acc, currency, Decimal('-1.00')),
+            (receiver, currency, Decimal('1.00')),
+        ], raise_exception=True)
+    assert not isinstance(exc_info.value, DocumentConflict)
+
+
+@pytest.mark.asyncio
+async def test_reused_nonce(create_account, passive_acc, active_acc, currency):
+    operations = [
+        (passive_acc, currency, Decimal('-1.00')),
+        (active_acc, currency, Decimal('1.00')),
+    ]
+    doc = await Document.create_with_operations(operations, signature='signature', nonce='1',
+                                                signer=passive_acc)
+    assert doc is not None
+    assert doc.signer == passive_acc.id
+    with pytest.raises(NonceReused):
+        await Document.create_with_operations(operations, raise_exception=True,
+                                              signature='signature2', nonce='1',
+                                              signer=passive_acc)
+    other_signer = await create_account(AccountType.passive)
+    assert await Document.create_with_operations([
+        (other_signer, currency, Decimal('-1.00')),
+        (active_acc, currency, Decimal('1.00')),
+    ], signature='signature3', nonce='1', signer=other_signer) is not None, \
+        "Nonces are unique per signer"
+
+    docs = await Document.create_transfers(
+        passive_acc,
+        [(active_acc, Decimal('1.00'), currency)] * 3,
+        ['signature4', 'signature5', 'signature6'],
+        ['1', '2', '2'],
+    )
+    assert [doc is not None for doc in docs] == [False, True, False]
+    assert docs[1].nonce == '2'
+    assert docs[1].signer == passive_acc.id
+
+    assert await doc.abort() is True
+    assert await Document.used_nonces(passive_acc.id, ['1', '2']) == {'2'}, \
+        "Nonces of aborted documents may be used again"
+
+
+@pytest.mark.asyncio
+async def test_create_transfers_amounts(create_account, passive_acc, currency):
+    receiver = await create_account(AccountType.normal)
+    docs = await Document.create_transfers(passive_acc, [
+        (receiver, Decimal('-1.00'), currency),
+        (receiver, Decimal('0'), currency),
+        (receiver, Decimal('1.00'), currency),
+    ])
+    assert [doc is not None for doc in docs] == [False, False, True], \
+        "Transfers of non-positive amounts should be skipped"
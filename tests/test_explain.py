@@ -0,0 +1,59 @@
+"""Ensure hot queries are able to use indexes instead of sequential scans.
+
+Test tables are tiny, so sequential scans are disabled to make the planner choose
+an index whenever it is possible.
+"""
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from yaaccu.db import db
+from yaaccu.models import Balance, Document, Operation
+
+
+async def explain(query):
+    sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    async with db.transaction():
+        await db.status(db.text("SET LOCAL enable_seqscan = off"))
+        rows = await db.all(db.text("EXPLAIN %s" % sql))
+    return '\n'.join(row[0] for row in rows)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', [
+    # document validation and commit
+    db.select([
+        Operation.account,
+        Operation.currency,
+        db.func.sum(Operation.amount),
+    ]).where(Operation.document == 1).group_by(Operation.account, Operation.currency),
+    # operations after the snapshot horizon
+    db.select([Operation.amount]).where(Operation.document > 1),
+    # raw balance of the account
+    db.select([db.func.sum(Operation.amount)]).where(db.and_(
+        Operation.account == 1,
+        Operation.currency == 1,
+    )),
+    # account history page
+    db.select([Operation.id]).where(db.and_(
+        Operation.account == 1,
+        Operation.id > 1,
+    )).order_by(Operation.id).limit(100),
+    # materialized balance of the account
+    db.select([Balance.committed]).where(Balance.account == 1),
+    # documents not committed yet
+    db.select([Document.id]).where(Document.committed.isnot(True)),
+    # document validation
+    Document(id=1, committed=False)._violations_query(),
+], ids=[
+    'document operations',
+    'operations after horizon',
+    'account operations',
+    'account history',
+    'account balances',
+    'uncommitted documents',
+    'document violations',
+])
+async def test_index_scan(client, query):
+    plan = await explain(query)
+    assert 'Seq Scan' not in plan, plan
+    assert 'Index' in plan, plan
@@ -0,0 +1,126 @@
+import json
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from starlette.datastructures import Secret
+
+import yaaccu.settings as config
+from yaaccu.export import export
+from yaaccu.models import AccountType, Document
+
+
+async def read(chunks):
+    return b''.join([chunk async for chunk in chunks]).decode()
+
+
+@pytest.fixture
+async def documents(create_account, currency):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    docs = []
+    for amount in ('1.00', '2.00'):
+        doc = await Document.create_transfer(passive_acc, active_acc, Decimal(amount), currency)
+        assert await doc.commit()
+        docs.append(doc)
+    # not committed documents are not exported
+    await Document.create_transfer(passive_acc, active_acc, Decimal('4.00'), currency)
+    return passive_acc, active_acc, docs
+
+
+@pytest.mark.asyncio
+async def test_export_ledger(documents):
+    passive_acc, active_acc, docs = documents
+    rows = [json.loads(line) for line in (await read(export('ledger'))).splitlines()]
+    assert [(row['document'], row['account'], row['amount']) for row in rows] == [
+        (docs[0].id, passive_acc.address, '-1.0000'),
+        (docs[0].id, active_acc.address, '1.0000'),
+        (docs[1].id, passive_acc.address, '-2.0000'),
+        (docs[1].id, active_acc.address, '2.0000'),
+    ]
+
+    first = await Document.get(docs[0].id)
+    lines = (await read(export('ledger', 'csv', commit=first.commit_seq))).splitlines()
+    assert lines[0] == 'document,commit_seq,created_at,operation,account,currency,amount'
+    assert len(lines) == 3
+
+
+@pytest.mark.asyncio
+async def test_export_trial_balance(documents, currency):
+    passive_acc, active_acc, docs = documents
+    lines = (await read(export('trial-balance', 'csv'))).splitlines()
+    assert sorted(lines[1:]) == sorted([
+        '%s,%s,-3.0000' % (passive_acc.address, currency.symbol),
+        '%s,%s,3.0000' % (active_acc.address, currency.symbol),
+    ])
+
+    first = await Document.get(docs[0].id)
+    rows = [
+        json.loads(line)
+        for line in (await read(export('trial-balance', commit=first.commit_seq))).splitlines()
+    ]
+    assert {row['account']: row['balance'] for row in rows} == {
+        passive_acc.address: '-1.0000',
+        active_acc.address: '1.0000',
+    }
+
+    past = datetime.utcnow() - timedelta(days=1)
+    assert await read(export('trial-balance', timestamp=past)) == ''
+    # timezone-aware timestamps are converted to UTC
+    future = datetime.now(timezone(timedelta(hours=3))) + timedelta(days=1)
+    assert await read(export('trial-balance', timestamp=future)) == await read(
+        export('trial-balance')
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_as_of_commit(create_account, currency):
+    """Documents commit out of the order of their ids."""
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    earlier = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    later = await Document.create_transfer(passive_acc, active_acc, Decimal('2.00'), currency)
+    assert await later.commit()
+    later = await Document.get(later.id)
+
+    rows = [
+        json.loads(line)
+        for line in (await read(export('trial-balance', commit=later.commit_seq))).splitlines()
+    ]
+    assert {row['account']: row['balance'] for row in rows} == {
+        passive_acc.address: '-2.0000',
+        active_acc.address: '2.0000',
+    }
+
+    assert await earlier.commit()
+    rows = [
+        json.loads(line)
+        for line in (await read(export('ledger', commit=later.commit_seq))).splitlines()
+    ]
+    assert {row['document'] for row in rows} == {later.id}
+
+
+@pytest.mark.asyncio
+async def test_export_api(client, monkeypatch, documents):
+    response = await client.get('/export')
+    assert response.status_code == 403
+
+    monkeypatch.setattr(config, 'EXPORT_TOKEN', Secret('secret'))
+    headers = {'X-Export-Token': 'secret'}
+    response = await client.get('/export', query_string={'format': 'csv'}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    assert len(response.text.splitlines()) == 5
+
+    response = await client.get('/export', query_string={
+        'report': 'trial-balance', 'timestamp': '2000-01-01T00:00:00Z',
+    }, headers=headers)
+    assert response.status_code == 200
+    assert response.text == ''
+
+    response = await client.get('/export', query_string={
+        'report': 'trial-balance'
+    }, headers={'X-Export-Token': 'invalid'})
+    assert response.status_code == 403
+    response = await client.get('/export', query_string={'report': 'INVALID'}, headers=headers)
+    assert response.status_code == 400
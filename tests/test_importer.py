@@ -0,0 +1,81 @@
+import io
+from decimal import Decimal
+
+import pytest
+
+from yaaccu.db import db
+from yaaccu.importer import InvalidImport, import_ledger, read_operations
+from yaaccu.models import AccountType, Balance, Document, Operation
+
+
+def ledger_csv(rows):
+    return io.StringIO('\n'.join(['document,account,currency,amount,created_at'] + rows))
+
+
+@pytest.mark.asyncio
+async def test_import_ledger(create_account, currency, currency2):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    progress = []
+
+    result = await import_ledger(read_operations(ledger_csv([
+        'a,%s,USD,-1.50,2020-01-01T10:00:00' % passive_acc.address,
+        'b,%s,EUR,-2.00,' % passive_acc.address,
+        'a,%s,USD,1.50,2020-01-01T10:00:00' % active_acc.address,
+        'b,%s,EUR,2.00,' % active_acc.address,
+        'c,%s,USD,-0.50,' % active_acc.address,
+        'c,%s,USD,0.50,' % passive_acc.address,
+    ]), 'csv'), chunk_size=2, progress=lambda *args: progress.append(args[:2]))
+
+    assert (result['documents'], result['operations']) == (3, 6)
+    assert progress == [('copy', 6), ('promote', 2), ('promote', 3)]
+    documents = await Document.query.order_by(Document.id).gino.all()
+    assert [document.committed for document in documents] == [True] * 3
+    assert documents[0].created_at.year == 2020
+    assert await db.select([db.func.count()]).select_from(Operation).gino.scalar() == 6
+
+    balance = await Balance.get((active_acc.id, currency.id))
+    assert (balance.committed, balance.pending) == (Decimal('1.00'), 0)
+    assert balance.last_document == documents[2].id
+    balance = await Balance.get((active_acc.id, currency2.id))
+    assert balance.committed == Decimal('2.00')
+    assert await Balance.find_mismatches(full=True) == []
+
+
+@pytest.mark.asyncio
+async def test_import_ndjson(create_account, currency):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    rows = read_operations(io.StringIO(
+        '{"document": 1, "account": "%s", "currency": "USD", "amount": "-1"}\n'
+        '{"document": 1, "account": "%s", "currency": "USD", "amount": 1}\n'
+        % (passive_acc.address, active_acc.address)
+    ), 'ndjson')
+    result = await import_ledger(rows)
+    assert (result['documents'], result['operations']) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_import_invalid(create_account, currency):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+
+    with pytest.raises(InvalidImport) as e:
+        await import_ledger(read_operations(ledger_csv([
+            # active account ends up negative
+            'a,%s,USD,1.00,' % passive_acc.address,
+            'a,%s,USD,-1.00,' % active_acc.address,
+            'b,%s,USD,-1.00,' % passive_acc.address,
+            'b,%s,USD,0.50,' % active_acc.address,
+            'c,unknown,XXX,0,',
+        ]), 'csv'))
+    assert sorted(e.value.errors) == sorted([
+        'unknown account unknown',
+        'unknown currency XXX',
+        'document b has imbalance -0.5000 USD',
+        'account %s would end up with invalid balance -0.5000 USD' % active_acc.address,
+    ])
+    assert await Document.query.gino.all() == []
+
+    with pytest.raises(InvalidImport):
+        await import_ledger(read_operations(ledger_csv(['a,acc,USD,invalid,']), 'csv'))
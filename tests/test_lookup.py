@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from yaaccu.db import db
+from yaaccu.lookup import (
+    CACHE_INVALIDATION_CHANNEL,
+    address_cache,
+    currency_cache,
+    get_accounts,
+    get_currency,
+    handle_invalidation,
+)
+from yaaccu.models import Currency
+
+
+@pytest.mark.asyncio
+async def test_read_through(create_account, currency):
+    assert await get_currency(currency.symbol) is not None
+    assert (await get_currency(currency.symbol)).id == currency.id
+    assert currency_cache.hits >= 1
+    assert await get_currency('INVALID') is None
+
+    acc = await create_account()
+    accounts = await get_accounts([acc.address, acc.address, 'INVALID'])
+    assert list(accounts) == [acc.address]
+    assert address_cache.get(acc.address).id == acc.id
+
+
+@pytest.mark.asyncio
+async def test_handle_invalidation(create_account, currency):
+    acc = await create_account()
+    await get_accounts([acc.address])
+    assert len(address_cache) == 1
+
+    handle_invalidation('INVALID')
+    handle_invalidation('{"table": "accounts", "row": {"address": "%s", "pub_key": null}}'
+                        % acc.address)
+    assert len(address_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_notify_invalidation(currency):
+    """Ensure database triggers broadcast changes of cached rows.
+    """
+    await get_currency(currency.symbol)
+    payloads = asyncio.Queue()
+
+    async with db.acquire() as conn:
+        raw_conn = await conn.get_raw_connection()
+        await raw_conn.add_listener(
+            CACHE_INVALIDATION_CHANNEL, lambda *args: payloads.put_nowait(args[-1])
+        )
+        await Currency.update.values(symbol='USD2').where(
+            Currency.id == currency.id
+        ).gino.status()
+        handle_invalidation(await asyncio.wait_for(payloads.get(), timeout=5))
+
+    assert currency_cache.get(currency.symbol) is None
+    assert await get_currency(currency.symbol) is None
+    assert (await get_currency('USD2')).id == currency.id
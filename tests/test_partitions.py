@@ -0,0 +1,89 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import yaaccu.settings as config
+from yaaccu.db import db
+from yaaccu.models import AccountType, Document, Operation
+from yaaccu.partitions import (
+    default_partition_name,
+    ensure_partitions,
+    partition_bounds,
+    partition_name,
+    partition_size,
+)
+
+
+async def partition_of(document: Document) -> str:
+    return await db.scalar(db.text(
+        "SELECT tableoid::regclass::text FROM operations WHERE document = :document LIMIT 1"
+    ), document=document.id)
+
+
+async def next_document_id(document_id: int):
+    await db.status(db.text("SELECT setval('documents_id_seq', :id, false)"), id=document_id)
+
+
+@pytest.mark.asyncio
+async def test_ensure_partitions(create_account, currency):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    size, ahead = partition_size(await partition_bounds()), config.PARTITIONS_AHEAD
+
+    # partitions ahead are created by migrations
+    assert await ensure_partitions() == []
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert await partition_of(doc) == partition_name('operations', 0)
+
+    # the first document of the last partition created ahead
+    await next_document_id(ahead * size)
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert doc.id == ahead * size
+    assert await partition_of(doc) == partition_name('operations', ahead)
+    assert await doc.commit()
+
+    created = await ensure_partitions()
+    assert created == [
+        partition_name(table, number)
+        for number in range(ahead + 1, 2 * ahead + 1)
+        for table in ('documents', 'operations')
+    ]
+    assert await ensure_partitions() == []
+
+
+@pytest.mark.asyncio
+async def test_default_partition(create_account, currency):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    size, ahead = partition_size(await partition_bounds()), config.PARTITIONS_AHEAD
+
+    # documents outrunning partitions created ahead
+    number = ahead + 2
+    await next_document_id(number * size)
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert await partition_of(doc) == default_partition_name('operations')
+    assert await doc.commit()
+
+    created = await ensure_partitions()
+    assert created == [
+        partition_name(table, created_number)
+        for created_number in range(number, number + ahead + 1)
+        for table in ('documents', 'operations')
+    ]
+    assert await partition_of(doc) == partition_name('operations', number)
+    assert (await Document.get(doc.id)).committed
+
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert await partition_of(doc) == partition_name('operations', number)
+    assert await doc.commit()
+
+
+@pytest.mark.asyncio
+async def test_partition_pruning(client):
+    size = partition_size(await partition_bounds())
+    query = db.select([Operation.amount]).where(Operation.document > size)
+    sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    plan = '\n'.join(row[0] for row in await db.all(db.text("EXPLAIN %s" % sql)))
+    assert partition_name('operations', 0) not in plan, plan
+    assert partition_name('operations', 1) in plan, plan
@@ -0,0 +1,44 @@
+import time
+from decimal import Decimal
+
+import pytest
+
+import yaaccu.settings as config
+from yaaccu.db import db
+from yaaccu.models import AccountType, Document
+from yaaccu.replica import read_engine
+
+
+@pytest.mark.asyncio
+async def test_primary_without_replicas(client):
+    assert await read_engine() is db
+    assert await read_engine(min_document=1) is db
+
+
+@pytest.mark.asyncio
+async def test_min_document(monkeypatch, replica, create_account, currency):
+    monkeypatch.setattr(config, 'REPLICA_WAIT_TIMEOUT', 0.05)
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    assert await read_engine() is replica
+
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    # not committed yet
+    assert await read_engine(min_document=doc.id) is db
+    assert await doc.commit()
+    assert await read_engine(min_document=doc.id) is replica
+
+
+@pytest.mark.asyncio
+async def test_min_document_not_committed(monkeypatch, replica, create_account, currency):
+    monkeypatch.setattr(config, 'REPLICA_WAIT_TIMEOUT', 10)
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert await doc.abort()
+
+    started = time.monotonic()
+    # aborted and never created documents don't wait for the replica
+    assert await read_engine(min_document=doc.id) is db
+    assert await read_engine(min_document=doc.id + 1000) is db
+    assert time.monotonic() - started < config.REPLICA_WAIT_TIMEOUT
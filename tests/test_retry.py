@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+import pytest
+
+from yaaccu.models import AccountType, Balance, Document
+from yaaccu.models.document import DocumentConflict, InvalidDocumentException
+from yaaccu.retry import RetryPolicy, create_and_commit
+
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(attempts=5, backoff=0.1, max_backoff=0.3, deadline=1)
+    for attempt, limit in ((1, 0.1), (2, 0.2), (3, 0.3), (4, 0.3)):
+        assert 0 <= policy.delay(attempt) <= limit
+
+
+@pytest.mark.asyncio
+async def test_create_and_commit(create_account, currency):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account(AccountType.active)
+    receiver = await create_account(AccountType.active)
+    policy = RetryPolicy(attempts=3, backoff=0, deadline=1)
+
+    doc, attempts = await create_and_commit([
+        (passive_acc, currency, Decimal('-1.00')),
+        (active_acc, currency, Decimal('1.00')),
+    ], policy)
+    assert doc.committed and attempts == 1
+
+    # conflicts with the pending document until it is committed or aborted
+    pending_doc = await Document.create_transfer(active_acc, receiver, Decimal('1.00'), currency)
+    operations = [
+        (active_acc, currency, Decimal('-1.00')),
+        (receiver, currency, Decimal('1.00')),
+    ]
+    with pytest.raises(DocumentConflict) as exc_info:
+        await create_and_commit(operations, policy)
+    assert exc_info.value.attempts == 3
+
+    await pending_doc.abort()
+    doc, attempts = await create_and_commit(operations, policy)
+    assert doc.committed and attempts == 1
+
+    # invalid documents are not retried
+    with pytest.raises(InvalidDocumentException) as exc_info:
+        await create_and_commit(operations, policy)
+    assert exc_info.value.attempts == 1
+    assert await Balance.find_mismatches() == []
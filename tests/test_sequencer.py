@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from yaaccu.sequencer import Sequencer
+
+
+@pytest.mark.asyncio
+async def test_sequencer_order():
+    sequencer = Sequencer(shards=4)
+    events = []
+
+    async def block(name, account_ids, delay):
+        async with sequencer.sequenced(account_ids):
+            events.append(('start', name))
+            await asyncio.sleep(delay)
+            events.append(('end', name))
+
+    await asyncio.gather(
+        block('first', [1], 0.05),
+        # the same shard as the first one
+        block('second', [5], 0),
+        # disjoint accounts proceed in parallel
+        block('disjoint', [2], 0.05),
+        block('both', [1, 2], 0),
+    )
+    assert events.index(('start', 'disjoint')) < events.index(('end', 'first'))
+    assert events.index(('end', 'first')) < events.index(('start', 'second'))
+    assert events[-2:] == [('start', 'both'), ('end', 'both')]
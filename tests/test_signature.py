@@ -1,6 +1,18 @@
+from decimal import Decimal
+
+import pytest
 from Cryptodome.PublicKey import RSA
 
-from yaaccu.signature import create_signature, check_signature
+from yaaccu.signature import (
+    InvalidSignature,
+    canonical_document,
+    check_signature,
+    check_signature_async,
+    check_signatures_async,
+    configure_executor,
+    create_signature,
+    shutdown_executor,
+)
 
 
 def test_cross_check():
@@ -18,3 +30,53 @@ def test_cross_check():
         key.publickey().export_key().decode(),
         raise_exception=False
     ) is False
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('executor', ['none', 'thread'])
+async def test_check_signature_async(executor):
+    content = 'some_content'
+    key = RSA.generate(1024)
+    pub_key = key.publickey().export_key().decode()
+    configure_executor(executor, workers=2)
+    try:
+        assert await check_signature_async(
+            content, create_signature(content, key.export_key().decode()), pub_key
+        )
+        with pytest.raises(InvalidSignature):
+            await check_signature_async(
+                content, create_signature(content + 'x', key.export_key().decode()), pub_key
+            )
+    finally:
+        shutdown_executor()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('executor', ['none', 'thread'])
+async def test_check_signatures_async(executor):
+    key = RSA.generate(1024)
+    private_key = key.export_key().decode()
+    pub_key = key.publickey().export_key().decode()
+    # odd items are signed for other content
+    items = [
+        ('content %s' % n, create_signature('content %s' % (n + n % 2), private_key), pub_key)
+        for n in range(5)
+    ]
+    configure_executor(executor, workers=2)
+    try:
+        assert await check_signatures_async(items) == [True, False, True, False, True]
+        assert await check_signatures_async([]) == []
+    finally:
+        shutdown_executor()
+
+
+def test_canonical_document():
+    assert canonical_document([
+        ('sender', 'USD', Decimal('-1.5')),
+        ('receiver', 'USD', Decimal('1.50')),
+    ], 'nonce') == 'nonce\nsender|USD|-1.5000\nreceiver|USD|1.5000'
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        configure_executor('unknown')
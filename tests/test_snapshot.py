@@ -0,0 +1,89 @@
+from decimal import Decimal
+
+import pytest
+
+from yaaccu.db import db
+from yaaccu.models import (
+    AccountType,
+    Balance,
+    BalanceSnapshot,
+    Document,
+)
+
+
+async def committed_balances(**kwargs):
+    balances = BalanceSnapshot.committed_balances(**kwargs)
+    rows = await db.select([
+        balances.c.account,
+        balances.c.balance,
+    ]).gino.all()
+    return dict(rows)
+
+
+@pytest.mark.asyncio
+async def test_snapshot(create_account, currency):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account()
+
+    for _ in range(2):
+        doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+        assert await doc.commit()
+    pending_doc = await Document.create_transfer(
+        passive_acc, active_acc, Decimal('1.00'), currency
+    )
+
+    assert await BalanceSnapshot.take(interval=10, grace_interval=0) is None, \
+        "Snapshot shouldn't be taken until interval passed"
+    horizon = await BalanceSnapshot.take(interval=1, grace_interval=0)
+    assert horizon == pending_doc.id - 1, "Documents not committed yet hold the horizon back"
+    assert await pending_doc.commit()
+
+    abandoned_doc = await Document.create_transfer(
+        passive_acc, active_acc, Decimal('1.00'), currency
+    )
+    assert await BalanceSnapshot.take(interval=1, grace_interval=0) < abandoned_doc.id, \
+        "Documents are not abandoned by default"
+    abandoned_horizon = await BalanceSnapshot.take(
+        interval=1, grace_interval=0, abandon_interval=0
+    )
+    assert abandoned_horizon == abandoned_doc.id
+    assert await abandoned_doc.commit() is False, \
+        "Documents behind the snapshot horizon can't be committed"
+    assert await Document.get(abandoned_doc.id) is None, \
+        "Abandoned documents behind the snapshot horizon are aborted"
+    pending = await db.select([Balance.pending]).where(
+        Balance.account.in_([passive_acc.id, active_acc.id])
+    ).gino.all()
+    assert pending == [(0,), (0,)], "Pending balances of aborted documents are released"
+
+    doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+    assert await doc.commit()
+
+    expected = {passive_acc.id: Decimal('-4.00'), active_acc.id: Decimal('4.00')}
+    assert await committed_balances() == expected
+    assert await committed_balances(full=True) == expected
+    assert await committed_balances(as_of=horizon) == {
+        passive_acc.id: Decimal('-2.00'),
+        active_acc.id: Decimal('2.00'),
+    }
+    assert await Balance.find_mismatches() == []
+
+
+@pytest.mark.asyncio
+async def test_snapshot_compaction(create_account, currency):
+    passive_acc = await create_account(AccountType.passive)
+    active_acc = await create_account()
+
+    horizons = []
+    for _ in range(3):
+        doc = await Document.create_transfer(passive_acc, active_acc, Decimal('1.00'), currency)
+        assert await doc.commit()
+        horizons.append(await BalanceSnapshot.take(interval=1, grace_interval=0))
+
+    await BalanceSnapshot.compact(keep=2)
+    snapshots = await db.select([BalanceSnapshot.document]).distinct().gino.all()
+    assert sorted(document for document, in snapshots) == horizons[1:]
+    assert await committed_balances() == {
+        passive_acc.id: Decimal('-3.00'),
+        active_acc.id: Decimal('3.00'),
+    }
@@ -1,8 +1,240 @@
+import asyncio
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+
 import typer
 
+import yaaccu.settings as config
+from yaaccu.db import db
+from yaaccu.models import Balance
+
 app = typer.Typer()
 
 
+@app.callback()
+def main():
+    """YAACCU management commands.
+    """
+
+
+async def _check_balances(full: bool):
+    async with db.with_bind(config.DB_DSN):
+        return await Balance.find_mismatches(full=full)
+
+
+@app.command()
+def check_balances(full: bool = typer.Option(False, help="Ignore balance snapshots")):
+    """Verify materialized balances against sums of the raw ledger.
+    """
+    mismatches = asyncio.run(_check_balances(full))
+    for account, currency, committed, pending, expected_committed, expected_pending in mismatches:
+        typer.echo(
+            "account %s currency %s: committed %s (expected %s), pending %s (expected %s)" % (
+                account, currency, committed, expected_committed, pending, expected_pending
+            )
+        )
+    if mismatches:
+        raise typer.Exit(code=1)
+    typer.echo("Balances are consistent with the ledger")
+
+
+async def _import_ledger(path: Path, fmt: str, chunk_size: int):
+    # pylint: disable=import-outside-toplevel
+    from yaaccu.importer import import_ledger, read_operations
+
+    def progress(stage: str, rows: int, seconds: float):
+        typer.echo("%s: %s rows (%.0f rows/s)" % (stage, rows, rows / seconds if seconds else 0),
+                   err=True)
+
+    async with db.with_bind(config.DB_DSN):
+        with path.open(newline='') as file:
+            return await import_ledger(read_operations(file, fmt), chunk_size, progress)
+
+
+@app.command('import')
+def import_ledger(
+        path: Path = typer.Argument(..., exists=True, dir_okay=False, help="CSV or NDJSON file"),
+        fmt: Optional[str] = typer.Option(
+            None, '--format', help="csv or ndjson (detected by the file extension by default)"
+        ),
+        chunk_size: int = typer.Option(
+            config.IMPORT_CHUNK_SIZE, help="Number of documents promoted at once"
+        ),
+):
+    """Import operations of an existing ledger as committed documents.
+
+    Rows hold document, account, currency, amount and optional created_at columns.
+    Nothing is imported if any document is invalid.
+    """
+    # pylint: disable=import-outside-toplevel
+    from yaaccu.importer import FORMATS, InvalidImport
+
+    fmt = fmt or ('csv' if path.suffix.lower() == '.csv' else 'ndjson')
+    if fmt not in FORMATS:
+        raise typer.BadParameter("Unknown format %s" % fmt)
+    try:
+        result = asyncio.run(_import_ledger(path, fmt, chunk_size))
+    except InvalidImport as e:
+        for error in e.errors:
+            typer.echo(error, err=True)
+        raise typer.Exit(code=1)
+    typer.echo("Imported %(documents)s documents (%(operations)s operations) "
+               "in %(seconds).1f seconds" % result)
+
+
+async def _export(report: str, fmt: str, commit: Optional[int],
+                  timestamp: Optional[datetime], output: BinaryIO):
+    # pylint: disable=import-outside-toplevel
+    from yaaccu.export import export
+
+    async with db.with_bind(config.DB_DSN):
+        async for chunk in export(report, fmt, commit, timestamp):
+            output.write(chunk)
+
+
+@app.command('export')
+def export_ledger(
+        report: str = typer.Option('ledger', help="ledger or trial-balance"),
+        fmt: str = typer.Option('ndjson', '--format', help="ndjson or csv"),
+        commit: Optional[int] = typer.Option(
+            None, help="Export as of the commit (commit_seq of documents)"
+        ),
+        timestamp: Optional[datetime] = typer.Option(
+            None, help="Export as of the latest commit of documents created before"
+        ),
+        output: Optional[Path] = typer.Option(None, help="Write to the file"),
+):
+    """Export committed documents and operations or the trial balance.
+
+    The export is consistent and doesn't block writers.
+    """
+    # pylint: disable=import-outside-toplevel
+    from yaaccu.export import FORMATS, REPORTS
+
+    if report not in REPORTS:
+        raise typer.BadParameter("Unknown report %s" % report)
+    if fmt not in FORMATS:
+        raise typer.BadParameter("Unknown format %s" % fmt)
+    if output is None:
+        asyncio.run(_export(report, fmt, commit, timestamp, sys.stdout.buffer))
+    else:
+        with output.open('wb') as file:
+            asyncio.run(_export(report, fmt, commit, timestamp, file))
+
+
+async def _audit(workers: Optional[int], chunk_size: int):
+    # pylint: disable=import-outside-toplevel
+    from yaaccu.audit import audit
+
+    async with db.with_bind(config.DB_DSN):
+        return await audit(workers, chunk_size)
+
+
+@app.command('audit')
+def audit_ledger(
+        workers: Optional[int] = typer.Option(
+            config.AUDIT_WORKERS, help="Number of processes (the number of CPUs by default)"
+        ),
+        chunk_size: int = typer.Option(
+            config.AUDIT_CHUNK_SIZE, help="Number of operations checked at once"
+        ),
+):
+    """Audit integrity of the whole ledger (requires numpy).
+
+    Checks committed documents are balanced, account types were never violated in
+    committed order and materialized balances match the ledger.
+    """
+    try:
+        report = asyncio.run(_audit(workers, chunk_size))
+    except ImportError as e:
+        typer.echo(str(e), err=True)
+        raise typer.Exit(code=1)
+    for document, currency, amount in report['unbalanced_documents']:
+        typer.echo("document %s currency %s: unbalanced by %s" % (document, currency, amount))
+    for account, currency, document, balance in report['invalid_balances']:
+        typer.echo("account %s currency %s: balance %s violates the account type "
+                   "at document %s" % (account, currency, balance, document))
+    for account, currency, committed, pending, expected_committed, expected_pending in \
+            report['mismatched_balances']:
+        typer.echo(
+            "account %s currency %s: committed %s (expected %s), pending %s (expected %s)" % (
+                account, currency, committed, expected_committed, pending, expected_pending
+            )
+        )
+    typer.echo("Audited %(documents)s documents (%(operations)s operations) "
+               "in %(seconds).1f seconds" % report, err=True)
+    if any(report[name] for name in (
+            'unbalanced_documents', 'invalid_balances', 'mismatched_balances'
+    )):
+        raise typer.Exit(code=1)
+    typer.echo("The ledger is consistent")
+
+
+async def _verify(full: bool):
+    # pylint: disable=import-outside-toplevel
+    from yaaccu.chain import verify
+
+    async with db.with_bind(config.DB_DSN):
+        return await verify(full)
+
+
+@app.command('verify')
+def verify_chain(full: bool = typer.Option(False, help="Verify since the first document")):
+    """Verify sealed documents against the hash chain and Merkle checkpoints.
+
+    Starts from the latest verified checkpoint unless `--full` is passed.
+    """
+    report = asyncio.run(_verify(full))
+    for document in report['invalid_documents']:
+        typer.echo("document %s doesn't match its hash" % document)
+    for document in report['invalid_checkpoints']:
+        typer.echo("checkpoint at document %s doesn't match sealed documents" % document)
+    typer.echo("Verified %(documents)s documents (%(checkpoints)s checkpoints) "
+               "in %(seconds).1f seconds" % report, err=True)
+    if report['invalid_documents'] or report['invalid_checkpoints']:
+        raise typer.Exit(code=1)
+    typer.echo("Sealed documents are consistent with the hash chain")
+
+
+@app.command()
+def bench(
+        ledger_size: List[int] = typer.Option(None, help="Number of seeded operations"),
+        contention: List[str] = typer.Option(None, help="Contention level: hot or uniform"),
+        concurrency: Optional[int] = typer.Option(None, help="Number of parallel clients"),
+        requests: Optional[int] = typer.Option(None, help="Number of requests per benchmark"),
+        output: Optional[Path] = typer.Option(None, help="Write results to the file"),
+):
+    """Run load tests of the api and the ledger and print results as json.
+
+    Benchmarks recreate the schema of the test database, so TESTING must be set.
+    """
+    if not config.TESTING:
+        typer.echo("Benchmarks recreate the database schema, set TESTING=true to use "
+                   "the test database", err=True)
+        raise typer.Exit(code=1)
+
+    # pylint: disable=import-outside-toplevel
+    from benchmarks import suite
+
+    for level in contention or ():
+        if level not in suite.CONTENTION:
+            raise typer.BadParameter("Unknown contention level %s" % level)
+    report = asyncio.run(suite.run(
+        ledger_sizes=ledger_size or suite.LEDGER_SIZES,
+        contention_levels=contention or suite.CONTENTION,
+        concurrency=concurrency or suite.CONCURRENCY,
+        requests=requests or suite.REQUESTS,
+    ))
+    result = json.dumps(report, indent=2)
+    if output is None:
+        typer.echo(result)
+    else:
+        output.write_text(result)
+
+
 def init():
     # hack to increase coverage :-)
     if __name__ == '__main__':
@@ -6,9 +6,34 @@ def create_app():
     new_app = FastAPI(title="YAACCU")
 
     from .views import router
+    from .signature import shutdown_executor
+    from .tasks import start_background_tasks, stop_background_tasks
+    from .lookup import load_currencies
+    from .metrics import MetricsMiddleware
+    from .replica import replicas
+    import yaaccu.settings as config
     from yaaccu.db import db
     new_app.include_router(router)
+
+    # registered before the db to stop tasks before the pool is closed
+    @new_app.on_event("shutdown")
+    async def shutdown():
+        await stop_background_tasks(new_app)
+        await replicas.close()
+        shutdown_executor()
+
     db.init_app(new_app)
+    # added last to measure the whole request including the db connection
+    new_app.add_middleware(
+        MetricsMiddleware, paths=[route.path for route in router.routes]
+    )
+
+    # registered after the db to start when the pool is ready
+    @new_app.on_event("startup")
+    async def startup():
+        await replicas.connect(config.DB_REPLICA_DSNS)
+        await load_currencies()
+        start_background_tasks(new_app)
 
     return new_app
 
@@ -0,0 +1,393 @@
+"""Vectorized integrity audit of the ledger.
+
+The audit checks the raw ledger at once:
+
+* every committed document sums to zero per currency;
+* no active account ever went negative and no passive account ever went positive
+  in committed order (documents are applied in the order of commit numbers, see
+  `yaaccu.models.Document.commit_seq`, documents committed together in the id order);
+* materialized balances (see `yaaccu.models.Balance`) match sums of operations.
+
+Operations are streamed from the database using ``COPY ... (FORMAT binary)`` of bigint
+columns (amounts are scaled to integers), so chunks of rows are read into NumPy
+arrays without decoding fields one by one, and checked in vectorized passes.
+
+The work is split between processes: each of them checks accounts and documents with
+``id % workers`` equal to its number. All processes read the same snapshot exported by
+the parent, so the audit is consistent while the api is writing.
+
+NumPy is an optional dependency required by the audit only.
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import yaaccu.settings as config
+from yaaccu.db import db
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+#: amounts are audited as integers of 1/SCALE units (the scale of amounts is 4)
+SCALE = 10000
+
+#: account types by their codes in the audit queries
+NORMAL, ACTIVE, PASSIVE = 0, 1, 2
+
+_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+_HEADER_SIZE = len(_SIGNATURE) + 8
+_TRAILER = b'\xff\xff'
+
+_UNCOMMITTED_QUERY = "SELECT id FROM documents WHERE committed IS NOT TRUE ORDER BY id"
+_ACCOUNTS_QUERY = """
+SELECT id, (CASE type WHEN 'active' THEN %d WHEN 'passive' THEN %d ELSE %d END)::bigint
+FROM accounts WHERE id %% $1 = $2 ORDER BY id
+""" % (ACTIVE, PASSIVE, NORMAL)
+_ACCOUNT_OPERATIONS_QUERY = """
+SELECT account, coalesce(currency, 0), document, (coalesce(amount, 0) * %d)::bigint
+FROM operations JOIN documents ON documents.id = operations.document
+WHERE account %% $1 = $2 ORDER BY account, currency, commit_seq, document, operations.id
+""" % SCALE
+_DOCUMENT_OPERATIONS_QUERY = """
+SELECT document, coalesce(currency, 0), (coalesce(amount, 0) * %d)::bigint
+FROM operations WHERE document %% $1 = $2 ORDER BY document, currency
+""" % SCALE
+_BALANCES_QUERY = """
+SELECT account, currency, (committed * %d)::bigint, (pending * %d)::bigint
+FROM balances WHERE account %% $1 = $2 ORDER BY account, currency
+""" % (SCALE, SCALE)
+
+
+def _amount(value) -> Decimal:
+    return Decimal(int(value)).scaleb(-4)
+
+
+def _starts(*keys):
+    """Mask of rows starting a new group of equal keys (rows are ordered by keys).
+    """
+    starts = np.zeros(len(keys[0]), dtype=bool)
+    starts[:1] = True
+    for key in keys:
+        starts[1:] |= key[1:] != key[:-1]
+    return starts
+
+
+class CopyReader:
+    """Incremental reader of ``COPY ... TO STDOUT (FORMAT binary)`` output.
+
+    All columns must be not null bigints, so rows have the same size and are read
+    into arrays at once. `callback` is called with arrays of columns of every
+    `chunk_size` rows.
+    """
+
+    def __init__(self, columns: int, chunk_size: int, callback: Callable):
+        self.dtype = np.dtype([('fields', '>i2')] + [
+            item for n in range(columns) for item in (('size%d' % n, '>i4'), ('c%d' % n, '>i8'))
+        ])
+        self.columns = columns
+        self.chunk_bytes = chunk_size * self.dtype.itemsize
+        self.callback = callback
+        self.buffer = bytearray()
+        self.header = False
+
+    async def write(self, data: bytes):
+        self.buffer += data
+        if not self.header:
+            if len(self.buffer) < _HEADER_SIZE:
+                return
+            if self.buffer[:len(_SIGNATURE)] != _SIGNATURE:
+                raise ValueError("Unexpected COPY format")
+            extension = int.from_bytes(self.buffer[_HEADER_SIZE - 4:_HEADER_SIZE], 'big')
+            if len(self.buffer) < _HEADER_SIZE + extension:
+                return
+            del self.buffer[:_HEADER_SIZE + extension]
+            self.header = True
+        if len(self.buffer) >= self.chunk_bytes:
+            self._read(len(self.buffer) // self.dtype.itemsize)
+
+    def close(self):
+        rows = len(self.buffer) // self.dtype.itemsize
+        if rows:
+            self._read(rows)
+        if bytes(self.buffer) != _TRAILER:
+            raise ValueError("Unexpected end of COPY data")
+
+    def _read(self, rows: int):
+        size = rows * self.dtype.itemsize
+        data = np.frombuffer(bytes(self.buffer[:size]), dtype=self.dtype)
+        del self.buffer[:size]
+        if (data['fields'] != self.columns).any():
+            raise ValueError("Unexpected number of COPY fields")
+        self.callback(*(data['c%d' % n].astype(np.int64) for n in range(self.columns)))
+
+
+class AccountAudit:
+    """Running balances of accounts in committed order.
+
+    Rows are ordered by account, currency and commit, so running balances are
+    cumulative sums within groups of the same account and currency. The balance of
+    the last group of a chunk is carried over to the next chunk.
+    """
+
+    def __init__(self, account_types, uncommitted, limit: int):
+        self.type_ids, self.type_codes = account_types
+        self.uncommitted = uncommitted
+        self.limit = limit
+        self.operations = 0
+        #: invalid balances: (account, currency, document, balance)
+        self.invalid: List[Tuple] = []
+        self._reported: Set[Tuple[int, int]] = set()
+        #: committed balances of (account, currency) as chunks of arrays
+        self.balances: List[Tuple] = []
+        self.pending: Dict[Tuple[int, int], int] = defaultdict(int)
+        self._key: Optional[Tuple[int, int]] = None
+        self._balance = 0
+
+    def _types(self, account):
+        if not len(self.type_ids):
+            return np.full(len(account), NORMAL)
+        index = np.minimum(np.searchsorted(self.type_ids, account), len(self.type_ids) - 1)
+        return np.where(self.type_ids[index] == account, self.type_codes[index], NORMAL)
+
+    def feed(self, account, currency, document, amount):
+        self.operations += len(amount)
+        pending = np.isin(document, self.uncommitted)
+        if pending.any():
+            for key in zip(account[pending], currency[pending], amount[pending]):
+                self.pending[(int(key[0]), int(key[1]))] += int(key[2])
+            committed = ~pending
+            account, currency = account[committed], currency[committed]
+            document, amount = document[committed], amount[committed]
+        if not len(amount):
+            return
+
+        starts = _starts(account, currency)
+        first = np.flatnonzero(starts)
+        group = np.cumsum(starts) - 1
+        totals = np.cumsum(amount)
+        before = totals[first] - amount[first]
+        if self._key == (account[0], currency[0]):
+            before[0] -= self._balance
+        else:
+            self.close()
+        balance = totals - before[group]
+
+        types = self._types(account)
+        invalid = np.flatnonzero(
+            ((types == ACTIVE) & (balance < 0)) | ((types == PASSIVE) & (balance > 0))
+        )
+        if len(invalid):
+            # the first violation of every group
+            _, index = np.unique(group[invalid], return_index=True)
+            for row in invalid[index]:
+                key = (int(account[row]), int(currency[row]))
+                if key not in self._reported and len(self.invalid) < self.limit:
+                    self._reported.add(key)
+                    self.invalid.append(key + (int(document[row]), _amount(balance[row])))
+
+        # the last group may continue in the next chunk
+        last = np.append(first[1:], len(amount)) - 1
+        self.balances.append((account[last[:-1]], currency[last[:-1]], balance[last[:-1]]))
+        self._key = (int(account[-1]), int(currency[-1]))
+        self._balance = int(balance[-1])
+
+    def close(self):
+        if self._key is not None:
+            self.balances.append((np.array([self._key[0]]), np.array([self._key[1]]),
+                                  np.array([self._balance])))
+            self._key = None
+
+    def mismatches(self, materialized) -> List[Tuple]:
+        """Compare materialized balances with audited ones.
+
+        :param materialized: arrays of account, currency, committed and pending
+        :return: list of (account, currency, committed, pending, expected committed,
+            expected pending)
+        """
+        self.close()
+        pending = list(self.pending.items())
+        empty = np.zeros(0, dtype=np.int64)
+        parts = [
+            # account, currency, expected committed, expected pending, committed, pending
+            (account, currency, balance, empty, empty, empty)
+            for account, currency, balance in self.balances
+        ] + [(
+            np.array([key[0] for key, _ in pending], dtype=np.int64),
+            np.array([key[1] for key, _ in pending], dtype=np.int64),
+            empty, np.array([value for _, value in pending], dtype=np.int64), empty, empty,
+        ), (
+            materialized[0], materialized[1], empty, empty, materialized[2], materialized[3],
+        )]
+        account = np.concatenate([part[0] for part in parts])
+        if not len(account):
+            return []
+        currency = np.concatenate([part[1] for part in parts])
+        values = np.zeros((4, len(account)), dtype=np.int64)
+        offset = 0
+        for part in parts:
+            size = len(part[0])
+            for n in range(4):
+                if len(part[n + 2]):
+                    values[n, offset:offset + size] = part[n + 2]
+            offset += size
+
+        order = np.lexsort((currency, account))
+        account, currency, values = account[order], currency[order], values[:, order]
+        first = np.flatnonzero(_starts(account, currency))
+        sums = np.add.reduceat(values, first, axis=1)
+        rows = np.flatnonzero((sums[0] != sums[2]) | (sums[1] != sums[3]))[:self.limit]
+        return [(
+            int(account[first[row]]), int(currency[first[row]]),
+            _amount(sums[2, row]), _amount(sums[3, row]),
+            _amount(sums[0, row]), _amount(sums[1, row]),
+        ) for row in rows]
+
+
+class DocumentAudit:
+    """Sums of committed documents per currency.
+
+    Rows are ordered by document and currency. The sum of the last group of a chunk
+    is carried over to the next chunk.
+    """
+
+    def __init__(self, uncommitted, limit: int):
+        self.uncommitted = uncommitted
+        self.limit = limit
+        self.documents = 0
+        #: unbalanced documents: (document, currency, sum)
+        self.unbalanced: List[Tuple] = []
+        self._key: Optional[Tuple[int, int]] = None
+        self._sum = 0
+
+    def _report(self, document, currency, amount):
+        if len(self.unbalanced) < self.limit:
+            self.unbalanced.append((int(document), int(currency), _amount(amount)))
+
+    def feed(self, document, currency, amount):
+        committed = ~np.isin(document, self.uncommitted)
+        document, currency, amount = document[committed], currency[committed], amount[committed]
+        if not len(amount):
+            return
+
+        documents = _starts(document)
+        if self._key is not None and self._key[0] == document[0]:
+            documents[0] = False
+        self.documents += int(np.count_nonzero(documents))
+
+        first = np.flatnonzero(_starts(document, currency))
+        sums = np.add.reduceat(amount, first)
+        if self._key == (document[0], currency[0]):
+            sums[0] += self._sum
+        elif self._key is not None and self._sum:
+            self._report(self._key[0], self._key[1], self._sum)
+        # the last group may continue in the next chunk
+        for row in np.flatnonzero(sums[:-1])[:self.limit]:
+            self._report(document[first[row]], currency[first[row]], sums[row])
+        self._key = (int(document[-1]), int(currency[-1]))
+        self._sum = int(sums[-1])
+
+    def close(self):
+        if self._key is not None and self._sum:
+            self._report(self._key[0], self._key[1], self._sum)
+        self._key = None
+
+
+async def _copy(connection, query: str, columns: int, chunk_size: int, callback, *args):
+    reader = CopyReader(columns, chunk_size, callback)
+    await connection.copy_from_query(query, *args, output=reader.write, format='binary')
+    reader.close()
+
+
+async def _read_arrays(connection, query: str, columns: int, chunk_size: int, *args):
+    chunks: List = []
+    await _copy(connection, query, columns, chunk_size, lambda *arrays: chunks.append(arrays),
+                *args)
+    return [
+        np.concatenate([chunk[n] for chunk in chunks]) if chunks else np.zeros(0, np.int64)
+        for n in range(columns)
+    ]
+
+
+async def _audit_partition(snapshot: str, partition: int, partitions: int,
+                           chunk_size: int, limit: int):
+    async with db.with_bind(config.DB_DSN, min_size=1, max_size=1):
+        async with db.transaction(isolation='repeatable_read', readonly=True) as tx:
+            connection = tx.connection.raw_connection
+            await connection.execute("SET TRANSACTION SNAPSHOT '%s'" % snapshot)
+            uncommitted = np.array([
+                row[0] for row in await connection.fetch(_UNCOMMITTED_QUERY)
+            ], dtype=np.int64)
+
+            documents = DocumentAudit(uncommitted, limit)
+            await _copy(connection, _DOCUMENT_OPERATIONS_QUERY, 3, chunk_size, documents.feed,
+                        partitions, partition)
+            documents.close()
+
+            account_types = await _read_arrays(connection, _ACCOUNTS_QUERY, 2, chunk_size,
+                                               partitions, partition)
+            accounts = AccountAudit(account_types, uncommitted, limit)
+            await _copy(connection, _ACCOUNT_OPERATIONS_QUERY, 4, chunk_size, accounts.feed,
+                        partitions, partition)
+            materialized = await _read_arrays(connection, _BALANCES_QUERY, 4, chunk_size,
+                                              partitions, partition)
+            return {
+                'operations': accounts.operations,
+                'documents': documents.documents,
+                'unbalanced_documents': documents.unbalanced,
+                'invalid_balances': accounts.invalid,
+                'mismatched_balances': accounts.mismatches(materialized),
+            }
+
+
+def audit_partition(snapshot: str, partition: int, partitions: int,
+                    chunk_size: int, limit: int):
+    """Audit accounts and documents with ``id % partitions == partition``.
+
+    Executed in worker processes.
+    """
+    return asyncio.run(_audit_partition(snapshot, partition, partitions, chunk_size, limit))
+
+
+async def audit(workers: Optional[int] = config.AUDIT_WORKERS,
+                chunk_size: int = config.AUDIT_CHUNK_SIZE,
+                limit: int = config.AUDIT_REPORT_LIMIT):
+    """Audit the ledger using `workers` processes.
+
+    :param workers: number of processes, the number of CPUs by default
+    :param chunk_size: number of rows checked at once
+    :param limit: max number of reported issues of every kind per process
+    :return: numbers of audited documents and operations, issues and elapsed seconds
+    """
+    if np is None:
+        raise ImportError("The audit requires numpy, install it with `pip install numpy`")
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    loop = asyncio.get_event_loop()
+    async with db.transaction(isolation='repeatable_read', readonly=True) as tx:
+        # workers read the snapshot of this transaction, so it must be open till the end
+        snapshot = await tx.connection.scalar('SELECT pg_export_snapshot()')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results: Sequence[Dict] = await asyncio.gather(*[loop.run_in_executor(
+                executor, audit_partition, snapshot, partition, workers, chunk_size, limit
+            ) for partition in range(workers)])
+
+    report: Dict = {
+        'documents': 0,
+        'operations': 0,
+        'unbalanced_documents': [],
+        'invalid_balances': [],
+        'mismatched_balances': [],
+    }
+    for result in results:
+        for name, value in result.items():
+            report[name] += value
+    for name in ('unbalanced_documents', 'invalid_balances', 'mismatched_balances'):
+        report[name].sort()
+    report['seconds'] = time.perf_counter() - started
+    return report
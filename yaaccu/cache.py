@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+#: all caches created by the application by name
+caches: Dict[str, 'LRUCache'] = {}
+
+
+class LRUCache:
+    """Bounded in-process cache evicting least recently used entries.
+
+    Entries expire after `ttl` seconds (if set) or at the explicitly provided time.
+    Hits and misses are counted to be exposed as cache statistics. The cache is
+    thread-safe, so it may be used from executor threads as well.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value, expires_at: Optional[float] = None):
+        """Put value into the cache.
+
+        :param expires_at: unix timestamp the entry expires at, `ttl` is used by default
+        """
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def cache_stats():
+    """Statistics of all application caches by name.
+    """
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+def clear_caches():
+    for cache in caches.values():
+        cache.clear()
@@ -0,0 +1,360 @@
+"""Tamper-evident log of committed documents.
+
+Committed documents are sealed in id order once they are behind the horizon of the
+latest balance snapshot, so they can't be committed or aborted anymore (see
+`yaaccu.models.BalanceSnapshot`). The hash of a sealed document is the SHA3-256 hash of
+the hash of the previous sealed document and the canonical content of the document
+(see `document_content`), so any change of sealed documents or their operations breaks
+the chain.
+
+Hashes of sealed documents are leaves of a Merkle tree (hashed as in RFC 6962) and
+every seal writes a checkpoint holding the root of the tree and the hash of the last
+sealed document:
+
+* verification is incremental: documents are rehashed starting from the latest
+  verified checkpoint (see `verify`);
+* inclusion of a document into the latest checkpoint is proven by O(log n) hashes
+  of the tree (see `inclusion_proof`), so clients keeping checkpoint roots detect
+  rewrites of the history.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, text, tuple_
+
+import yaaccu.settings as config
+from yaaccu.db import db
+from yaaccu.models import BalanceSnapshot, Document, HashCheckpoint, MerkleNode, Operation
+from yaaccu.signature import content_hash
+
+log = logging.getLogger(__name__)
+
+#: advisory lock serializing sealing of several processes
+SEAL_LOCK = 0x79616873
+#: hash preceding the first sealed document
+GENESIS = bytes(32)
+
+Node = Tuple[int, int]
+
+
+def document_content(document: int, created_at: Optional[datetime], signature: Optional[str],
+                     operations) -> bytes:
+    """Canonical content of the document hashed into the chain.
+
+    :param signature: client signature of the document
+    :param operations: (id, account, currency, amount) of the operations ordered by id
+    """
+    lines = ['%s|%s|%s' % (
+        document, created_at.isoformat() if created_at else '', signature or ''
+    )]
+    lines += ['%s|%s|%s|%s' % operation for operation in operations]
+    return '\n'.join(lines).encode()
+
+
+def chain_hash(previous: bytes, content: bytes) -> bytes:
+    return content_hash(previous + content)
+
+
+def leaf_hash(document_hash: bytes) -> bytes:
+    return content_hash(b'\x00' + document_hash)
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return content_hash(b'\x01' + left + right)
+
+
+def fold(hashes: List[bytes]) -> bytes:
+    """Root of the tree made of complete subtrees (largest first).
+    """
+    if not hashes:
+        return content_hash(b'')
+    result = hashes[-1]
+    for left in reversed(hashes[:-1]):
+        result = node_hash(left, result)
+    return result
+
+
+def decompose(start: int, size: int) -> List[Node]:
+    """Complete subtrees, as (level, position), of leaves from `start` (largest first).
+    """
+    nodes = []
+    for level in reversed(range(size.bit_length())):
+        if size & (1 << level):
+            nodes.append((level, start >> level))
+            start += 1 << level
+    return nodes
+
+
+def audit_path(index: int, size: int, start: int = 0) -> List[List[Node]]:
+    """Siblings of the leaf from the bottom up (RFC 6962 audit path).
+
+    Every sibling is returned as complete subtrees it is made of (see `decompose`).
+    """
+    if size <= 1:
+        return []
+    split = 1 << ((size - 1).bit_length() - 1)
+    if index < split:
+        return audit_path(index, split, start) + [decompose(start + split, size - split)]
+    return audit_path(index - split, size - split, start + split) + [decompose(start, split)]
+
+
+def verify_inclusion(leaf: bytes, index: int, size: int, path: List[bytes], root: bytes) -> bool:
+    """Check the audit path of the leaf against the root (RFC 9162 2.1.3.2).
+    """
+    if index >= size:
+        return False
+    fn, sn, result = index, size - 1, leaf
+    for sibling in path:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            result = node_hash(sibling, result)
+            while not fn & 1 and fn:
+                fn, sn = fn >> 1, sn >> 1
+        else:
+            result = node_hash(result, sibling)
+        fn, sn = fn >> 1, sn >> 1
+    return sn == 0 and result == root
+
+
+class Frontier:
+    """Complete subtrees the Merkle tree of sealed documents is made of.
+
+    Appending a leaf merges subtrees of the same size, so the tree is extended
+    without reading it.
+    """
+
+    def __init__(self, size: int = 0, hashes: Iterable[bytes] = ()):
+        self.size = size
+        self.nodes = [
+            (level, position, node) for (level, position), node in zip(decompose(0, size), hashes)
+        ]
+
+    def append(self, document: int,
+               document_hash: bytes) -> List[Tuple[int, int, bytes, Optional[int]]]:
+        """Append the leaf of the document.
+
+        :return: created nodes as (level, position, hash, document) tuples, the document
+            is None for inner nodes
+        """
+        level, position, node = 0, self.size, leaf_hash(document_hash)
+        created: List[Tuple[int, int, bytes, Optional[int]]] = [(level, position, node, document)]
+        while self.nodes and self.nodes[-1][0] == level:
+            _, _, left = self.nodes.pop()
+            level, position, node = level + 1, position >> 1, node_hash(left, node)
+            created.append((level, position, node, None))
+        self.nodes.append((level, position, node))
+        self.size += 1
+        return created
+
+    def root(self) -> bytes:
+        return fold([node for _, _, node in self.nodes])
+
+
+async def _load_nodes(nodes: Iterable[Node]) -> Dict[Node, bytes]:
+    nodes = list(nodes)
+    if not nodes:
+        return {}
+    rows = await db.select([MerkleNode.level, MerkleNode.position, MerkleNode.hash]).where(
+        tuple_(MerkleNode.level, MerkleNode.position).in_(nodes)
+    ).gino.all()
+    return {(level, position): node for level, position, node in rows}
+
+
+async def _frontier(size: int) -> Frontier:
+    nodes = decompose(0, size)
+    stored = await _load_nodes(nodes)
+    return Frontier(size, [stored.get(node, b'') for node in nodes])
+
+
+async def _documents(after: int, until: int, limit: int):
+    """Committed or sealed documents with ids in (after, until] ordered by id.
+
+    :return: list of (id, committed, hash, content) tuples
+    """
+    documents = await db.select([
+        Document.id, Document.created_at, Document.signature, Document.committed, Document.hash,
+    ]).where(and_(
+        Document.id > after,
+        Document.id <= until,
+        or_(Document.committed.is_(True), Document.hash.isnot(None)),
+    )).order_by(Document.id).limit(limit).gino.all()
+    if not documents:
+        return []
+    operations: Dict[int, List] = {}
+    for document, *operation in await db.select([
+            Operation.document, Operation.id, Operation.account, Operation.currency,
+            Operation.amount,
+    ]).where(and_(
+        Operation.document > after,
+        Operation.document <= documents[-1].id,
+    )).order_by(Operation.document, Operation.id).gino.all():
+        operations.setdefault(document, []).append(tuple(operation))
+    return [(
+        document.id, bool(document.committed), document.hash,
+        document_content(document.id, document.created_at, document.signature,
+                         operations.get(document.id, ())),
+    ) for document in documents]
+
+
+async def latest_checkpoint() -> Optional[HashCheckpoint]:
+    return await HashCheckpoint.query.order_by(HashCheckpoint.document.desc()).gino.first()
+
+
+async def seal(batch_size: int = config.HASH_SEAL_BATCH_SIZE) -> Optional[HashCheckpoint]:
+    """Seal up to `batch_size` committed documents behind the snapshot horizon.
+
+    :return: the new checkpoint or None if there was nothing to seal
+    """
+    async with db.transaction() as tx:
+        if not await db.scalar(db.select([db.func.pg_try_advisory_xact_lock(SEAL_LOCK)])):
+            # sealed by another process
+            return None
+        latest = await latest_checkpoint()
+        after, previous = (latest.document, latest.hash) if latest else (0, GENESIS)
+        horizon = await db.scalar(db.select([BalanceSnapshot.horizon()]))
+        documents = [
+            (document, content) for document, committed, _, content
+            in await _documents(after, horizon, batch_size) if committed
+        ]
+        if not documents:
+            return None
+
+        frontier = await _frontier(latest.size if latest else 0)
+        hashes, nodes = [], []
+        for document, content in documents:
+            previous = chain_hash(previous, content)
+            hashes.append(previous)
+            nodes += frontier.append(document, previous)
+
+        ids = [document for document, _ in documents]
+        await db.status(text(
+            "UPDATE documents SET hash = sealed.hash "
+            "FROM unnest(CAST(:ids AS bigint[]), CAST(:hashes AS bytea[])) AS sealed(id, hash) "
+            "WHERE documents.id = sealed.id AND documents.id BETWEEN :first AND :last"
+        ), ids=ids, hashes=hashes, first=ids[0], last=ids[-1])
+        connection = await tx.connection.get_raw_connection()
+        await connection.copy_records_to_table(
+            MerkleNode.__tablename__,
+            records=nodes,
+            columns=('level', 'position', 'hash', 'document'),
+        )
+        checkpoint = await HashCheckpoint.create(
+            document=ids[-1], size=frontier.size, root=frontier.root(), hash=previous,
+        )
+    log.info("Sealed %s documents up to document %s", len(ids), checkpoint.document)
+    return checkpoint
+
+
+async def verify(full: bool = False, batch_size: int = config.HASH_SEAL_BATCH_SIZE) -> Dict:
+    """Verify sealed documents against their hashes and checkpoints.
+
+    Every sealed document must match its hash made of the hash of the previous one,
+    and the tree of sealed documents must match checkpoints. Documents are rehashed
+    starting from the latest verified checkpoint (since the genesis if `full`), and
+    checkpoints passed are marked as verified unless there were issues.
+
+    :return: numbers of verified documents and checkpoints, ids of invalid documents and
+        invalid checkpoints (their last documents)
+    """
+    started = time.perf_counter()
+    report: Dict = {
+        'documents': 0,
+        'checkpoints': 0,
+        'invalid_documents': [],
+        'invalid_checkpoints': [],
+    }
+    start = None
+    if not full:
+        start = await HashCheckpoint.query.where(HashCheckpoint.verified_at.isnot(None)).order_by(
+            HashCheckpoint.document.desc()
+        ).gino.first()
+    if start is None:
+        after, previous, frontier = 0, GENESIS, Frontier()
+    else:
+        after, previous, frontier = start.document, start.hash, await _frontier(start.size)
+        if frontier.root() != start.root:
+            # the tree was changed after the checkpoint was verified
+            report['invalid_checkpoints'].append(start.document)
+
+    for checkpoint in await HashCheckpoint.query.where(HashCheckpoint.document > after).order_by(
+            HashCheckpoint.document
+    ).gino.all():
+        valid = True
+        while after < checkpoint.document:
+            documents = await _documents(after, checkpoint.document, batch_size)
+            if not documents:
+                break
+            nodes = []
+            for document, committed, stored, content in documents:
+                if not committed or stored is None or chain_hash(previous, content) != stored:
+                    report['invalid_documents'].append(document)
+                    valid = False
+                if stored is None:
+                    stored = chain_hash(previous, content)
+                # the next document is checked against the stored hash
+                previous = stored
+                nodes += frontier.append(document, stored)
+            stored_nodes = await _load_nodes((level, position) for level, position, _, _ in nodes)
+            if any(stored_nodes.get((level, position)) != node
+                   for level, position, node, _ in nodes):
+                valid = False
+            report['documents'] += len(documents)
+            after = documents[-1][0]
+
+        if (frontier.size, frontier.root(), previous) != (
+                checkpoint.size, checkpoint.root, checkpoint.hash
+        ):
+            valid = False
+        if not valid:
+            report['invalid_checkpoints'].append(checkpoint.document)
+        elif not report['invalid_checkpoints'] and not report['invalid_documents']:
+            await checkpoint.update(verified_at=datetime.utcnow()).apply()
+        report['checkpoints'] += 1
+    report['seconds'] = time.perf_counter() - started
+    return report
+
+
+async def inclusion_proof(document: int) -> Optional[Dict]:
+    """Prove inclusion of the sealed document into the latest checkpoint.
+
+    The proof holds the content and the hash of the document along with the hash of
+    the previous one, so the hash can be recomputed, and the audit path of its leaf.
+
+    :return: None if the document is not sealed yet (or there is no checkpoint)
+    """
+    leaf = await MerkleNode.query.where(and_(
+        MerkleNode.level == 0, MerkleNode.document == document
+    )).gino.first()
+    if leaf is None:
+        return None
+    checkpoint = await latest_checkpoint()
+    if checkpoint is None:
+        return None
+    path = audit_path(leaf.position, checkpoint.size)
+    nodes = await _load_nodes(node for sibling in path for node in sibling)
+
+    previous = GENESIS
+    if leaf.position:
+        previous = await db.select([Document.hash]).select_from(
+            MerkleNode.join(Document, Document.id == MerkleNode.document)
+        ).where(and_(
+            MerkleNode.level == 0, MerkleNode.position == leaf.position - 1
+        )).gino.scalar()
+    documents = await _documents(document - 1, document, 1)
+    if not documents:
+        return None
+    [(_, _, document_hash, content)] = documents
+    return {
+        'document': document,
+        'content': content.decode(),
+        'previous': previous.hex(),
+        'hash': document_hash.hex(),
+        'index': leaf.position,
+        'checkpoint': checkpoint.document,
+        'size': checkpoint.size,
+        'root': checkpoint.root.hex(),
+        'path': [fold([nodes[node] for node in sibling]).hex() for sibling in path],
+    }
@@ -1,6 +1,84 @@
+import time
+
+from asyncpg.connection import Connection
+from gino.dialects.asyncpg import AsyncpgDialect, DBAPICursor, Pool
 from gino.ext.starlette import Gino  # noqa  # pylint: disable=no-name-in-module,import-error
+from sqlalchemy.dialects import registry
 
 import yaaccu.settings as config
+from yaaccu.metrics import measure, pools, record
+
+
+def _record_query(query):
+    record('db', query.elapsed)
+
+
+class InstrumentedCursor(DBAPICursor):
+    """Cursor measuring queries executed by gino as the `db` phase (see `yaaccu.metrics`).
+    """
+
+    async def async_execute(self, query, timeout, args, limit=0, many=False):
+        with measure('db'):
+            return await super().async_execute(query, timeout, args, limit, many)
+
+    async def prepare(self, context, clause=None):
+        with measure('db'):
+            return await super().prepare(context, clause)
+
+
+class InstrumentedDialect(AsyncpgDialect):  # pylint: disable=abstract-method
+    cursor_cls = InstrumentedCursor
+
+
+# gino engines are created for `postgresql+asyncpg` urls
+registry.register('postgresql.asyncpg', __name__, 'InstrumentedDialect')
+
+
+class InstrumentedConnection(Connection):
+    """Connection measuring queries made using asyncpg directly as the `db` phase.
+
+    Queries of gino don't reach asyncpg query loggers, they are measured by
+    `InstrumentedCursor`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.add_query_logger(_record_query)
+
+    async def copy_records_to_table(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        with measure('db'):
+            return await super().copy_records_to_table(*args, **kwargs)
+
+
+class InstrumentedPool(Pool):
+    """Pool recording its saturation: acquired connections, waiters and wait time.
+
+    Time spent waiting for connections is measured as the `pool` phase as well.
+    """
+
+    def __init__(self, url, loop, **kwargs):
+        super().__init__(url, loop, **kwargs)
+        self.stats = pools['%s:%s/%s' % (url.host, url.port or 5432, url.database)]
+        self.stats.max_size = kwargs.get('max_size', 0)
+
+    async def acquire(self, *, timeout=None):
+        self.stats.waiting += 1
+        started = time.perf_counter()
+        try:
+            with measure('pool'):
+                conn = await super().acquire(timeout=timeout)
+        finally:
+            self.stats.waiting -= 1
+            self.stats.wait.observe(time.perf_counter() - started)
+        self.stats.in_use += 1
+        return conn
+
+    async def release(self, conn):
+        try:
+            await super().release(conn)
+        finally:
+            self.stats.in_use -= 1
+
 
 db = Gino(
     dsn=config.DB_DSN,
@@ -11,4 +89,9 @@ db = Gino(
     use_connection_for_request=config.DB_USE_CONNECTION_FOR_REQUEST,
     retry_limit=config.DB_RETRY_LIMIT,
     retry_interval=config.DB_RETRY_INTERVAL,
+    kwargs=dict(
+        connection_class=InstrumentedConnection,
+        pool_class=InstrumentedPool,
+        statement_cache_size=config.DB_STATEMENT_CACHE_SIZE,
+    ),
 )
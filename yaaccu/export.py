@@ -0,0 +1,117 @@
+"""Streaming export of the ledger.
+
+Reports are read in a single `REPEATABLE READ` read-only transaction, so they are
+consistent even when made of several queries, and don't block writers. Rows are
+fetched from a server-side cursor by `EXPORT_CHUNK_SIZE`, so memory usage doesn't
+depend on the size of the ledger.
+
+* ``ledger`` - committed operations along with their documents ordered by document;
+* ``trial-balance`` - committed balances per account and currency.
+
+Both reports may be made as of a commit (`Document.commit_seq`, documents commit out
+of the order of their ids) or a timestamp (the latest commit of documents created
+before it).
+"""
+import csv
+import io
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+import orjson
+
+import yaaccu.settings as config
+from yaaccu.db import db
+from yaaccu.models import Account, Balance, BalanceSnapshot, Currency, Document, Operation
+
+REPORTS = ('ledger', 'trial-balance')
+FORMATS = ('ndjson', 'csv')
+MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def ledger_query(as_of: Optional[int] = None):
+    query = db.select([
+        Operation.document,
+        Document.commit_seq,
+        Document.created_at,
+        Operation.id.label('operation'),
+        Account.address.label('account'),
+        Currency.symbol.label('currency'),
+        Operation.amount,
+    ]).select_from(
+        Operation.join(Document).join(Account).join(Currency)
+    ).where(Document.committed.is_(True)).order_by(Operation.document, Operation.id)
+    if as_of is not None:
+        query = query.where(Document.commit_seq <= as_of)
+    return query
+
+
+def trial_balance_query(as_of: Optional[int] = None):
+    if as_of is None:
+        # materialized balances are up to date
+        balances = db.select([
+            Balance.account, Balance.currency, Balance.committed.label('balance')
+        ]).alias('committed_balances')
+    else:
+        balances = BalanceSnapshot.committed_balances(as_of_commit=as_of)
+    return db.select([
+        Account.address.label('account'),
+        Currency.symbol.label('currency'),
+        balances.c.balance,
+    ]).select_from(
+        balances.join(Account, Account.id == balances.c.account).join(
+            Currency, Currency.id == balances.c.currency
+        )
+    ).order_by(Account.address, Currency.symbol)
+
+
+def _encode(rows, fmt: str) -> bytes:
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+    return b''.join(orjson.dumps(dict(row), default=str) + b'\n' for row in rows)
+
+
+async def stream_rows(query, fmt: str = 'ndjson', bind=db,
+                      chunk_size: int = config.EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Stream rows of the query as json lines or csv using a server-side cursor.
+    """
+    async with bind.transaction(isolation='repeatable_read', readonly=True) as tx:
+        async for chunk in _fetch(tx.connection, query, fmt, chunk_size):
+            yield chunk
+
+
+async def _fetch(connection, query, fmt: str, chunk_size: int) -> AsyncIterator[bytes]:
+    if fmt == 'csv':
+        yield _encode([[column.name for column in query.columns]], fmt)
+    cursor = await connection.iterate(query)
+    while True:
+        rows = await cursor.many(chunk_size)
+        if not rows:
+            break
+        yield _encode(rows, fmt)
+
+
+async def export(report: str,
+                 fmt: str = 'ndjson',
+                 commit: Optional[int] = None,
+                 timestamp: Optional[datetime] = None,
+                 bind=db) -> AsyncIterator[bytes]:
+    """Stream the report (see `REPORTS`) in the given format.
+
+    :param commit: make the report as of the commit (`Document.commit_seq`, including)
+    :param timestamp: make the report as of the latest commit of documents created before
+    """
+    if timestamp is not None and timestamp.tzinfo is not None:
+        # created_at is naive UTC
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    async with bind.transaction(isolation='repeatable_read', readonly=True) as tx:
+        as_of = commit
+        if timestamp is not None:
+            latest = await tx.connection.scalar(db.select([
+                db.func.coalesce(db.func.max(Document.commit_seq), 0)
+            ]).where(Document.created_at <= timestamp))
+            as_of = latest if as_of is None else min(as_of, latest)
+        query = ledger_query(as_of) if report == 'ledger' else trial_balance_query(as_of)
+        async for chunk in _fetch(tx.connection, query, fmt, config.EXPORT_CHUNK_SIZE):
+            yield chunk
@@ -0,0 +1,271 @@
+"""Bulk import of existing ledgers.
+
+Ledgers are imported from CSV or NDJSON files of operations. Every row holds the
+`document` key (any string identifying the document within the file), `account`
+address, `currency` symbol, `amount` and optionally `created_at` of the document
+(ISO 8601). CSV files must have a header row.
+
+Importing documents one by one using `Document.create_transfer` would validate each of
+them separately, so rows are copied into temporary staging tables using COPY instead,
+validated with a few set-based queries and promoted as committed documents in chunks:
+
+* every document must be balanced in every currency;
+* accounts and currencies must exist;
+* final balances (existing committed balances plus imported operations) must not
+  violate account types.
+
+Intermediate balances are not checked, so accounts involved must not be used by the
+api while they are being imported.
+"""
+import csv
+import logging
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import orjson
+
+from sqlalchemy import Index, MetaData, Table
+from sqlalchemy.schema import CreateIndex, CreateTable, DropTable
+
+import yaaccu.settings as config
+from yaaccu.db import db
+from yaaccu.models import (
+    Account,
+    AccountType,
+    Balance,
+    BalanceSnapshot,
+    Currency,
+    Document,
+    Operation,
+)
+from yaaccu.models.document import next_commit_seq
+from yaaccu.partitions import ensure_partitions
+
+log = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+#: max number of reported validation errors of each kind
+MAX_ERRORS = 100
+
+#: (line, document key, account address, currency symbol, amount, created_at)
+OperationRow = Tuple[int, str, str, str, Decimal, Optional[datetime]]
+#: called with the stage (`copy` or `promote`), number of processed rows and seconds spent
+Progress = Callable[[str, int, float], None]
+
+# staging tables live in the connection of the import only
+_staging = MetaData()
+import_operations = Table(
+    'yaaccu_import_operations', _staging,
+    db.Column('line', db.BigInteger()),
+    db.Column('document', db.Unicode()),
+    db.Column('account', db.Unicode()),
+    db.Column('currency', db.Unicode()),
+    db.Column('amount', db.Numeric(precision=16, scale=4)),
+    db.Column('created_at', db.DateTime()),
+    prefixes=['TEMPORARY'],
+)
+# created once rows are copied (see `_promote`)
+import_operations_document_idx = Index(
+    'yaaccu_import_operations_document', import_operations.c.document
+)
+import_documents = Table(
+    'yaaccu_import_documents', _staging,
+    db.Column('number', db.BigInteger(), primary_key=True, autoincrement=False),
+    db.Column('key', db.Unicode()),
+    db.Column('created_at', db.DateTime()),
+    db.Column('id', db.BigInteger()),
+    prefixes=['TEMPORARY'],
+)
+
+
+class InvalidImport(Exception):
+    def __init__(self, errors: List[str]):
+        super().__init__("Ledger is invalid: %s" % '; '.join(errors[:3]))
+        self.errors = errors
+
+
+def read_operations(file: TextIO, fmt: str) -> Iterator[OperationRow]:
+    """Parse operations of the CSV or NDJSON file.
+
+    :raises InvalidImport: the row is malformed
+    """
+    if fmt == 'csv':
+        records: Iterable = csv.DictReader(file)
+        first_line = 2
+    else:
+        records = (orjson.loads(line) for line in file if line.strip())
+        first_line = 1
+    for line, record in enumerate(records, start=first_line):
+        try:
+            created_at = record.get('created_at')
+            yield (
+                line,
+                str(record['document']),
+                record['account'],
+                record['currency'],
+                Decimal(str(record['amount'])),
+                datetime.fromisoformat(created_at) if created_at else None,
+            )
+        except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+            raise InvalidImport(["line %s: malformed row (%r)" % (line, e)]) from e
+
+
+async def _copy(connection, rows: Iterable[OperationRow], progress: Progress) -> int:
+    raw_connection = await connection.get_raw_connection()
+    started = time.perf_counter()
+    copied = 0
+    batch: List[OperationRow] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == config.IMPORT_COPY_BATCH_SIZE:
+            await raw_connection.copy_records_to_table(import_operations.name, records=batch)
+            copied += len(batch)
+            batch = []
+            progress('copy', copied, time.perf_counter() - started)
+    if batch:
+        await raw_connection.copy_records_to_table(import_operations.name, records=batch)
+        copied += len(batch)
+    progress('copy', copied, time.perf_counter() - started)
+    return copied
+
+
+async def _validate():
+    ops = import_operations
+    errors = []
+
+    for column, model, key in (
+            (ops.c.account, Account, Account.address),
+            (ops.c.currency, Currency, Currency.symbol),
+    ):
+        unknown = await db.all(db.select([column]).select_from(
+            ops.outerjoin(model, key == column)
+        ).where(model.id.is_(None)).group_by(column).order_by(column).limit(MAX_ERRORS))
+        errors += ["unknown %s %s" % (column.name, value) for value, in unknown]
+
+    amount = db.func.sum(ops.c.amount)
+    imbalanced = await db.all(db.select([ops.c.document, ops.c.currency, amount]).group_by(
+        ops.c.document, ops.c.currency
+    ).having(amount != 0).order_by(ops.c.document).limit(MAX_ERRORS))
+    errors += [
+        "document %s has imbalance %s %s" % (document, total, currency)
+        for document, currency, total in imbalanced
+    ]
+
+    changes = db.select([
+        ops.c.account, ops.c.currency, amount.label('amount')
+    ]).group_by(ops.c.account, ops.c.currency).alias('changes')
+    balance = db.func.coalesce(Balance.committed, 0) + changes.c.amount
+    violations = await db.all(db.select([Account.address, Currency.symbol, balance]).select_from(
+        changes.join(
+            Account, Account.address == changes.c.account
+        ).join(
+            Currency, Currency.symbol == changes.c.currency
+        ).outerjoin(Balance, db.and_(
+            Balance.account == Account.id,
+            Balance.currency == Currency.id,
+        ))
+    ).where(db.or_(
+        db.and_(Account.type == AccountType.active, balance < 0),
+        db.and_(Account.type == AccountType.passive, balance > 0),
+    )).order_by(Account.address).limit(MAX_ERRORS))
+    errors += [
+        "account %s would end up with invalid balance %s %s" % (address, total, currency)
+        for address, currency, total in violations
+    ]
+
+    if errors:
+        raise InvalidImport(errors)
+
+
+async def _promote(chunk_size: int, progress: Progress) -> int:
+    ops, docs = import_operations, import_documents
+    # documents are numbered in order of their first rows
+    first_line = db.func.min(ops.c.line)
+    await db.status(docs.insert().from_select(
+        ['number', 'key', 'created_at'],
+        db.select([
+            db.func.row_number().over(order_by=first_line),
+            ops.c.document,
+            db.func.min(ops.c.created_at),
+        ]).group_by(ops.c.document)
+    ))
+    total = await db.scalar(db.select([db.func.count()]).select_from(docs))
+    # chunks join operations of their documents by keys, so they don't scan all staged
+    # rows; temporary tables are not analyzed by autovacuum
+    await db.status(CreateIndex(import_operations_document_idx))
+    await db.status(db.text('ANALYZE %s, %s' % (ops.name, docs.name)))
+
+    started = time.perf_counter()
+    for first in range(1, total + 1, chunk_size):
+        chunk = docs.c.number.between(first, first + chunk_size - 1)
+        await ensure_partitions(reserve=chunk_size)
+        async with db.transaction():
+            # snapshots must not miss promoted documents (see `Document.commit`)
+            await BalanceSnapshot.lock_shared()
+            await db.status(docs.update().values(
+                id=db.func.nextval(db.literal_column("'documents_id_seq'"))
+            ).where(chunk))
+            chunk_operations = ops.join(docs, docs.c.key == ops.c.document).join(
+                Account, Account.address == ops.c.account
+            ).join(
+                Currency, Currency.symbol == ops.c.currency
+            )
+            await Balance.add_committed(db.select([
+                Account.id,
+                Currency.id,
+                db.func.sum(ops.c.amount),
+                db.func.max(docs.c.id),
+            ]).select_from(chunk_operations).where(chunk).group_by(Account.id, Currency.id))
+            # numbered once balances are locked (see `Document._commit_documents`)
+            await db.status(Document.insert().from_select(
+                ['id', 'committed', 'created_at', 'commit_seq'],
+                db.select([
+                    docs.c.id,
+                    db.true(),
+                    db.func.coalesce(docs.c.created_at, db.func.timezone('utc', db.func.now())),
+                    next_commit_seq(),
+                ]).where(chunk)
+            ))
+            await db.status(Operation.insert().from_select(
+                ['document', 'account', 'currency', 'amount'],
+                db.select([docs.c.id, Account.id, Currency.id, ops.c.amount]).select_from(
+                    chunk_operations
+                ).where(chunk).order_by(ops.c.line)
+            ))
+        progress('promote', min(first + chunk_size - 1, total), time.perf_counter() - started)
+    return total
+
+
+async def import_ledger(rows: Iterable[OperationRow],
+                        chunk_size: int = config.IMPORT_CHUNK_SIZE,
+                        progress: Optional[Progress] = None):
+    """Import operations as committed documents.
+
+    Nothing is imported if the ledger is invalid.
+
+    :param rows: operations (see `read_operations`); rows of a document may be spread
+        over the file
+    :param chunk_size: number of documents promoted in a single transaction
+    :param progress: progress callback
+    :raises InvalidImport: the ledger is invalid
+    :return: numbers of imported documents and operations and seconds spent
+    """
+    progress = progress or (lambda stage, count, seconds: None)
+    started = time.perf_counter()
+    # staging tables are temporary, so everything is done using the same connection
+    async with db.acquire() as connection:
+        for table in (import_operations, import_documents):
+            await db.status(CreateTable(table))
+        try:
+            operations = await _copy(connection, rows, progress)
+            await _validate()
+            documents = await _promote(chunk_size, progress)
+        finally:
+            for table in (import_operations, import_documents):
+                await db.status(DropTable(table))
+    seconds = time.perf_counter() - started
+    log.info("Imported %s documents (%s operations) in %.1f seconds",
+             documents, operations, seconds)
+    return {'documents': documents, 'operations': operations, 'seconds': seconds}
@@ -0,0 +1,108 @@
+"""Read-through caches of currencies and accounts looked up by clients.
+
+Currencies are loaded at startup, accounts are cached by address on first use.
+Changes made by any process are broadcast by database triggers to the
+`CACHE_INVALIDATION_CHANNEL` channel and applied by `handle_invalidation`.
+"""
+import logging
+from typing import Dict, Iterable, Optional
+
+import orjson
+
+import yaaccu.settings as config
+from yaaccu.cache import LRUCache
+from yaaccu.metrics import measured
+from yaaccu.models.account import Account
+from yaaccu.models.currency import Currency
+from yaaccu.security import account_cache
+
+log = logging.getLogger(__name__)
+
+#: channel notified about changes of accounts and currencies (see migrations)
+CACHE_INVALIDATION_CHANNEL = 'yaaccu_cache'
+
+#: currencies by symbol
+currency_cache = LRUCache('currencies', maxsize=config.CURRENCY_CACHE_SIZE)
+#: accounts by address
+address_cache = LRUCache(
+    'addresses', maxsize=config.ADDRESS_CACHE_SIZE, ttl=config.ACCOUNT_CACHE_TTL
+)
+
+
+async def load_currencies():
+    """Fill the cache with all known currencies.
+    """
+    for currency in await Currency.query.gino.all():
+        currency_cache.set(currency.symbol, currency)
+
+
+async def get_currencies(symbols: Iterable[str]) -> Dict[str, Currency]:
+    """Get currencies by symbols, unknown symbols are omitted.
+    """
+    return await _read_through(currency_cache, Currency, Currency.symbol, symbols)
+
+
+async def get_currency(symbol: str) -> Optional[Currency]:
+    return (await get_currencies([symbol])).get(symbol)
+
+
+async def get_accounts(addresses: Iterable[str]) -> Dict[str, Account]:
+    """Get accounts by addresses, unknown addresses are omitted.
+    """
+    return await _read_through(address_cache, Account, Account.address, addresses)
+
+
+async def get_account(address: str) -> Optional[Account]:
+    return (await get_accounts([address])).get(address)
+
+
+def cache_account(account: Account):
+    """Put just created account into the caches.
+    """
+    address_cache.set(account.address, account)
+    if account.pub_key is not None:
+        account_cache.set(account.pub_key, account)
+
+
+def handle_invalidation(payload: str):
+    """Drop entries changed by the database row described in the notification.
+
+    Payload is a json object containing table name and the old row values.
+    """
+    try:
+        change = orjson.loads(payload)
+        table, row = change['table'], change['row']
+    except (ValueError, TypeError, KeyError, orjson.JSONDecodeError):
+        log.error("Invalid cache invalidation payload: %s", payload)
+        return
+    if table == Currency.__tablename__:
+        currency_cache.pop(row['symbol'])
+    elif table == Account.__tablename__:
+        address_cache.pop(row['address'])
+        account_cache.pop(row['pub_key'])
+
+
+def clear_lookup_caches():
+    """Drop all entries, used when notifications could be missed.
+    """
+    currency_cache.clear()
+    address_cache.clear()
+    account_cache.clear()
+
+
+@measured('lookup')
+async def _read_through(cache: LRUCache, model, column, keys: Iterable[str]) -> dict:
+    found = {}
+    missing = []
+    for key in set(keys):
+        value = cache.get(key)
+        if value is None:
+            missing.append(key)
+        else:
+            found[key] = value
+    if missing:
+        for value in await model.query.where(column.in_(missing)).gino.all():
+            key = getattr(value, column.key)
+            cache.set(key, value)
+            found[key] = value
+    return found
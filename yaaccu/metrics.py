@@ -0,0 +1,251 @@
+"""Lightweight request instrumentation.
+
+Code measures its phases (db queries, signature checks, validation...) using
+`measure`. Timings are accumulated process-wide to be exported in the Prometheus
+text format by `render_metrics` and per request to be returned in the
+`Server-Timing` header by `MetricsMiddleware`.
+"""
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+import yaaccu.settings as config
+from yaaccu.cache import cache_stats
+
+#: upper bounds (seconds) of request duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class PhaseStats:
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+
+
+class Histogram:
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        index = bisect_left(DURATION_BUCKETS, seconds)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+class PoolStats:
+    """Saturation of a connection pool.
+    """
+    __slots__ = ('max_size', 'in_use', 'waiting', 'wait')
+
+    def __init__(self):
+        self.max_size = 0
+        #: number of acquired connections
+        self.in_use = 0
+        #: number of coroutines waiting for a connection
+        self.waiting = 0
+        #: time spent waiting for connections
+        self.wait = Histogram()
+
+
+#: phases of all requests and background tasks
+phases: Dict[str, PhaseStats] = defaultdict(PhaseStats)
+#: number of requests by (method, path, status)
+requests: Dict[Tuple[str, str, int], int] = defaultdict(int)
+#: request durations by path
+durations: Dict[str, Histogram] = defaultdict(Histogram)
+#: connection pools by name (see `yaaccu.db.InstrumentedPool`)
+pools: Dict[str, PoolStats] = defaultdict(PoolStats)
+
+_request_phases: ContextVar[Optional[Dict[str, PhaseStats]]] = ContextVar(
+    'request_phases', default=None
+)
+
+
+def record(phase: str, seconds: float):
+    """Add time spent in the phase measured elsewhere (see `measure`).
+    """
+    phases[phase].add(seconds)
+    request_phases = _request_phases.get()
+    if request_phases is not None:
+        request_phases[phase].add(seconds)
+
+
+@contextmanager
+def measure(phase: str):
+    """Measure time spent in the block as the given phase.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def measured(phase: str):
+    """Decorator measuring calls of the coroutine function as the given phase.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with measure(phase):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def phase_totals(phase: str) -> Tuple[int, float]:
+    """Number of measurements and total seconds spent in the phase by the process.
+    """
+    stats = phases.get(phase)
+    if stats is None:
+        return 0, 0.0
+    return stats.count, stats.seconds
+
+
+def server_timing(request_phases: Dict[str, PhaseStats], total: float) -> str:
+    """Format phases as the `Server-Timing` header value (durations in ms).
+    """
+    metrics = [
+        '%s;desc="%s";dur=%.3f' % (phase, stats.count, stats.seconds * 1000)
+        for phase, stats in request_phases.items()
+    ]
+    metrics.append('total;dur=%.3f' % (total * 1000))
+    return ', '.join(metrics)
+
+
+class MetricsMiddleware:
+    """Measure requests and add `Server-Timing` header to responses.
+
+    Durations are recorded by known paths only (see `paths`), other requests are
+    recorded as `other` to keep the number of metrics bounded.
+    """
+
+    def __init__(self, app, paths=()):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_phases: Dict[str, PhaseStats] = defaultdict(PhaseStats)
+        token = _request_phases.set(request_phases)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if config.SERVER_TIMING:
+                    headers: List = list(message.get('headers', []))
+                    headers.append((b'server-timing', server_timing(
+                        request_phases, time.perf_counter() - started
+                    ).encode()))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_phases.reset(token)
+            path = scope['path'] if scope['path'] in self.paths else 'other'
+            requests[(scope['method'], path, status)] += 1
+            durations[path].observe(time.perf_counter() - started)
+
+
+def _labels(**labels) -> str:
+    return '{%s}' % ','.join('%s="%s"' % item for item in labels.items())
+
+
+def _histogram_lines(metric: str, histogram: Histogram, **labels) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(DURATION_BUCKETS, histogram.buckets):
+        cumulative += count
+        lines.append('%s_bucket%s %s' % (metric, _labels(**labels, le=bound), cumulative))
+    return lines + [
+        '%s_bucket%s %s' % (metric, _labels(**labels, le='+Inf'), histogram.count),
+        '%s_sum%s %s' % (metric, _labels(**labels), histogram.sum),
+        '%s_count%s %s' % (metric, _labels(**labels), histogram.count),
+    ]
+
+
+def render_metrics() -> str:
+    """Render metrics in the Prometheus text exposition format.
+    """
+    lines = [
+        '# HELP yaaccu_requests_total Number of handled http requests.',
+        '# TYPE yaaccu_requests_total counter',
+    ]
+    for (method, path, status), count in sorted(requests.items()):
+        lines.append('yaaccu_requests_total%s %s' % (
+            _labels(method=method, path=path, status=status), count
+        ))
+
+    lines += [
+        '# HELP yaaccu_request_duration_seconds Duration of http requests.',
+        '# TYPE yaaccu_request_duration_seconds histogram',
+    ]
+    for path, histogram in sorted(durations.items()):
+        lines += _histogram_lines('yaaccu_request_duration_seconds', histogram, path=path)
+
+    for name, help_text in (
+            ('max_size', 'Max number of pool connections.'),
+            ('in_use', 'Number of acquired pool connections.'),
+            ('waiting', 'Number of coroutines waiting for a pool connection.'),
+    ):
+        metric = 'yaaccu_pool_%s' % name
+        lines += ['# HELP %s %s' % (metric, help_text), '# TYPE %s gauge' % metric]
+        for pool, pool_stats in sorted(pools.items()):
+            lines.append('%s%s %s' % (metric, _labels(pool=pool), getattr(pool_stats, name)))
+    lines += [
+        '# HELP yaaccu_pool_wait_seconds Time spent waiting for pool connections.',
+        '# TYPE yaaccu_pool_wait_seconds histogram',
+    ]
+    for pool, pool_stats in sorted(pools.items()):
+        lines += _histogram_lines('yaaccu_pool_wait_seconds', pool_stats.wait, pool=pool)
+
+    lines += [
+        '# HELP yaaccu_phase_seconds_total Time spent in phases (db, crypto, validation...).',
+        '# TYPE yaaccu_phase_seconds_total counter',
+    ]
+    for phase, stats in sorted(phases.items()):
+        lines.append('yaaccu_phase_seconds_total%s %s' % (_labels(phase=phase), stats.seconds))
+    lines += [
+        '# HELP yaaccu_phase_calls_total Number of measured phases (e.g. db queries).',
+        '# TYPE yaaccu_phase_calls_total counter',
+    ]
+    for phase, stats in sorted(phases.items()):
+        lines.append('yaaccu_phase_calls_total%s %s' % (_labels(phase=phase), stats.count))
+
+    caches = sorted(cache_stats().items())
+    for name, kind, help_text in (
+            ('size', 'gauge', 'Number of cached entries.'),
+            ('hits', 'counter', 'Number of cache hits.'),
+            ('misses', 'counter', 'Number of cache misses.'),
+    ):
+        metric = 'yaaccu_cache_%s' % name
+        if kind == 'counter':
+            metric += '_total'
+        lines += ['# HELP %s %s' % (metric, help_text), '# TYPE %s %s' % (metric, kind)]
+        for cache, stats in caches:
+            lines.append('%s%s %s' % (metric, _labels(cache=cache), stats[name]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,40 @@
+"""balances
+
+Revision ID: 5f2c3b7a1e04
+Revises: d1d0e8ca1b9e
+Create Date: 2026-10-18 10:12:41.518203
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c3b7a1e04'
+down_revision = 'd1d0e8ca1b9e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'balances',
+        sa.Column('account', sa.BigInteger(), nullable=False),
+        sa.Column('currency', sa.BigInteger(), nullable=False),
+        sa.Column('committed', sa.Numeric(precision=32, scale=4), nullable=False),
+        sa.Column('pending', sa.Numeric(precision=32, scale=4), nullable=False),
+        sa.ForeignKeyConstraint(['account'], ['accounts.id'], ),
+        sa.ForeignKeyConstraint(['currency'], ['currencies.id'], ),
+        sa.PrimaryKeyConstraint('account', 'currency')
+    )
+    op.execute(
+        "INSERT INTO balances (account, currency, committed, pending) "
+        "SELECT operations.account, operations.currency, "
+        "coalesce(sum(operations.amount) FILTER (WHERE documents.committed IS TRUE), 0), "
+        "coalesce(sum(operations.amount) FILTER (WHERE documents.committed IS NOT TRUE), 0) "
+        "FROM operations JOIN documents ON documents.id = operations.document "
+        "GROUP BY operations.account, operations.currency"
+    )
+
+
+def downgrade():
+    op.drop_table('balances')
@@ -0,0 +1,32 @@
+"""balance snapshots
+
+Revision ID: 8b41d0c6f7a2
+Revises: 5f2c3b7a1e04
+Create Date: 2026-10-18 13:40:07.902311
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d0c6f7a2'
+down_revision = '5f2c3b7a1e04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'balance_snapshots',
+        sa.Column('document', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('account', sa.BigInteger(), nullable=False),
+        sa.Column('currency', sa.BigInteger(), nullable=False),
+        sa.Column('balance', sa.Numeric(precision=32, scale=4), nullable=False),
+        sa.ForeignKeyConstraint(['account'], ['accounts.id'], ),
+        sa.ForeignKeyConstraint(['currency'], ['currencies.id'], ),
+        sa.PrimaryKeyConstraint('document', 'account', 'currency')
+    )
+
+
+def downgrade():
+    op.drop_table('balance_snapshots')
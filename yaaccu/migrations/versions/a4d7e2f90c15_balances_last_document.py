@@ -0,0 +1,29 @@
+"""balances last document
+
+Revision ID: a4d7e2f90c15
+Revises: f2b8d4e61a97
+Create Date: 2026-10-18 18:05:37.214860
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7e2f90c15'
+down_revision = 'f2b8d4e61a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('balances', sa.Column('last_document', sa.BigInteger(), nullable=True))
+    op.execute(
+        "UPDATE balances SET last_document = latest.document "
+        "FROM (SELECT account, currency, max(document) AS document "
+        "FROM operations GROUP BY account, currency) AS latest "
+        "WHERE balances.account = latest.account AND balances.currency = latest.currency"
+    )
+
+
+def downgrade():
+    op.drop_column('balances', 'last_document')
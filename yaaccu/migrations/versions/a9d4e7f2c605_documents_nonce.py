@@ -0,0 +1,33 @@
+"""documents nonce
+
+Revision ID: a9d4e7f2c605
+Revises: c8e2d5a7f391
+Create Date: 2026-10-18 22:02:51.630478
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4e7f2c605'
+down_revision = 'c8e2d5a7f391'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # added to all partitions
+    op.add_column('documents', sa.Column('nonce', sa.Unicode(), nullable=True))
+    op.add_column('documents', sa.Column('signer', sa.BigInteger(), nullable=True))
+    # unique indexes of partitioned tables must include the partition key, so reused
+    # nonces are rejected by `Document.used_nonces` looking them up
+    op.create_index(
+        'ix_documents_signer_nonce', 'documents', ['signer', 'nonce'], unique=False,
+        postgresql_where=sa.text('signer IS NOT NULL'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_documents_signer_nonce', table_name='documents')
+    op.drop_column('documents', 'signer')
+    op.drop_column('documents', 'nonce')
@@ -0,0 +1,23 @@
+"""documents commit sequence index
+
+Revision ID: b3f8c1d6e294
+Revises: a9d4e7f2c605
+Create Date: 2026-10-18 23:11:08.402816
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f8c1d6e294'
+down_revision = 'a9d4e7f2c605'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # account history is paginated by commits
+    op.create_index('ix_documents_commit_seq', 'documents', ['commit_seq'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_documents_commit_seq', table_name='documents')
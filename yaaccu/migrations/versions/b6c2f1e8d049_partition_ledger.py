@@ -0,0 +1,96 @@
+"""partition ledger
+
+Revision ID: b6c2f1e8d049
+Revises: a4d7e2f90c15
+Create Date: 2026-10-18 18:42:09.561372
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b6c2f1e8d049'
+down_revision = 'a4d7e2f90c15'
+branch_labels = None
+depends_on = None
+
+#: number of document ids per partition, partitions created later have the same size
+#: (see yaaccu.partitions)
+PARTITION_SIZE = 1000000
+#: number of partitions created after the partition of the latest document
+PARTITIONS_AHEAD = 2
+
+DOCUMENTS = (
+    "CREATE TABLE documents ("
+    "  id bigint NOT NULL DEFAULT nextval('documents_id_seq'),"
+    "  committed boolean,"
+    "  created_at timestamp without time zone,"
+    "  PRIMARY KEY (id)"
+    ")"
+)
+OPERATIONS = (
+    "CREATE TABLE operations ("
+    "  id bigint NOT NULL DEFAULT nextval('operations_id_seq'),"
+    "  document bigint NOT NULL REFERENCES documents (id),"
+    "  account bigint REFERENCES accounts (id),"
+    "  currency bigint REFERENCES currencies (id),"
+    "  amount numeric(16, 4),"
+    "  PRIMARY KEY (%s)"
+    ")"
+)
+
+
+def _rename_old_tables():
+    op.execute("ALTER TABLE operations DROP CONSTRAINT operations_document_fkey")
+    for table in ('documents', 'operations'):
+        op.execute("ALTER TABLE %s RENAME TO %s_old" % (table, table))
+        op.execute("ALTER TABLE %s_old RENAME CONSTRAINT %s_pkey TO %s_old_pkey" % (
+            table, table, table
+        ))
+    op.execute("DROP INDEX ix_documents_uncommitted, ix_operations_account_currency, "
+               "ix_operations_account_id")
+
+
+def _move_rows_from_old_tables():
+    op.execute("INSERT INTO documents SELECT id, committed, created_at FROM documents_old")
+    op.execute("INSERT INTO operations SELECT id, document, account, currency, amount "
+               "FROM operations_old")
+    for table in ('documents', 'operations'):
+        op.execute("ALTER SEQUENCE %s_id_seq OWNED BY %s.id" % (table, table))
+    op.execute("DROP TABLE operations_old, documents_old")
+
+    op.execute(
+        "CREATE INDEX ix_operations_account_currency ON operations (account, currency) "
+        "INCLUDE (amount, document)"
+    )
+    op.execute("CREATE INDEX ix_operations_account_id ON operations (account, id)")
+    op.execute(
+        "CREATE INDEX ix_documents_uncommitted ON documents (id) "
+        "WHERE committed IS NOT TRUE"
+    )
+
+
+def upgrade():
+    latest = op.get_bind().execute("SELECT coalesce(max(id), 0) FROM documents").scalar()
+    # operations of the document are looked up by the primary key from now on
+    op.drop_index('ix_operations_document', table_name='operations')
+    _rename_old_tables()
+    op.execute(DOCUMENTS + " PARTITION BY RANGE (id)")
+    # the primary key of a partitioned table must include the partition key
+    op.execute(OPERATIONS % 'document, id' + " PARTITION BY RANGE (document)")
+    # existing documents and PARTITIONS_AHEAD partitions after them (see yaaccu.partitions)
+    for number in range(latest // PARTITION_SIZE + PARTITIONS_AHEAD + 1):
+        for table in ('documents', 'operations'):
+            op.execute("CREATE TABLE %s_p%d PARTITION OF %s FOR VALUES FROM (%d) TO (%d)" % (
+                table, number, table, number * PARTITION_SIZE, (number + 1) * PARTITION_SIZE
+            ))
+    # documents outrunning partitions created ahead
+    for table in ('documents', 'operations'):
+        op.execute("CREATE TABLE %s_default PARTITION OF %s DEFAULT" % (table, table))
+    _move_rows_from_old_tables()
+
+
+def downgrade():
+    _rename_old_tables()
+    op.execute(DOCUMENTS)
+    op.execute(OPERATIONS % 'id')
+    _move_rows_from_old_tables()
+    op.create_index('ix_operations_document', 'operations', ['document'], unique=False)
@@ -0,0 +1,36 @@
+"""operations indexes
+
+Revision ID: c3e9a5d27f18
+Revises: 8b41d0c6f7a2
+Create Date: 2026-10-18 15:02:55.117340
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e9a5d27f18'
+down_revision = '8b41d0c6f7a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # operations of the document (validation, commit) and after the snapshot horizon
+    op.create_index(op.f('ix_operations_document'), 'operations', ['document'], unique=False)
+    # per account balances and history; covering to avoid heap lookups
+    # (INCLUDE is not supported by sqlalchemy, so raw sql is used)
+    op.execute(
+        "CREATE INDEX ix_operations_account_currency ON operations (account, currency) "
+        "INCLUDE (amount, document)"
+    )
+    # documents not committed yet are few, so keep them in a small partial index
+    op.execute(
+        "CREATE INDEX ix_documents_uncommitted ON documents (id) "
+        "WHERE committed IS NOT TRUE"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_documents_uncommitted', table_name='documents')
+    op.drop_index('ix_operations_account_currency', table_name='operations')
+    op.drop_index(op.f('ix_operations_document'), table_name='operations')
@@ -0,0 +1,37 @@
+"""documents commit sequence
+
+Revision ID: c8e2d5a7f391
+Revises: e5b7c9d14a36
+Create Date: 2026-10-18 21:14:37.208163
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2d5a7f391'
+down_revision = 'e5b7c9d14a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE SEQUENCE documents_commit_seq")
+    # added to all partitions
+    op.add_column('documents', sa.Column('commit_seq', sa.BigInteger(), nullable=True))
+    # documents committed so far are considered committed in the id order
+    op.execute(
+        "UPDATE documents SET commit_seq = committed_documents.seq FROM ("
+        "  SELECT id, row_number() OVER (ORDER BY id) AS seq FROM documents"
+        "  WHERE committed IS TRUE"
+        ") committed_documents WHERE documents.id = committed_documents.id"
+    )
+    op.execute(
+        "SELECT setval('documents_commit_seq', "
+        "(SELECT coalesce(max(commit_seq), 0) + 1 FROM documents), false)"
+    )
+
+
+def downgrade():
+    op.drop_column('documents', 'commit_seq')
+    op.execute("DROP SEQUENCE documents_commit_seq")
@@ -0,0 +1,49 @@
+"""hash chain
+
+Revision ID: d9a3f6b1c2e7
+Revises: b6c2f1e8d049
+Create Date: 2026-10-18 19:27:51.408163
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a3f6b1c2e7'
+down_revision = 'b6c2f1e8d049'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # added to all partitions
+    op.add_column('documents', sa.Column('hash', sa.LargeBinary(), nullable=True))
+    op.create_table(
+        'merkle_nodes',
+        sa.Column('level', sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column('position', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('hash', sa.LargeBinary(), nullable=False),
+        sa.Column('document', sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint('level', 'position')
+    )
+    op.create_index(
+        'ix_merkle_nodes_document', 'merkle_nodes', ['document'], unique=False,
+        postgresql_where=sa.text('level = 0'),
+    )
+    op.create_table(
+        'hash_checkpoints',
+        sa.Column('document', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('root', sa.LargeBinary(), nullable=False),
+        sa.Column('hash', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('verified_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('document')
+    )
+
+
+def downgrade():
+    op.drop_table('hash_checkpoints')
+    op.drop_index('ix_merkle_nodes_document', table_name='merkle_nodes')
+    op.drop_table('merkle_nodes')
+    op.drop_column('documents', 'hash')
@@ -0,0 +1,24 @@
+"""documents signature
+
+Revision ID: e5b7c9d14a36
+Revises: d9a3f6b1c2e7
+Create Date: 2026-10-18 20:03:12.785416
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b7c9d14a36'
+down_revision = 'd9a3f6b1c2e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # added to all partitions
+    op.add_column('documents', sa.Column('signature', sa.Unicode(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('documents', 'signature')
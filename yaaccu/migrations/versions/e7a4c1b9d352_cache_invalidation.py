@@ -0,0 +1,41 @@
+"""cache invalidation
+
+Revision ID: e7a4c1b9d352
+Revises: c3e9a5d27f18
+Create Date: 2026-10-18 16:21:07.482913
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a4c1b9d352'
+down_revision = 'c3e9a5d27f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # notify api processes about changed or deleted rows they may have cached
+    # (see yaaccu.lookup); inserted rows are never cached before they exist
+    op.execute("""
+        CREATE FUNCTION yaaccu_notify_cache() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify(
+                'yaaccu_cache',
+                json_build_object('table', TG_TABLE_NAME, 'row', row_to_json(OLD))::text
+            );
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    for table in ('accounts', 'currencies'):
+        op.execute(
+            "CREATE TRIGGER %s_notify_cache AFTER UPDATE OR DELETE ON %s "
+            "FOR EACH ROW EXECUTE PROCEDURE yaaccu_notify_cache()" % (table, table)
+        )
+
+
+def downgrade():
+    for table in ('accounts', 'currencies'):
+        op.execute("DROP TRIGGER %s_notify_cache ON %s" % (table, table))
+    op.execute("DROP FUNCTION yaaccu_notify_cache()")
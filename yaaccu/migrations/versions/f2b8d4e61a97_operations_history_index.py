@@ -0,0 +1,23 @@
+"""operations history index
+
+Revision ID: f2b8d4e61a97
+Revises: e7a4c1b9d352
+Create Date: 2026-10-18 17:40:12.903551
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8d4e61a97'
+down_revision = 'e7a4c1b9d352'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # account history ordered by operation id (keyset pagination)
+    op.create_index('ix_operations_account_id', 'operations', ['account', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_operations_account_id', table_name='operations')
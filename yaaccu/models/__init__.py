@@ -1,12 +1,19 @@
 from .account import Account, AccountType
+from .balance import Balance
+from .checkpoint import HashCheckpoint, MerkleNode
 from .currency import Currency
 from .document import Document
 from .operation import Operation
+from .snapshot import BalanceSnapshot
 
 __all__ = (
     'Account',
     'AccountType',
+    'Balance',
+    'BalanceSnapshot',
     'Currency',
     'Document',
+    'HashCheckpoint',
+    'MerkleNode',
     'Operation',
 )
@@ -0,0 +1,187 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, Set, Tuple
+
+from sqlalchemy import and_, or_, union_all
+from sqlalchemy.dialects.postgresql import insert
+
+from yaaccu.db import db
+
+from .operation import Operation
+
+#: balance changes keyed by (account id, currency id) pair
+BalanceChanges = Dict[Tuple[int, int], Decimal]
+
+
+def balance_changes(operations: Iterable[Tuple[int, int, Decimal]]) -> BalanceChanges:
+    """Sum (account id, currency id, amount) triples per account and currency.
+    """
+    changes: BalanceChanges = defaultdict(Decimal)
+    for account, currency, amount in operations:
+        changes[(account, currency)] += amount
+    return changes
+
+
+class Balance(db.Model):
+    """Materialized balance of the account in a single currency.
+
+    `committed` is the sum of operations of committed documents and `pending` is the sum
+    of operations of documents not committed yet. Both are maintained by `Document`, so
+    operations must be added using its methods to be taken into account. `last_document`
+    is the latest document which changed the balance.
+    """
+    __tablename__ = 'balances'
+
+    account = db.Column(db.BigInteger(), db.ForeignKey('accounts.id'), primary_key=True)
+    currency = db.Column(db.BigInteger(), db.ForeignKey('currencies.id'), primary_key=True)
+    committed = db.Column(db.Numeric(precision=32, scale=4), nullable=False, default=0)
+    pending = db.Column(db.Numeric(precision=32, scale=4), nullable=False, default=0)
+    last_document = db.Column(db.BigInteger())
+
+    @classmethod
+    async def add_pending(cls, changes: BalanceChanges, document: int):
+        """Add balance changes of a document which is not committed yet.
+        """
+        await cls._update(changes, document, committed=0, pending=1)
+
+    @classmethod
+    async def apply(cls, changes: BalanceChanges, document: int):
+        """Move balance changes of the committed document from pending to committed.
+        """
+        await cls._update(changes, document, committed=1, pending=-1)
+
+    @classmethod
+    async def release(cls, changes: BalanceChanges, document: int):
+        """Drop pending balance changes of the aborted document.
+        """
+        await cls._update(changes, document, committed=0, pending=-1)
+
+    @classmethod
+    async def add_committed(cls, query):
+        """Add committed balance changes selected by the query (e.g. of imported documents).
+
+        :param query: select of (account id, currency id, amount, document id) rows
+            unique by account and currency
+        """
+        account, currency, amount, document = query.alias('changes').c
+        stmt = insert(cls.__table__).from_select(
+            ['account', 'currency', 'committed', 'pending', 'last_document'],
+            # rows are locked in the same order by every writer to avoid deadlocks
+            db.select([account, currency, amount, db.literal_column('0'), document]).order_by(
+                account, currency
+            )
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.account, cls.currency],
+            set_={
+                'committed': cls.committed + stmt.excluded.committed,
+                'last_document': db.func.greatest(
+                    cls.last_document, stmt.excluded.last_document
+                ),
+            }
+        )
+        await db.status(stmt)
+
+    @classmethod
+    async def lock(cls, pairs: Set[Tuple[int, int]]) -> Dict[Tuple[int, int], 'Balance']:
+        """Lock balances of (account id, currency id) pairs until the end of the transaction.
+
+        Missing balances are created.
+
+        :return: locked balances by pair
+        """
+        if not pairs:
+            return {}
+        stmt = insert(cls.__table__).values([
+            {'account': account, 'currency': currency, 'committed': 0, 'pending': 0}
+            for account, currency in sorted(pairs)
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.account, cls.currency],
+            set_={'committed': cls.committed},
+        ).returning(*cls.__table__.columns)
+        balances = await stmt.gino.model(cls).all()
+        return {(balance.account, balance.currency): balance for balance in balances}
+
+    @classmethod
+    async def _update(cls, changes: BalanceChanges, document: int, committed: int, pending: int):
+        if not changes:
+            return
+        # rows are locked in the same order by every writer to avoid deadlocks
+        stmt = insert(cls.__table__).values([
+            {
+                'account': account,
+                'currency': currency,
+                'committed': amount * committed,
+                'pending': amount * pending,
+                'last_document': document,
+            }
+            for (account, currency), amount in sorted(changes.items())
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.account, cls.currency],
+            set_={
+                'committed': cls.committed + stmt.excluded.committed,
+                'pending': cls.pending + stmt.excluded.pending,
+                'last_document': db.func.greatest(
+                    cls.last_document, stmt.excluded.last_document
+                ),
+            }
+        )
+        await db.status(stmt)
+
+    @classmethod
+    async def find_mismatches(cls, full: bool = False):
+        """Compare materialized balances with sums of the raw operations.
+
+        Committed balances are calculated from the latest balance snapshot plus operations
+        after it, unless `full` is set.
+
+        :param full: sum the whole history of operations ignoring snapshots
+        :return: list of (account id, currency id, committed, pending, expected committed,
+            expected pending) rows which differ
+        """
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from .document import Document
+        from .snapshot import BalanceSnapshot
+
+        committed = BalanceSnapshot.committed_balances(full=full)
+        committed_rows = db.select([
+            committed.c.account,
+            committed.c.currency,
+            committed.c.balance.label('committed'),
+            db.literal_column('0').label('pending'),
+        ])
+        pending_rows = db.select([
+            Operation.account,
+            Operation.currency,
+            db.literal_column('0'),
+            Operation.amount,
+        ]).select_from(Operation.join(Document)).where(Document.committed.isnot(True))
+        rows = union_all(committed_rows, pending_rows).alias('ledger_rows')
+        ledger = db.select([
+            rows.c.account,
+            rows.c.currency,
+            db.func.sum(rows.c.committed).label('committed'),
+            db.func.sum(rows.c.pending).label('pending'),
+        ]).group_by(rows.c.account, rows.c.currency).alias('ledger')
+
+        balance_committed = db.func.coalesce(cls.committed, 0)
+        balance_pending = db.func.coalesce(cls.pending, 0)
+        ledger_committed = db.func.coalesce(ledger.c.committed, 0)
+        ledger_pending = db.func.coalesce(ledger.c.pending, 0)
+        return await db.select([
+            db.func.coalesce(cls.account, ledger.c.account),
+            db.func.coalesce(cls.currency, ledger.c.currency),
+            balance_committed,
+            balance_pending,
+            ledger_committed,
+            ledger_pending,
+        ]).select_from(cls.__table__.join(
+            ledger,
+            and_(cls.account == ledger.c.account, cls.currency == ledger.c.currency),
+            full=True
+        )).where(or_(
+            balance_committed != ledger_committed,
+            balance_pending != ledger_pending,
+        )).gino.all()
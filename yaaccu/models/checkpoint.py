@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from yaaccu.db import db
+
+
+class MerkleNode(db.Model):
+    """Node of the Merkle tree over hashes of sealed documents (see `yaaccu.chain`).
+
+    Only roots of complete subtrees are stored: the node at `level` and `position`
+    covers leaves from ``position * 2 ** level`` to ``(position + 1) * 2 ** level``
+    (excluding). Leaves (level 0) refer to their documents.
+    """
+    __tablename__ = 'merkle_nodes'
+
+    level = db.Column(db.SmallInteger(), primary_key=True, autoincrement=False)
+    position = db.Column(db.BigInteger(), primary_key=True, autoincrement=False)
+    hash = db.Column(db.LargeBinary(), nullable=False)
+    #: sealed document of the leaf
+    document = db.Column(db.BigInteger(), nullable=True)
+
+    _document_idx = db.Index(
+        'ix_merkle_nodes_document', 'document', postgresql_where=db.text('level = 0')
+    )
+
+
+class HashCheckpoint(db.Model):
+    """Merkle root of the first `size` sealed documents.
+    """
+    __tablename__ = 'hash_checkpoints'
+
+    #: the last sealed document
+    document = db.Column(db.BigInteger(), primary_key=True, autoincrement=False)
+    #: number of sealed documents (leaves of the tree)
+    size = db.Column(db.BigInteger(), nullable=False)
+    root = db.Column(db.LargeBinary(), nullable=False)
+    #: chain hash of the last sealed document
+    hash = db.Column(db.LargeBinary(), nullable=False)
+    created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+    #: time the checkpoint was verified against documents last time
+    verified_at = db.Column(db.DateTime(), nullable=True)
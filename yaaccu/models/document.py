@@ -1,29 +1,99 @@
 import logging
 from datetime import datetime
 from decimal import Decimal
+from typing import Iterable, List, Optional, Set, Tuple
 
-from gino.loader import ColumnLoader
-from sqlalchemy import or_
+from sqlalchemy import and_, tuple_
 
+import yaaccu.settings as config
 from yaaccu.db import db
+from yaaccu.metrics import measured
 
 from .account import Account, AccountType
+from .balance import Balance, BalanceChanges, balance_changes
 from .currency import Currency
 from .operation import Operation
+from .snapshot import BalanceSnapshot
 
 log = logging.getLogger('yaaccu')
 
+#: class of advisory locks of nonces of signers (see `Document.used_nonces`)
+NONCE_LOCK = 0x79617367
+
+#: class of advisory locks of accounts taken by commits (see `Document._commit_documents`)
+COMMIT_LOCK = 0x79616361
+
+_LOCK_ACCOUNTS_QUERY = db.text(
+    "SELECT count(pg_advisory_xact_lock(:lock, hashint8(account))) FROM ("
+    "SELECT unnest(CAST(:accounts AS bigint[])) AS account ORDER BY 1) accounts"
+)
+_LOCK_NONCES_QUERY = db.text(
+    "SELECT count(pg_advisory_xact_lock(:lock, hashtext(CAST(:signer AS text) || '|' || nonce))) "
+    "FROM (SELECT unnest(CAST(:nonces AS text[])) AS nonce ORDER BY 1) nonces"
+)
+
 
 class InvalidDocumentException(Exception):
-    pass
+    #: number of attempts made to create and commit the document (see `yaaccu.retry`)
+    attempts = 1
+
+
+class DocumentConflict(InvalidDocumentException):
+    """Document is valid against committed balances but conflicts with pending operations
+    of other documents, so it may become valid once they are committed or aborted.
+    """
+
+
+class NonceReused(InvalidDocumentException):
+    """Nonce of the signed document is already used by another document of the signer.
+    """
+
+
+def next_commit_seq():
+    """Scalar subquery evaluated once per statement: the number of the next commit.
+    """
+    return db.select([
+        db.func.nextval(db.literal_column("'documents_commit_seq'"))
+    ]).as_scalar()
+
+
+def _balance_allowed(account_type: AccountType, balance: Decimal) -> bool:
+    if account_type == AccountType.active:
+        return balance >= 0
+    if account_type == AccountType.passive:
+        return balance <= 0
+    return True
 
 
 class Document(db.Model):
     __tablename__ = 'documents'
+    # range partitions by id (see `yaaccu.partitions`)
+    __table_args__ = {'postgresql_partition_by': 'RANGE (id)'}
 
     id = db.Column(db.BigInteger(), primary_key=True)
     committed = db.Column(db.Boolean(), default=False)
     created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+    #: number of the commit, documents of the same account are committed in the order of
+    #: their numbers (documents committed together share the number)
+    commit_seq = db.Column(db.BigInteger(), nullable=True)
+    #: chain hash of the committed document set once it is sealed (see `yaaccu.chain`)
+    hash = db.Column(db.LargeBinary(), nullable=True)
+    #: client signature (PSS, hex) of the canonical content of the document
+    #: (see `yaaccu.signature.canonical_document`)
+    signature = db.Column(db.Unicode(), nullable=True)
+    #: client nonce of the signed document, the first line of its canonical content
+    nonce = db.Column(db.Unicode(), nullable=True)
+    #: id of the account which signed the document, nonces are unique per signer
+    signer = db.Column(db.BigInteger(), nullable=True)
+
+    _uncommitted_idx = db.Index(
+        'ix_documents_uncommitted', 'id', postgresql_where=db.text('committed IS NOT TRUE')
+    )
+    _commit_seq_idx = db.Index('ix_documents_commit_seq', 'commit_seq')
+    _signer_nonce_idx = db.Index(
+        'ix_documents_signer_nonce', 'signer', 'nonce',
+        postgresql_where=db.text('signer IS NOT NULL'),
+    )
 
     async def transfer(self,
                        sender: Account,
@@ -37,31 +107,80 @@ class Document(db.Model):
         :param amount: transfer amount
         :param currency: used currency
         """
-        await Operation.create(
-            document=self.id,
-            account=sender.id,
-            currency=currency.id,
-            amount=-amount
-        )
-        await Operation.create(
-            document=self.id,
-            account=receiver.id,
-            currency=currency.id,
-            amount=amount
-        )
-
-    async def add_operation(self, account: Account, currency: Currency, amount: Decimal):
+        await self.add_operations([
+            (sender, currency, -amount),
+            (receiver, currency, amount),
+        ])
+
+    async def add_operation(self,
+                            account: Account,
+                            currency: Currency,
+                            amount: Decimal) -> Operation:
         """Add operation to the document.
 
-        Just a shortcut for `Operation.create` without `document` parameter
-        and explict args order.
+        Just a shortcut for `add_operations` with a single operation.
+
+        :return: created operation
         """
-        return await Operation.create(
-            document=self.id,
-            account=account.id,
-            currency=currency.id,
-            amount=amount
+        operations = await self._insert_operations(
+            [(self.id, account.id, currency.id, amount)], returning=True
         )
+        return operations[0]
+
+    async def add_operations(self, operations: List[Tuple[Account, Currency, Decimal]]):
+        """Add several operations to the document at once.
+
+        All operations are written with a single multi-row INSERT (or COPY for large
+        documents, see `OPERATIONS_COPY_THRESHOLD`) and pending balances of involved
+        accounts are updated in the same transaction.
+
+        :param operations: list of (account, currency, amount) tuples
+        """
+        await self._insert_operations([
+            (self.id, account.id, currency.id, amount)
+            for account, currency, amount in operations
+        ])
+
+    @staticmethod
+    @measured('insert')
+    async def _insert_operations(rows: List[Tuple[int, int, int, Decimal]],
+                                 returning=False) -> List[Operation]:
+        """Write (document id, account id, currency id, amount) rows and pending balances.
+
+        :param returning: return created operations (COPY is not used then)
+        :return: created operations if `returning` is set
+        """
+        operations: List[Operation] = []
+        if not rows:
+            return operations
+        async with db.transaction() as tx:
+            if not returning and len(rows) >= config.OPERATIONS_COPY_THRESHOLD:
+                connection = await tx.connection.get_raw_connection()
+                await connection.copy_records_to_table(
+                    Operation.__tablename__,
+                    records=rows,
+                    columns=('document', 'account', 'currency', 'amount'),
+                )
+            else:
+                stmt = Operation.insert().values([
+                    {
+                        'document': document,
+                        'account': account,
+                        'currency': currency,
+                        'amount': amount,
+                    }
+                    for document, account, currency, amount in rows
+                ])
+                if returning:
+                    operations = await stmt.returning(
+                        *Operation.__table__.columns
+                    ).gino.model(Operation).all()
+                else:
+                    await db.status(stmt)
+            await Balance.add_pending(balance_changes(
+                (account, currency, amount) for _, account, currency, amount in rows
+            ), max(document for document, _, _, _ in rows))
+        return operations
 
     @classmethod
     async def create_transfer(cls,
@@ -77,22 +196,351 @@ class Document(db.Model):
 
         You must commit returned document manually.
         """
-        async with db.transaction() as tx:
-            doc: Document = await cls.create()
-            await doc.transfer(sender, receiver, amount, currency)
-            if not await doc.is_valid():
-                tx.raise_rollback()
-            return doc
+        return await cls.create_with_operations([
+            (sender, currency, -amount),
+            (receiver, currency, amount),
+        ])
+
+    @classmethod
+    async def create_with_operations(cls,
+                                     operations: List[Tuple[Account, Currency, Decimal]],
+                                     raise_exception=False,
+                                     signature: Optional[str] = None,
+                                     nonce: Optional[str] = None,
+                                     signer: Optional[Account] = None) -> Optional['Document']:
+        """Create document containing arbitrary operations.
+
+        Operations may involve any number of accounts and currencies (e.g. a fee
+        split or a pair of exchange legs). They are written at once and the document
+        is validated once.
+
+        You must commit returned document manually.
 
-    async def commit(self):
+        :param operations: list of (account, currency, amount) tuples
+        :param raise_exception: raise validation error instead of returning None
+        :param signature: client signature of the document
+        :param nonce: client nonce of the signed document
+        :param signer: account which signed the document
+        :return: created document or None if it is invalid (or the nonce is used by
+            another document of the signer, see `NonceReused`)
+        """
+        try:
+            async with db.transaction():
+                if signer is not None and nonce is not None and await cls.used_nonces(
+                        signer.id, [nonce], lock=True
+                ):
+                    raise NonceReused("Nonce is already used")
+                doc: Document = await cls.create(
+                    signature=signature, nonce=nonce,
+                    signer=signer.id if signer is not None else None,
+                )
+                await doc.add_operations(operations)
+                await doc.validate()
+        except InvalidDocumentException:
+            if raise_exception:
+                raise
+            return None
+        return doc
+
+    async def commit(self, raise_exception=False):
         """Commit document.
 
         Commit balance changes if current document is valid.
 
         Must be invoked outside transaction to ensure no conflicting document were added.
+
+        Materialized balances of involved accounts are updated in the same transaction.
+
+        :param raise_exception: raise validation error instead of returning False
+        :return: True if the document has been committed
+        """
+        try:
+            await self.validate()
+            if not await self._commit_documents([self.id], await self._balance_changes()):
+                raise InvalidDocumentException(
+                    "Document %s is already committed or abandoned" % self.id
+                )
+        except InvalidDocumentException:
+            if raise_exception:
+                raise
+            return False
+        self.committed = True
+        return True
+
+    async def abort(self) -> bool:
+        """Delete the document which is not committed along with its operations.
+
+        Pending balances of involved accounts are released, so the failed document
+        doesn't affect validation of other documents anymore.
+
+        :return: True if the document has been aborted
+        """
+        async with db.transaction():
+            # locked to not release pending balances twice
+            document_id = await db.select([Document.id]).where(and_(
+                Document.id == self.id,
+                Document.committed.isnot(True),
+            )).with_for_update().gino.scalar()
+            if document_id is None:
+                return False
+            changes = await self._balance_changes()
+            await Operation.delete.where(Operation.document == self.id).gino.status()
+            # commits of the document fail from now on as it doesn't exist
+            await Document.delete.where(Document.id == self.id).gino.status()
+            await Balance.release(changes, self.id)
+        return True
+
+    @classmethod
+    async def abandon(cls, after: int, until: int) -> int:
+        """Abort documents with ids in (after, until] which are not committed yet.
+
+        Used for documents behind the horizon of a new snapshot (see
+        `BalanceSnapshot.take`): they can't be committed anymore, so their pending
+        balances must not affect validation of other documents.
+
+        Must be invoked inside transaction.
+
+        :return: number of aborted documents
+        """
+        behind = and_(cls.id > after, cls.id <= until)
+        # locked to not release pending balances twice (see `abort`)
+        ids = [document_id for document_id, in await db.select([cls.id]).where(and_(
+            behind,
+            cls.committed.isnot(True),
+        )).with_for_update().gino.all()]
+        if not ids:
+            return 0
+        changes = await cls._documents_balance_changes(ids)
+        await Operation.delete.where(and_(
+            Operation.document > after,
+            Operation.document <= until,
+            Operation.document.in_(ids),
+        )).gino.status()
+        await cls.delete.where(and_(behind, cls.id.in_(ids))).gino.status()
+        await Balance.release(changes, max(ids))
+        return len(ids)
+
+    async def _balance_changes(self) -> BalanceChanges:
+        return await self._documents_balance_changes([self.id])
+
+    @classmethod
+    async def _documents_balance_changes(cls, ids: List[int]) -> BalanceChanges:
+        rows = await db.select([
+            Operation.account,
+            Operation.currency,
+            db.func.sum(Operation.amount),
+        ]).where(
+            Operation.document.in_(ids)
+        ).group_by(Operation.account, Operation.currency).gino.all()
+        return balance_changes(rows)
+
+    @classmethod
+    @measured('commit')
+    async def _commit_documents(cls, ids: List[int], changes: BalanceChanges) -> bool:
+        """Mark documents committed and apply their balance changes atomically.
+
+        Nothing is committed if any of the documents can't be committed.
+        """
+        committed = False
+        async with db.transaction() as tx:
+            # snapshots must not miss documents committed while they are being taken
+            await BalanceSnapshot.lock_shared()
+            status, _ = await cls.update.values(committed=True).where(and_(
+                cls.id.in_(ids),
+                cls.committed.isnot(True),
+                # documents behind the latest snapshot are abandoned and can't be committed
+                cls.id > BalanceSnapshot.horizon(),
+            )).gino.status()
+            if status != 'UPDATE %s' % len(ids):
+                tx.raise_rollback()
+            await Balance.apply(changes, max(ids))
+            # accounts are locked till the end of the transaction, so documents of the same
+            # account get numbers in the order they are committed (the account history is
+            # paginated by them)
+            await db.status(_LOCK_ACCOUNTS_QUERY, lock=COMMIT_LOCK,
+                            accounts=sorted({account for account, _ in changes}))
+            await cls.update.values(commit_seq=next_commit_seq()).where(
+                cls.id.in_(ids)
+            ).gino.status()
+            committed = True
+        return committed
+
+    @classmethod
+    async def create_transfers(cls,
+                               sender: Account,
+                               transfers: List[Tuple[Account, Decimal, Currency]],
+                               signatures: Optional[List[Optional[str]]] = None,
+                               nonces: Optional[List[Optional[str]]] = None
+                               ) -> List[Optional['Document']]:
+        """Create transfer documents from the sender to several receivers at once.
+
+        Balances of involved accounts are locked and read once, then transfers are
+        validated in order in a single pass: the transfer is skipped if its amount is not
+        positive, it makes any account balance invalid (considering previous transfers of
+        the batch) or its nonce is already used (by another document of the sender or a
+        previous transfer of the batch).
+        Documents and operations of accepted transfers are written with a single
+        statement each (see `add_operations`).
+
+        You must commit returned documents manually (see `commit_many`).
+
+        :param transfers: list of (receiver, amount, currency) tuples
+        :param signatures: client signatures of transfers made with the sender key
+        :param nonces: client nonces of signed transfers
+        :return: list of created documents (None for skipped transfers) in the same order
+        """
+        accounts = {sender.id: sender}
+        for receiver, _, _ in transfers:
+            accounts[receiver.id] = receiver
+        documents_changes = [
+            balance_changes([
+                (sender.id, currency.id, -amount),
+                (receiver.id, currency.id, amount),
+            ])
+            for receiver, amount, currency in transfers
+        ]
+
+        signatures = signatures or [None] * len(transfers)
+        nonces = nonces or [None] * len(transfers)
+        documents: List[Optional[Document]] = [None] * len(transfers)
+        async with db.transaction():
+            used = await cls.used_nonces(
+                sender.id, [nonce for nonce in nonces if nonce is not None], lock=True
+            )
+            locked = await Balance.lock({
+                pair for changes in documents_changes for pair in changes
+            })
+            clean = {pair: balance.committed for pair, balance in locked.items()}
+            dirty = {
+                pair: balance.committed + balance.pending for pair, balance in locked.items()
+            }
+
+            accepted = []
+            for index, changes in enumerate(documents_changes):
+                nonce = nonces[index]
+                if transfers[index][1] <= 0:
+                    log.info("Amount of transfer %s of the batch is not positive", index)
+                elif nonce in used:
+                    log.info("Nonce of transfer %s of the batch is already used", index)
+                elif all(
+                        _balance_allowed(
+                            accounts[account].type, balances[(account, currency)] + amount
+                        )
+                        for (account, currency), amount in changes.items()
+                        for balances in (clean, dirty)
+                ):
+                    for pair, amount in changes.items():
+                        clean[pair] += amount
+                        dirty[pair] += amount
+                    if nonce is not None:
+                        used.add(nonce)
+                    accepted.append(index)
+                else:
+                    log.info("Transfer %s of the batch is not valid", index)
+            if not accepted:
+                return documents
+
+            ids = await cls._next_ids(len(accepted))
+            now = datetime.utcnow()
+            await db.status(cls.insert().values([
+                {
+                    'id': document_id,
+                    'committed': False,
+                    'created_at': now,
+                    'signature': signatures[index],
+                    'nonce': nonces[index],
+                    'signer': sender.id if nonces[index] is not None else None,
+                }
+                for document_id, index in zip(ids, accepted)
+            ]))
+            await cls._insert_operations([
+                (document_id, account, currency, amount)
+                for document_id, index in zip(ids, accepted)
+                for (account, currency), amount in documents_changes[index].items()
+            ])
+            for document_id, index in zip(ids, accepted):
+                documents[index] = cls(id=document_id, committed=False, created_at=now,
+                                       signature=signatures[index], nonce=nonces[index],
+                                       signer=sender.id if nonces[index] is not None else None)
+        return documents
+
+    @classmethod
+    async def used_nonces(cls, signer: int, nonces: Iterable[str], lock=False) -> Set[str]:
+        """Nonces of the given ones used by existing documents signed by the account.
+
+        Nonces of aborted documents are not used anymore, so failed documents may be
+        sent again.
+
+        :param signer: id of the account
+        :param lock: lock nonces till the end of the transaction, so documents using them
+            can't be created concurrently (must be invoked inside transaction)
+        """
+        nonces = list(set(nonces))
+        if not nonces:
+            return set()
+        if lock:
+            # locked in order to not deadlock with documents sharing nonces
+            await db.status(_LOCK_NONCES_QUERY, lock=NONCE_LOCK, signer=str(signer),
+                            nonces=nonces)
+        rows = await db.select([cls.nonce]).where(and_(
+            cls.signer == signer,
+            cls.nonce.in_(nonces),
+        )).gino.all()
+        return {nonce for nonce, in rows}
+
+    @classmethod
+    async def _next_ids(cls, count: int) -> List[int]:
+        rows = await db.select([
+            db.func.nextval(db.literal_column("'documents_id_seq'"))
+        ]).select_from(db.func.generate_series(1, count)).gino.all()
+        return [document_id for document_id, in rows]
+
+    @classmethod
+    async def commit_many(cls, documents: List['Document']) -> List[bool]:
+        """Commit several documents at once.
+
+        Documents are validated together against materialized balances in a single pass
+        and committed in a single transaction. If documents are not valid together,
+        they are committed one by one, so valid ones are still committed.
+
+        Must be invoked outside transaction (see `commit`).
+
+        :return: list of flags showing which documents have been committed
+        """
+        if not documents:
+            return []
+        ids = [document.id for document in documents]
+        changes = await cls._documents_balance_changes(ids)
+        if await cls._changes_are_valid(changes) and await cls._commit_documents(ids, changes):
+            for document in documents:
+                document.committed = True
+            return [True] * len(documents)
+        return [await document.commit() for document in documents]
+
+    @staticmethod
+    async def _changes_are_valid(changes: BalanceChanges) -> bool:
+        """Check if balance changes of documents not committed yet keep accounts valid.
+
+        Performs both dirty and clean checks (see `is_valid`) of all pairs at once.
         """
-        if await self.is_valid():
-            await self.update(committed=True).apply()
+        rows = await db.select([
+            Balance.committed,
+            Balance.pending,
+            Balance.account,
+            Balance.currency,
+            Account.type,
+        ]).select_from(Balance.join(Account)).where(
+            tuple_(Balance.account, Balance.currency).in_(list(changes))
+        ).gino.all()
+        if len(rows) != len(changes):
+            return False
+        for committed, pending, account, currency, account_type in rows:
+            clean = committed + changes[(account, currency)]
+            # pending balance already contains changes of the documents
+            dirty = committed + pending
+            if not all(_balance_allowed(account_type, balance) for balance in (clean, dirty)):
+                return False
+        return True
 
     async def is_valid(self):
         """Check if document is valid.
@@ -118,81 +566,93 @@ class Document(db.Model):
 
         Other db clients follow the same rules so it is not possible to introduce conflicts
         between this checks (while our uncommitted document and operations is in the database).
+
+        All the checks are performed by a single query returning violations only.
         """
 
         # TODO: check if we are inside transaction and raise exception
         try:
-            log.debug("Perform dirty document check")
-            await self._per_currency_balance_is_valid()
-            await self._per_account_balance_is_valid(include_dirty=True)
-
-            log.debug("Perform clean document check")
-            await self._per_account_balance_is_valid(include_dirty=False)
-        except InvalidDocumentException as e:
-            log.error("Document is not valid: %s", e.args[0])
+            await self.validate()
+        except InvalidDocumentException:
             return False
         log.debug("Document is valid")
         return True
 
-    async def _per_currency_balance_is_valid(self):
-        # Check operation balance for each currency
-        count_column = db.func.coalesce(db.func.sum(Operation.amount), 0)
-        total_sum_qs = db.select([
-            count_column,
-            Currency.symbol
-        ]).select_from(Operation.join(Currency)).where(Operation.document == self.id)
-
-        total_sum_qs = total_sum_qs.group_by(Currency.symbol)
-
-        balance_per_currency = await total_sum_qs.gino.load((
-            ColumnLoader(count_column),
-            ColumnLoader(Currency.symbol)
-        )).all()
-        log.debug("Balances per currency: %s", balance_per_currency)
-
-        for balance, currency in balance_per_currency:
-            if balance != 0:
-                raise InvalidDocumentException(
-                    "Document %s is invalid because has imbalance on currency %s" %
-                    (self.id, currency)
-                )
-
-        return True
-
-    async def _per_account_balance_is_valid(self, include_dirty=True):
-        balance_column = db.func.coalesce(db.func.sum(Operation.amount), 0)
-
-        from_stmt = Operation.join(Account).join(Document).join(Currency)
-        accounts_balances = db.select([
-            balance_column,
-            Currency.symbol,
-            Account
-        ]).select_from(from_stmt).where(Operation.account == Account.id)
+    @measured('validation')
+    async def validate(self):
+        """Check if document is valid like `is_valid` but raise an exception if it is not.
 
-        if not include_dirty:
-            accounts_balances = accounts_balances.where(
-                or_(Document.committed.is_(True), Document.id == self.id)
+        :raises DocumentConflict: only the check against pending operations failed
+        :raises InvalidDocumentException: the document is invalid against committed balances
+        """
+        violations = await db.all(self._violations_query())
+        for check, address, currency, balance in violations:
+            if check == 'imbalance':
+                log.error("Document %s is invalid because has imbalance on currency %s",
+                          self.id, currency)
+            else:
+                log.error("Document %s is invalid: %s check failed for account %s "
+                          "(estimated balance: %s %s)", self.id, check, address, balance, currency)
+        checks = {check for check, _, _, _ in violations}
+        if checks == {'dirty'}:
+            raise DocumentConflict(
+                "Document %s conflicts with documents not committed yet" % self.id
+            )
+        if checks:
+            raise InvalidDocumentException(
+                "Document %s is invalid: %s check failed" % (self.id, ', '.join(sorted(checks)))
             )
 
-        accounts_balances = accounts_balances.group_by(Account.id, Currency.symbol)
-
-        balance_per_account = await accounts_balances.gino.load((
-            ColumnLoader(balance_column),
-            ColumnLoader(Currency.symbol),
-            Account
-        )).all()
-        log.debug("Balances per account (with dirty operations): %s", balance_per_account)
-
-        for balance, currency, account in balance_per_account:
-            if account.type == AccountType.active and balance < 0:
-                raise InvalidDocumentException(
-                    "Active account %s balance will become less than zero which is invalid"
-                    "(estimated balance: %s %s)" % (account.address, balance, currency)
-                )
-            if account.type == AccountType.passive and balance > 0:
-                raise InvalidDocumentException(
-                    "Passive account %s balance will become greater than zero which is invalid"
-                    "(estimated balance: %s %s)" % (account.address, balance, currency)
-                )
+    def _violations_query(self):
+        """Query returning only rows violating document constraints.
 
-        return True
+        Performs all the checks of `is_valid` in a single statement: each row contains
+        the name of the failed check (`imbalance`, `dirty` or `clean`), account address
+        (not set for imbalances), currency symbol and the estimated balance.
+        """
+        document_balances = db.select([
+            Operation.account,
+            Operation.currency,
+            db.func.sum(Operation.amount).label('amount'),
+        ]).where(
+            Operation.document == self.id
+        ).group_by(Operation.account, Operation.currency).cte('document_balances')
+
+        # total sum of the document operations should be zero per each currency
+        currency_sum = db.func.sum(document_balances.c.amount)
+        imbalanced = db.select([
+            db.literal_column("'imbalance'").label('check'),
+            db.cast(db.null(), db.Unicode).label('address'),
+            Currency.symbol,
+            currency_sum.label('balance'),
+        ]).select_from(
+            document_balances.join(Currency, Currency.id == document_balances.c.currency)
+        ).group_by(Currency.symbol).having(currency_sum != 0)
+
+        # only (account, currency) pairs touched by the document may become invalid,
+        # so materialized balances of these pairs are enough to check the document
+        from_stmt = document_balances.outerjoin(Balance, and_(
+            Balance.account == document_balances.c.account,
+            Balance.currency == document_balances.c.currency,
+        )).join(
+            Account, Account.id == document_balances.c.account
+        ).join(
+            Currency, Currency.id == document_balances.c.currency
+        )
+        committed = db.func.coalesce(Balance.committed, 0)
+        # pending balance already contains operations of the document
+        dirty = committed + db.func.coalesce(Balance.pending, 0)
+        clean = committed if self.committed else committed + document_balances.c.amount
+
+        checks = [imbalanced]
+        for check, balance in (('dirty', dirty), ('clean', clean)):
+            checks.append(db.select([
+                db.literal_column("'%s'" % check).label('check'),
+                Account.address,
+                Currency.symbol,
+                balance.label('balance'),
+            ]).select_from(from_stmt).where(db.or_(
+                and_(Account.type == AccountType.active, balance < 0),
+                and_(Account.type == AccountType.passive, balance > 0),
+            )))
+        return db.union_all(*checks)
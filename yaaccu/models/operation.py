@@ -2,10 +2,23 @@ from yaaccu.db import db
 
 
 class Operation(db.Model):
+    """Balance change of a single account in a single currency made by the document.
+
+    Operations are partitioned by document id using the same bounds as documents
+    (see `yaaccu.partitions`), so the primary key includes the document.
+    """
     __tablename__ = 'operations'
+    __table_args__ = {'postgresql_partition_by': 'RANGE (document)'}
 
-    id = db.Column(db.BigInteger(), primary_key=True)
-    document = db.Column(db.BigInteger(), db.ForeignKey('documents.id'))
+    id = db.Column(db.BigInteger(), autoincrement=True)
+    document = db.Column(db.BigInteger(), db.ForeignKey('documents.id'), nullable=False)
     account = db.Column(db.BigInteger(), db.ForeignKey('accounts.id'))
     currency = db.Column(db.BigInteger(), db.ForeignKey('currencies.id'))
     amount = db.Column(db.Numeric(precision=16, scale=4))
+
+    # operations of the document (validation, commit)
+    _pk = db.PrimaryKeyConstraint('document', 'id')
+    # covers amount and document columns as well (see migrations)
+    _account_currency_idx = db.Index('ix_operations_account_currency', 'account', 'currency')
+    # keyset pagination of the account history
+    _account_id_idx = db.Index('ix_operations_account_id', 'account', 'id')
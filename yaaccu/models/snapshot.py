@@ -0,0 +1,198 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, union_all
+from sqlalchemy.dialects.postgresql import insert
+
+import yaaccu.settings as config
+from yaaccu.db import db
+
+from .operation import Operation
+
+log = logging.getLogger('yaaccu')
+
+#: advisory lock serializing snapshots with document commits
+SNAPSHOT_LOCK = 0x79616363
+
+
+class BalanceSnapshot(db.Model):
+    """Checkpoint of committed balances.
+
+    Each snapshot is a set of rows sharing the same `document` (the snapshot horizon):
+    the balance of the account is the sum of operations of committed documents with id
+    less or equal to the horizon. Documents behind the latest horizon can't be
+    committed anymore, so the balance is never changed afterwards. The horizon doesn't
+    pass documents which are not committed yet unless they are abandoned (see `take`).
+
+    The actual committed balance is the snapshot balance plus the sum of committed
+    operations after the horizon, so it is not required to sum history since genesis.
+    """
+    __tablename__ = 'balance_snapshots'
+
+    #: snapshot horizon, i.e. the last document included into the snapshot
+    document = db.Column(db.BigInteger(), primary_key=True)
+    account = db.Column(db.BigInteger(), db.ForeignKey('accounts.id'), primary_key=True)
+    currency = db.Column(db.BigInteger(), db.ForeignKey('currencies.id'), primary_key=True)
+    balance = db.Column(db.Numeric(precision=32, scale=4), nullable=False)
+
+    @classmethod
+    def horizon(cls, as_of: Optional[int] = None):
+        """Query the horizon of the latest snapshot (or the latest one not after `as_of`).
+
+        Returns 0 if there are no snapshots yet.
+        """
+        query = db.select([db.func.coalesce(db.func.max(cls.document), 0)])
+        if as_of is not None:
+            query = query.where(cls.document <= as_of)
+        return query.as_scalar()
+
+    @classmethod
+    async def lock_shared(cls):
+        """Prevent snapshots from being taken until the end of the current transaction.
+        """
+        await db.status(db.select([db.func.pg_advisory_xact_lock_shared(SNAPSHOT_LOCK)]))
+
+    @classmethod
+    def committed_balances(cls, as_of: Optional[int] = None, full: bool = False,
+                           as_of_commit: Optional[int] = None):
+        """Query committed balances per account and currency.
+
+        Balances are calculated as the latest snapshot plus committed operations after it.
+
+        :param as_of: calculate balances as of the given document id (including)
+        :param full: ignore snapshots and sum the whole history of operations
+        :param as_of_commit: calculate balances as of the given commit
+            (`Document.commit_seq`, including)
+        :return: selectable with `account`, `currency` and `balance` columns
+        """
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from .document import Document
+
+        if full:
+            horizon = db.literal(0)
+        elif as_of_commit is not None:
+            # the latest snapshot without documents committed after the commit
+            committed_after = db.select([db.func.min(Document.id)]).where(
+                Document.commit_seq > as_of_commit
+            ).as_scalar()
+            horizon = db.select([db.func.coalesce(db.func.max(cls.document), 0)]).where(
+                db.or_(committed_after.is_(None), cls.document < committed_after)
+            ).as_scalar()
+        else:
+            horizon = cls.horizon(as_of)
+        snapshot_rows = db.select([
+            cls.account,
+            cls.currency,
+            cls.balance.label('amount'),
+        ]).where(cls.document == horizon)
+        operation_rows = db.select([
+            Operation.account,
+            Operation.currency,
+            Operation.amount,
+        ]).select_from(Operation.join(Document)).where(and_(
+            Document.committed.is_(True),
+            # both tables are pruned to partitions after the horizon
+            Operation.document > horizon,
+            Document.id > horizon,
+        ))
+        if as_of is not None:
+            operation_rows = operation_rows.where(and_(
+                Operation.document <= as_of,
+                Document.id <= as_of,
+            ))
+        if as_of_commit is not None:
+            operation_rows = operation_rows.where(Document.commit_seq <= as_of_commit)
+        rows = union_all(snapshot_rows, operation_rows).alias('ledger_rows')
+
+        return db.select([
+            rows.c.account,
+            rows.c.currency,
+            db.func.sum(rows.c.amount).label('balance'),
+        ]).group_by(rows.c.account, rows.c.currency).alias('committed_balances')
+
+    @classmethod
+    async def take(cls,
+                   interval: int = config.SNAPSHOT_INTERVAL,
+                   grace_interval: int = config.SNAPSHOT_GRACE_INTERVAL,
+                   abandon_interval: Optional[int] = config.SNAPSHOT_ABANDON_INTERVAL
+                   ) -> Optional[int]:
+        """Take a new snapshot if at least `interval` documents were added after the latest one.
+
+        The horizon of the new snapshot is the latest document created before
+        `grace_interval` seconds ago (so documents being inserted are not passed), but
+        before any document not committed yet: a document waiting for its commit holds
+        snapshots back.
+
+        If `abandon_interval` is set, documents not committed within that many seconds
+        (e.g. left by a crashed client) don't hold the horizon back. They end up behind
+        it and can't be committed anymore, so they are aborted releasing their pending
+        balances (see `Document.abandon`).
+
+        Commits are blocked only while the horizon is chosen and documents behind it are
+        aborted: balances as of the horizon can't change afterwards, so they are summed
+        without blocking commits.
+
+        :return: horizon of the new snapshot or None if there was no need to take it
+        """
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from .document import Document
+
+        async with db.transaction():
+            await db.status(db.select([db.func.pg_advisory_xact_lock(SNAPSHOT_LOCK)]))
+
+            previous = await db.scalar(db.select([cls.horizon()]))
+            now = datetime.utcnow()
+            cutoff = now - timedelta(seconds=grace_interval)
+            # documents behind the previous horizon are settled already,
+            # so only partitions after it are read
+            settled = db.select([db.func.max(Document.id)]).where(and_(
+                Document.id > previous,
+                Document.created_at < cutoff,
+            ))
+            in_progress = db.select([db.func.min(Document.id) - 1]).where(and_(
+                Document.id > previous,
+                Document.committed.isnot(True),
+            ))
+            if abandon_interval is not None:
+                in_progress = in_progress.where(
+                    Document.created_at >= now - timedelta(seconds=abandon_interval)
+                )
+            horizon = await db.scalar(db.select([
+                db.func.least(
+                    db.func.coalesce(settled.as_scalar(), previous), in_progress.as_scalar()
+                )
+            ]))
+            if horizon is None or horizon - previous < interval:
+                return None
+            abandoned = 0
+            if abandon_interval is not None:
+                abandoned = await Document.abandon(previous, horizon)
+        if abandoned:
+            log.warning("%s documents not committed behind horizon %s were aborted",
+                        abandoned, horizon)
+
+        # documents behind the horizon are committed or aborted already,
+        # so balances as of the horizon can't be changed by commits anymore
+        rows = cls.committed_balances(as_of=horizon)
+        # concurrent snapshots may choose the same horizon
+        await db.status(insert(cls.__table__).from_select(
+            ['document', 'account', 'currency', 'balance'],
+            db.select([
+                db.cast(horizon, db.BigInteger),
+                rows.c.account,
+                rows.c.currency,
+                rows.c.balance,
+            ])
+        ).on_conflict_do_nothing())
+        log.info("Balance snapshot taken at document %s", horizon)
+        return horizon
+
+    @classmethod
+    async def compact(cls, keep: int = config.SNAPSHOT_KEEP):
+        """Drop all snapshots except `keep` latest ones.
+        """
+        oldest_kept = db.select([cls.document]).group_by(cls.document).order_by(
+            cls.document.desc()
+        ).offset(keep - 1).limit(1).as_scalar()
+        await cls.delete.where(cls.document < oldest_kept).gino.status()
@@ -0,0 +1,149 @@
+"""Range partitions of the ledger tables.
+
+`documents` are partitioned by id and `operations` by document id using the same
+bounds, so operations of a document are stored in the partition with the same number
+as the document. Queries filtering by document id (validation and commit of a document,
+operations after the snapshot horizon) only touch the relevant partitions, and old
+partitions covered by snapshots are not read by hot queries anymore.
+
+Partitions are created ahead of time: `ensure_partitions` is run periodically in
+background of the api process (see `yaaccu.tasks`). Documents outrunning partitions
+created ahead are stored in the default partitions until `ensure_partitions` moves them
+into the partitions covering them, so writes never fail for a missing partition.
+
+The size of partitions is chosen by the migration creating the first ones and is
+derived from the bounds of existing partitions afterwards (see `partition_bounds`).
+"""
+import logging
+import re
+from typing import Dict, List, Tuple
+
+import yaaccu.settings as config
+from yaaccu.db import db
+from yaaccu.models.document import Document
+
+log = logging.getLogger(__name__)
+
+#: partitioned tables and their partition keys, referenced tables go first
+PARTITIONED_TABLES = (('documents', 'id'), ('operations', 'document'))
+#: advisory lock serializing partition maintenance of several processes
+PARTITION_LOCK = 0x79617274
+
+_PARTITIONS_QUERY = db.text(
+    "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits "
+    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+    "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+    "WHERE parent.relname = ANY(:tables)"
+)
+_RANGE_BOUND = re.compile(r"FOR VALUES FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+
+def partition_name(table: str, number: int) -> str:
+    return '%s_p%d' % (table, number)
+
+
+def default_partition_name(table: str) -> str:
+    return '%s_default' % table
+
+
+def partition_ddl(table: str, number: int, size: int) -> str:
+    """Statement creating the partition covering ids from `number * size` (including)
+    to `(number + 1) * size` (excluding).
+    """
+    return "CREATE TABLE %s PARTITION OF %s FOR VALUES FROM (%d) TO (%d)" % (
+        partition_name(table, number), table, number * size, (number + 1) * size
+    )
+
+
+async def partition_bounds() -> Dict[str, Tuple[int, int]]:
+    """Bounds (lower including, upper excluding) of range partitions by name.
+
+    Default partitions are not included.
+    """
+    bounds = {}
+    for name, bound in await db.all(
+            _PARTITIONS_QUERY, tables=[table for table, _ in PARTITIONED_TABLES]
+    ):
+        match = _RANGE_BOUND.match(bound)
+        if match:
+            bounds[name] = (int(match.group(1)), int(match.group(2)))
+    return bounds
+
+
+def partition_size(bounds: Dict[str, Tuple[int, int]]) -> int:
+    """Number of ids per partition: the size of the latest partition of documents.
+
+    :param bounds: bounds of existing partitions (see `partition_bounds`)
+    """
+    lower, upper = max(
+        bound for name, bound in bounds.items() if name.startswith('documents_')
+    )
+    return upper - lower
+
+
+async def _move_from_default(tables: List[Tuple[str, str]], number: int, size: int):
+    """Create partitions of the tables filling them with rows of default partitions.
+
+    Partitions are attached once filled: rows of the range must be moved out of the
+    default partition before a partition covering it can be created.
+    """
+    lower, upper = number * size, (number + 1) * size
+    for table, _ in tables:
+        await db.status(db.text("CREATE TABLE %s (LIKE %s)" % (
+            partition_name(table, number), default_partition_name(table)
+        )))
+    # rows of referencing tables are moved out first to not violate foreign keys
+    for table, key in reversed(tables):
+        await db.status(db.text(
+            "WITH moved AS (DELETE FROM {default} WHERE {key} >= :lower AND {key} < :upper "
+            "RETURNING *) INSERT INTO {partition} SELECT * FROM moved".format(
+                default=default_partition_name(table),
+                key=key,
+                partition=partition_name(table, number),
+            )
+        ), lower=lower, upper=upper)
+    for table, _ in tables:
+        await db.status(db.text(
+            "ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (%d) TO (%d)" % (
+                table, partition_name(table, number), lower, upper
+            )
+        ))
+
+
+async def ensure_partitions(reserve: int = 0,
+                            ahead: int = config.PARTITIONS_AHEAD) -> List[str]:
+    """Create missing partitions up to `ahead` partitions after the latest document.
+
+    Documents stored in the default partitions are moved into created partitions.
+
+    :param reserve: number of documents about to be created (e.g. by a bulk import)
+    :return: names of created partitions
+    """
+    created = []
+    async with db.transaction():
+        await db.status(db.select([db.func.pg_advisory_xact_lock(PARTITION_LOCK)]))
+        latest = await db.scalar(db.select([db.func.coalesce(db.func.max(Document.id), 0)]))
+        bounds = await partition_bounds()
+        size = partition_size(bounds)
+        for number in range(latest // size, (latest + reserve) // size + ahead + 1):
+            missing = [
+                (table, key) for table, key in PARTITIONED_TABLES
+                if partition_name(table, number) not in bounds
+            ]
+            if not missing:
+                continue
+            outrun = await db.scalar(db.text(
+                "SELECT EXISTS (SELECT 1 FROM %s WHERE id >= :lower AND id < :upper)"
+                % default_partition_name('documents')
+            ), lower=number * size, upper=(number + 1) * size)
+            if outrun:
+                log.warning("Documents of partition %s are moved from the default partition",
+                            number)
+                await _move_from_default(missing, number, size)
+            else:
+                for table, _ in missing:
+                    await db.status(db.text(partition_ddl(table, number, size)))
+            created += [partition_name(table, number) for table, _ in missing]
+    if created:
+        log.info("Partitions created: %s", ', '.join(created))
+    return created
@@ -0,0 +1,98 @@
+"""Routing of read-only queries to replicas.
+
+Reads of read-only endpoints (balances, history) are sent to replicas configured by
+`DB_REPLICA_DSNS` to not compete with the write path on the primary. Replicas lag
+behind the primary, so clients may pass the id of their latest document as the
+`X-Min-Document` header to read their own writes: the replica is used only once it
+has replayed the commit of the document, otherwise the primary is used after
+`REPLICA_WAIT_TIMEOUT`. Documents which are not committed on the primary (not
+committed yet, aborted or never created) are read from the primary at once.
+
+Without replicas all queries are sent to the primary.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from typing import List, Optional
+
+import gino
+from gino.engine import GinoEngine
+from sqlalchemy.engine.url import make_url
+
+import yaaccu.settings as config
+from yaaccu.db import db
+from yaaccu.metrics import measure
+from yaaccu.models.document import Document
+
+log = logging.getLogger(__name__)
+
+
+class Replicas:
+    """Pools of replica connections chosen in round-robin order.
+    """
+
+    def __init__(self):
+        self.engines: List[GinoEngine] = []
+        self._counter = itertools.count()
+
+    async def connect(self, dsns):
+        for dsn in dsns:
+            self.engines.append(await gino.create_engine(
+                make_url(dsn),
+                echo=config.DB_ECHO,
+                min_size=config.DB_REPLICA_POOL_MIN_SIZE,
+                max_size=config.DB_REPLICA_POOL_MAX_SIZE,
+                ssl=config.DB_SSL,
+                **db.config['kwargs'],
+            ))
+
+    async def close(self):
+        engines, self.engines = self.engines, []
+        for engine in engines:
+            await engine.close()
+
+    def choose(self) -> Optional[GinoEngine]:
+        if not self.engines:
+            return None
+        return self.engines[next(self._counter) % len(self.engines)]
+
+
+replicas = Replicas()
+
+
+async def _has_committed(bind, document: int) -> bool:
+    # commits are replayed in order, so everything committed before is there as well
+    return bool(await bind.scalar(
+        db.select([Document.committed]).where(Document.id == document)
+    ))
+
+
+async def read_engine(min_document: Optional[int] = None):
+    """Choose the bind to run read-only queries with.
+
+    :param min_document: id of the document which commit must be visible
+    :return: a replica engine or `db` (the primary)
+    """
+    engine = replicas.choose()
+    if engine is None:
+        return db
+    if min_document is None:
+        return engine
+
+    if await _has_committed(engine, min_document):
+        return engine
+    if not await _has_committed(db, min_document):
+        # the replica would never replay the commit
+        log.info("Document %s is not committed, reading from the primary", min_document)
+        return db
+
+    deadline = time.monotonic() + config.REPLICA_WAIT_TIMEOUT
+    with measure('replica_wait'):
+        while not await _has_committed(engine, min_document):
+            if time.monotonic() >= deadline:
+                log.info("Replica hasn't replayed document %s yet, reading from the primary",
+                         min_document)
+                return db
+            await asyncio.sleep(config.REPLICA_POLL_INTERVAL)
+    return engine
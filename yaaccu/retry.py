@@ -0,0 +1,94 @@
+"""Server-side retries of documents conflicting with documents not committed yet.
+
+Concurrent documents see pending operations of each other, so a document may be
+rejected by the dirty check (see `Document.is_valid`) even though it is valid against
+committed balances. Such conflicts are transient: they are resolved once conflicting
+documents are committed or aborted, so they are retried with a jittered backoff
+instead of making every client implement its own retry loop. Documents invalid against
+committed balances are never retried.
+"""
+import asyncio
+import logging
+import random
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+import yaaccu.settings as config
+from yaaccu.models.account import Account
+from yaaccu.models.currency import Currency
+from yaaccu.models.document import Document, DocumentConflict, InvalidDocumentException
+
+log = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter limited by the number of attempts and the deadline.
+
+    Settings (`DOCUMENT_RETRY_*`) are used by default.
+    """
+
+    def __init__(self,
+                 attempts: Optional[int] = None,
+                 backoff: Optional[float] = None,
+                 max_backoff: Optional[float] = None,
+                 deadline: Optional[float] = None):
+        self.attempts = config.DOCUMENT_RETRY_ATTEMPTS if attempts is None else attempts
+        self.backoff = config.DOCUMENT_RETRY_BACKOFF if backoff is None else backoff
+        self.max_backoff = config.DOCUMENT_RETRY_MAX_BACKOFF if max_backoff is None else max_backoff
+        self.deadline = config.DOCUMENT_RETRY_DEADLINE if deadline is None else deadline
+
+    def delay(self, attempt: int) -> float:
+        """Random delay before the attempt following the given one.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+async def create_and_commit(operations: List[Tuple[Account, Currency, Decimal]],
+                            policy: Optional[RetryPolicy] = None,
+                            signature: Optional[str] = None,
+                            nonce: Optional[str] = None,
+                            signer: Optional[Account] = None) -> Tuple[Document, int]:
+    """Create document with given operations and commit it retrying transient conflicts.
+
+    Conflicts found on creation are retried by creating the document again; conflicts
+    found on commit are retried by committing the same document. The document is
+    aborted if it can't be committed.
+
+    :param signature: client signature of the document
+    :param nonce: client nonce of the signed document
+    :param signer: account which signed the document
+    :return: committed document and the number of attempts made
+    :raises DocumentConflict: conflicts are not resolved within the policy limits
+    :raises InvalidDocumentException: the document is invalid against committed balances
+    """
+    policy = policy or RetryPolicy()
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    doc: Optional[Document] = None
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if doc is None:
+                created = await Document.create_with_operations(
+                    operations, raise_exception=True, signature=signature, nonce=nonce,
+                    signer=signer,
+                )
+                # invalid documents are raised instead
+                assert created is not None
+                doc = created
+            await doc.commit(raise_exception=True)
+            return doc, attempt
+        except DocumentConflict as e:
+            delay = policy.delay(attempt)
+            if attempt < policy.attempts and loop.time() - started + delay < policy.deadline:
+                log.debug("Document conflict, retry in %.3f seconds", delay)
+                await asyncio.sleep(delay)
+                continue
+            error: InvalidDocumentException = e
+        except InvalidDocumentException as e:
+            error = e
+        if doc is not None:
+            await doc.abort()
+        error.attempts = attempt
+        raise error
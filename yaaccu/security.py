@@ -7,19 +7,33 @@ import orjson
 from fastapi import Depends, HTTPException
 from fastapi.security import APIKeyHeader
 
+import yaaccu.settings as config
+from yaaccu.cache import LRUCache
 from yaaccu.models.account import Account
-from yaaccu.signature import check_signature, InvalidSignature
+from yaaccu.signature import check_signature_async, InvalidSignature
 
 token_header = APIKeyHeader(name='X-Token')
 
 TOKEN_EXPIRE_INTERVAL = 3600
 
+#: public keys of verified tokens; entries expire with tokens
+token_cache = LRUCache('tokens', maxsize=config.TOKEN_CACHE_SIZE)
+#: accounts by public key
+account_cache = LRUCache(
+    'accounts', maxsize=config.ACCOUNT_CACHE_SIZE, ttl=config.ACCOUNT_CACHE_TTL
+)
 
-def decode_token(token: str):
+
+async def decode_token(token: str):
     """Decode base64 token containing json-serialized value.
 
     Check sign, token expiration time and return encoded public key.
+    Verified tokens are cached until expired to skip decoding and signature check.
     """
+    pub_key = token_cache.get(token)
+    if pub_key is not None:
+        return pub_key
+
     try:
         decoded = b64decode(token.encode())
         key_data = orjson.loads(decoded)
@@ -34,7 +48,7 @@ def decode_token(token: str):
         raise HTTPException(status_code=403, detail="Token expired")
 
     try:
-        check_signature(
+        await check_signature_async(
             ''.join([pub_key, str(timestamp)]),
             signature,
             pub_key
@@ -43,19 +57,24 @@ def decode_token(token: str):
         logging.error("Invalid token signature. Might be access violation.")
         raise HTTPException(status_code=403, detail="Invalid token") from e
 
+    token_cache.set(token, pub_key, expires_at=timestamp + TOKEN_EXPIRE_INTERVAL)
     return pub_key
 
 
-def get_current_pub_key(token: str = Depends(token_header)):
+async def get_current_pub_key(token: str = Depends(token_header)):
     """Get public key of the current client from the token.
     """
-    return decode_token(token)
+    return await decode_token(token)
 
 
 async def get_current_account(pub_key: str = Depends(get_current_pub_key)):
     """Get current Account or return 403 response.
     """
+    account = account_cache.get(pub_key)
+    if account is not None:
+        return account
     account = await Account.query.where(Account.pub_key == pub_key).gino.first()
     if account is None:
         raise HTTPException(status_code=403, detail="Account doesn't exist")
+    account_cache.set(pub_key, account)
     return account
@@ -0,0 +1,72 @@
+"""In-process sequencing of documents involving the same accounts.
+
+Concurrent documents see each other's pending operations during the dirty check
+(see `Document.is_valid`), so under contention on a hot account they may reject each
+other and clients have to retry. Sequencing documents of the same accounts removes
+such rejections, while documents of disjoint accounts still proceed in parallel.
+
+Sequencing works within a single process only: documents created by other processes
+are validated as usual.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Optional
+
+import yaaccu.settings as config
+from yaaccu.metrics import measure
+
+
+class Sequencer:
+    """Serialize blocks of code involving the same accounts.
+
+    Accounts are spread over `shards` locks. A block acquires locks of all involved
+    shards in ascending order, so there are no deadlocks between blocks. Waiters of
+    asyncio locks are woken up in FIFO order, so blocks are executed in arrival order.
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _lock(self, shard: int) -> asyncio.Lock:
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            # locks are bound to the loop they were used in first
+            self._locks = {}
+            self._loop = loop
+        lock = self._locks.get(shard)
+        if lock is None:
+            lock = self._locks[shard] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def sequenced(self, account_ids: Iterable[int]):
+        shards = sorted({account_id % self.shards for account_id in account_ids})
+        acquired = []
+        try:
+            with measure('sequencer'):
+                for shard in shards:
+                    lock = self._lock(shard)
+                    await lock.acquire()
+                    acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+
+sequencer = Sequencer(config.SEQUENCER_SHARDS)
+
+
+@asynccontextmanager
+async def sequenced(account_ids: Iterable[int]):
+    """Sequence the block with other blocks involving the same accounts.
+
+    Does nothing unless `SEQUENCER` is enabled.
+    """
+    if not config.SEQUENCER:
+        yield
+        return
+    async with sequencer.sequenced(account_ids):
+        yield
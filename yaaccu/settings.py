@@ -1,6 +1,6 @@
 from sqlalchemy.engine.url import URL, make_url
 from starlette.config import Config
-from starlette.datastructures import Secret
+from starlette.datastructures import CommaSeparatedStrings, Secret
 
 config = Config(".env")
 
@@ -33,12 +33,150 @@ DB_POOL_MIN_SIZE = config("DB_POOL_MIN_SIZE", cast=int, default=1)
 DB_POOL_MAX_SIZE = config("DB_POOL_MAX_SIZE", cast=int, default=16)
 DB_ECHO = config("DB_ECHO", cast=bool, default=False)
 DB_SSL = config("DB_SSL", default=None)
+#: "request" - the connection acquired by the first query of the request is held until the
+#: request is finished; "transaction" - connections are acquired for a single statement or
+#: transaction only, so requests don't hold them while doing other work (e.g. signature checks)
+DB_POOL_MODE = config("DB_POOL_MODE", default="request")
 DB_USE_CONNECTION_FOR_REQUEST = config(
-    "DB_USE_CONNECTION_FOR_REQUEST", cast=bool, default=True
+    "DB_USE_CONNECTION_FOR_REQUEST", cast=bool, default=DB_POOL_MODE == "request"
 )
+#: number of prepared statements cached per connection; set 0 behind PgBouncer
+#: in the transaction pooling mode, so only unnamed statements are used
+DB_STATEMENT_CACHE_SIZE = config("DB_STATEMENT_CACHE_SIZE", cast=int, default=100)
 DB_RETRY_LIMIT = config("DB_RETRY_LIMIT", cast=int, default=1)
 DB_RETRY_INTERVAL = config("DB_RETRY_INTERVAL", cast=int, default=1)
 
+# Replicas
+
+#: comma separated DSNs of read replicas serving read-only endpoints (/balance, /history, /export)
+DB_REPLICA_DSNS = config("DB_REPLICA_DSNS", cast=CommaSeparatedStrings, default="")
+DB_REPLICA_POOL_MIN_SIZE = config("DB_REPLICA_POOL_MIN_SIZE", cast=int, default=DB_POOL_MIN_SIZE)
+DB_REPLICA_POOL_MAX_SIZE = config("DB_REPLICA_POOL_MAX_SIZE", cast=int, default=DB_POOL_MAX_SIZE)
+#: seconds to wait for the replica to replay the commit of the document requested by
+#: the X-Min-Document header before reading from the primary
+REPLICA_WAIT_TIMEOUT = config("REPLICA_WAIT_TIMEOUT", cast=float, default=0.5)
+#: seconds between checks of the replica while waiting
+REPLICA_POLL_INTERVAL = config("REPLICA_POLL_INTERVAL", cast=float, default=0.01)
+
+# Documents
+
+#: documents with at least this number of operations are written using COPY
+OPERATIONS_COPY_THRESHOLD = config("OPERATIONS_COPY_THRESHOLD", cast=int, default=1000)
+
+# History and export
+
+#: number of operations fetched from the server-side cursor at once by /history
+HISTORY_CHUNK_SIZE = config("HISTORY_CHUNK_SIZE", cast=int, default=1000)
+#: max value of the limit parameter of /history
+HISTORY_MAX_LIMIT = config("HISTORY_MAX_LIMIT", cast=int, default=100000)
+#: number of rows fetched from the server-side cursor at once by exports
+EXPORT_CHUNK_SIZE = config("EXPORT_CHUNK_SIZE", cast=int, default=10000)
+#: token required by /export in the X-Export-Token header; /export is disabled if not set
+EXPORT_TOKEN = config("EXPORT_TOKEN", cast=Secret, default=None)
+
+# Import
+
+#: number of rows copied into the staging table at once by `yaaccu import`
+IMPORT_COPY_BATCH_SIZE = config("IMPORT_COPY_BATCH_SIZE", cast=int, default=10000)
+#: number of imported documents promoted in a single transaction
+IMPORT_CHUNK_SIZE = config("IMPORT_CHUNK_SIZE", cast=int, default=10000)
+
+# Audit
+
+#: number of processes auditing the ledger, the number of CPUs by default
+AUDIT_WORKERS = config("AUDIT_WORKERS", cast=int, default=None)
+#: number of operations checked at once by every process
+AUDIT_CHUNK_SIZE = config("AUDIT_CHUNK_SIZE", cast=int, default=1000000)
+#: max number of reported issues of every kind per process
+AUDIT_REPORT_LIMIT = config("AUDIT_REPORT_LIMIT", cast=int, default=1000)
+
+# Retries
+
+#: max attempts to create and commit a document conflicting with documents not committed yet
+DOCUMENT_RETRY_ATTEMPTS = config("DOCUMENT_RETRY_ATTEMPTS", cast=int, default=3)
+#: max delay (seconds) before the second attempt, doubled for every next one (full jitter)
+DOCUMENT_RETRY_BACKOFF = config("DOCUMENT_RETRY_BACKOFF", cast=float, default=0.01)
+#: upper limit of the delay between attempts (seconds)
+DOCUMENT_RETRY_MAX_BACKOFF = config("DOCUMENT_RETRY_MAX_BACKOFF", cast=float, default=0.2)
+#: don't start new attempts after this number of seconds since the first one
+DOCUMENT_RETRY_DEADLINE = config("DOCUMENT_RETRY_DEADLINE", cast=float, default=1.0)
+
+# Sequencer
+
+#: serialize documents involving the same accounts within the process (see yaaccu.sequencer)
+SEQUENCER = config("SEQUENCER", cast=bool, default=False)
+#: number of sequencer locks accounts are spread over
+SEQUENCER_SHARDS = config("SEQUENCER_SHARDS", cast=int, default=1024)
+
+# Signature verification
+
+#: executor running signature checks off the event loop: thread, process or none
+SIGNATURE_EXECUTOR = config("SIGNATURE_EXECUTOR", default="thread")
+#: number of executor workers (the number of CPUs by default)
+SIGNATURE_WORKERS = config("SIGNATURE_WORKERS", cast=int, default=None)
+
+# Metrics
+
+#: add Server-Timing header with timings of request phases to responses
+SERVER_TIMING = config("SERVER_TIMING", cast=bool, default=True)
+
+# Caches
+
+#: max number of verified auth tokens cached
+TOKEN_CACHE_SIZE = config("TOKEN_CACHE_SIZE", cast=int, default=10000)
+#: max number of parsed RSA public keys cached
+KEY_CACHE_SIZE = config("KEY_CACHE_SIZE", cast=int, default=10000)
+#: max number of accounts cached by public key
+ACCOUNT_CACHE_SIZE = config("ACCOUNT_CACHE_SIZE", cast=int, default=10000)
+#: seconds cached accounts are considered fresh
+ACCOUNT_CACHE_TTL = config("ACCOUNT_CACHE_TTL", cast=int, default=60)
+#: max number of accounts cached by address (shares ACCOUNT_CACHE_TTL)
+ADDRESS_CACHE_SIZE = config("ADDRESS_CACHE_SIZE", cast=int, default=10000)
+#: max number of currencies cached by symbol (all of them are loaded at startup)
+CURRENCY_CACHE_SIZE = config("CURRENCY_CACHE_SIZE", cast=int, default=1000)
+#: invalidate caches on changes made by other processes using LISTEN/NOTIFY
+#: (requires a dedicated connection, e.g. not available behind pgbouncer transaction pooling)
+CACHE_INVALIDATION = config("CACHE_INVALIDATION", cast=bool, default=True)
+#: token required by /stats and /metrics in the X-Stats-Token header; they are disabled if
+#: not set
+STATS_TOKEN = config("STATS_TOKEN", cast=Secret, default=None)
+
+# Balance snapshots
+
+#: take a snapshot of committed balances every SNAPSHOT_INTERVAL documents
+SNAPSHOT_INTERVAL = config("SNAPSHOT_INTERVAL", cast=int, default=10000)
+#: number of latest snapshots kept by compaction
+SNAPSHOT_KEEP = config("SNAPSHOT_KEEP", cast=int, default=2)
+#: documents created within this interval (seconds) are not included into snapshots yet
+SNAPSHOT_GRACE_INTERVAL = config("SNAPSHOT_GRACE_INTERVAL", cast=int, default=60)
+#: documents not committed within this interval (seconds) are aborted by snapshots;
+#: documents are never aborted if not set, so they hold snapshots back until committed
+SNAPSHOT_ABANDON_INTERVAL = config("SNAPSHOT_ABANDON_INTERVAL", cast=int, default=None)
+#: run snapshot compaction in background of the api process
+SNAPSHOT_COMPACTION = config("SNAPSHOT_COMPACTION", cast=bool, default=True)
+#: seconds between background compaction runs
+SNAPSHOT_COMPACTION_INTERVAL = config("SNAPSHOT_COMPACTION_INTERVAL", cast=int, default=60)
+
+# Partitions
+
+#: number of partitions kept ahead of the partition of the latest document
+PARTITIONS_AHEAD = config("PARTITIONS_AHEAD", cast=int, default=2)
+#: create future partitions in background of the api process
+PARTITION_MAINTENANCE = config("PARTITION_MAINTENANCE", cast=bool, default=True)
+#: seconds between background partition maintenance runs
+PARTITION_MAINTENANCE_INTERVAL = config(
+    "PARTITION_MAINTENANCE_INTERVAL", cast=int, default=3600
+)
+
+# Hash chain
+
+#: seal committed documents behind the snapshot horizon in background of the api process
+HASH_SEALING = config("HASH_SEALING", cast=bool, default=True)
+#: seconds between background sealing runs
+HASH_SEAL_INTERVAL = config("HASH_SEAL_INTERVAL", cast=int, default=60)
+#: max number of documents sealed into a single checkpoint
+HASH_SEAL_BATCH_SIZE = config("HASH_SEAL_BATCH_SIZE", cast=int, default=10000)
+
 # Test database
 
 TEST_DB_DRIVER = config("TEST_DB_DRIVER", default=DB_DRIVER)
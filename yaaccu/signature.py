@@ -1,12 +1,49 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from functools import partial
+from typing import Iterable, List, Optional, Sequence, Tuple
+
 from Cryptodome.Hash import SHA3_256
 from Cryptodome.PublicKey import RSA
 from Cryptodome.Signature import pss
 
+import yaaccu.settings as config
+from yaaccu.cache import LRUCache
+from yaaccu.metrics import measured
+
+#: parsed public keys by their PEM representation
+key_cache = LRUCache('keys', maxsize=config.KEY_CACHE_SIZE)
+
+#: amounts of signed documents are serialized with the precision of stored amounts
+AMOUNT_QUANTUM = Decimal('0.0001')
+
+_executor: Optional[Executor] = None
+_executor_workers = 1
+_executor_configured = False
+
 
 class InvalidSignature(Exception):
     pass
 
 
+def import_public_key(pub_key: str):
+    """Import RSA public key caching parsed key objects.
+    """
+    key = key_cache.get(pub_key)
+    if key is None:
+        key = RSA.import_key(pub_key)
+        key_cache.set(pub_key, key)
+    return key
+
+
+def content_hash(content: bytes) -> bytes:
+    """SHA3-256 digest of the content, the same hash signatures are made of.
+    """
+    return SHA3_256.new(content).digest()
+
+
 def check_signature(content: str, signature: str, pub_key: str, raise_exception=True):
     """Check signature on provided content using public key.
 
@@ -18,7 +55,7 @@ def check_signature(content: str, signature: str, pub_key: str, raise_exception=
     """
     try:
         sign = bytes.fromhex(signature)
-        verifier = pss.new(RSA.import_key(pub_key))
+        verifier = pss.new(import_public_key(pub_key))
         # noinspection PyTypeChecker
         verifier.verify(SHA3_256.new(content.encode()), sign)  # type: ignore
     except (TypeError, ValueError) as e:
@@ -28,7 +65,113 @@ def check_signature(content: str, signature: str, pub_key: str, raise_exception=
     return True
 
 
+def normalize_signature(signature: str) -> str:
+    """Canonical form of the hex signature: lowercase without whitespace.
+
+    :raises InvalidSignature: the signature is not a hex string
+    """
+    try:
+        return bytes.fromhex(signature).hex()
+    except ValueError as e:
+        raise InvalidSignature() from e
+
+
+def check_signatures(items: Sequence[Tuple[str, str, str]]) -> List[bool]:
+    """Check several signatures.
+
+    :param items: list of (content, signature, public key) tuples
+    :return: list of flags showing which signatures are valid
+    """
+    return [
+        check_signature(content, signature, pub_key, raise_exception=False)
+        for content, signature, pub_key in items
+    ]
+
+
+def canonical_document(operations: Iterable[Tuple[str, str, Decimal]], nonce: str) -> str:
+    """Canonical serialization of the document signed by clients.
+
+    The nonce chosen by the client goes first, so contents (and signatures) of documents
+    with the same operations differ. It is followed by one ``account|currency|amount``
+    line per operation in the order of the document, where the account is the address,
+    the currency is the symbol and the amount has four decimal places (e.g. ``-1.5000``).
+
+    :param operations: list of (account address, currency symbol, amount) tuples
+    :param nonce: single line nonce unique for documents of the client
+    """
+    return '\n'.join([nonce] + [
+        '%s|%s|%s' % (account, currency, Decimal(amount).quantize(AMOUNT_QUANTUM))
+        for account, currency, amount in operations
+    ])
+
+
 def create_signature(content: str, private_key: str):
     cipher = pss.new(RSA.import_key(private_key))
     # noinspection PyTypeChecker
     return cipher.sign(SHA3_256.new(content.encode())).hex()  # type: ignore
+
+
+def configure_executor(kind: str = config.SIGNATURE_EXECUTOR,
+                       workers: Optional[int] = config.SIGNATURE_WORKERS):
+    """Set up the executor used by `check_signature_async` and `check_signatures_async`.
+
+    :param kind: `thread`, `process` or `none` to check signatures on the event loop
+    :param workers: number of workers, the number of CPUs by default
+    """
+    global _executor, _executor_workers, _executor_configured  # pylint: disable=global-statement
+    shutdown_executor()
+    workers = workers or os.cpu_count() or 1
+    _executor_workers = workers
+    if kind == 'thread':
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='signature')
+    elif kind == 'process':
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    elif kind != 'none':
+        raise ValueError("Unknown signature executor: %s" % kind)
+    _executor_configured = True
+
+
+def shutdown_executor():
+    global _executor, _executor_configured  # pylint: disable=global-statement
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = None
+    _executor_configured = False
+
+
+@measured('crypto')
+async def check_signature_async(content: str, signature: str, pub_key: str,
+                                raise_exception=True):
+    """Check signature like `check_signature` but without blocking the event loop.
+
+    Verification is performed by the executor configured with `SIGNATURE_EXECUTOR`.
+    """
+    if not _executor_configured:
+        configure_executor()
+    if _executor is None:
+        return check_signature(content, signature, pub_key, raise_exception)
+    return await asyncio.get_event_loop().run_in_executor(
+        _executor, partial(check_signature, content, signature, pub_key, raise_exception)
+    )
+
+
+@measured('crypto')
+async def check_signatures_async(items: Sequence[Tuple[str, str, str]]) -> List[bool]:
+    """Check several signatures like `check_signatures` in parallel.
+
+    Items are split into a chunk per worker of the executor configured with
+    `SIGNATURE_EXECUTOR`, so the overhead of passing work to workers is paid once per
+    chunk and every worker parses each public key once (see `key_cache`).
+    """
+    if not _executor_configured:
+        configure_executor()
+    items = list(items)
+    if _executor is None or len(items) < 2:
+        return check_signatures(items)
+    size = -(-len(items) // _executor_workers)
+    loop = asyncio.get_event_loop()
+    results = await asyncio.gather(*[
+        loop.run_in_executor(_executor, check_signatures, items[start:start + size])
+        for start in range(0, len(items), size)
+    ])
+    return [valid for chunk in results for valid in chunk]
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+import yaaccu.settings as config
+from yaaccu.chain import seal
+from yaaccu.db import db
+from yaaccu.lookup import (
+    CACHE_INVALIDATION_CHANNEL,
+    clear_lookup_caches,
+    handle_invalidation,
+    load_currencies,
+)
+from yaaccu.models.snapshot import BalanceSnapshot
+from yaaccu.partitions import ensure_partitions
+
+log = logging.getLogger(__name__)
+
+#: seconds between checks that the listening connection is alive
+LISTEN_HEARTBEAT_INTERVAL = 30
+
+
+async def compact_snapshots(interval: int):
+    """Periodically take balance snapshots and drop outdated ones.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await BalanceSnapshot.take()
+            await BalanceSnapshot.compact()
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Balance snapshot compaction failed")
+
+
+async def maintain_partitions(interval: int):
+    """Periodically create partitions for upcoming documents.
+    """
+    while True:
+        try:
+            await ensure_partitions()
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Partition maintenance failed")
+        await asyncio.sleep(interval)
+
+
+async def seal_documents(interval: int):
+    """Periodically seal documents behind the snapshot horizon into the hash chain.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            while await seal() is not None:
+                pass
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Document sealing failed")
+
+
+async def listen_cache_invalidations():
+    """Apply cache invalidations broadcast by the database.
+
+    Holds a dedicated connection listening to the invalidation channel. Notifications
+    sent while the connection was lost are missed, so caches are dropped on reconnect.
+    """
+    def on_notification(connection, pid, channel, payload):  # pylint: disable=unused-argument
+        handle_invalidation(payload)
+
+    reconnect = False
+    while True:
+        try:
+            async with db.acquire() as conn:
+                raw_conn = await conn.get_raw_connection()
+                await raw_conn.add_listener(CACHE_INVALIDATION_CHANNEL, on_notification)
+                if reconnect:
+                    clear_lookup_caches()
+                # changes made before we started listening
+                await load_currencies()
+                try:
+                    while True:
+                        await asyncio.sleep(LISTEN_HEARTBEAT_INTERVAL)
+                        await raw_conn.execute("SELECT 1")
+                finally:
+                    await raw_conn.remove_listener(CACHE_INVALIDATION_CHANNEL, on_notification)
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Cache invalidation listener failed")
+            await asyncio.sleep(LISTEN_HEARTBEAT_INTERVAL)
+        reconnect = True
+
+
+def start_background_tasks(app):
+    """Start background tasks of the api process.
+    """
+    tasks = []
+    if config.SNAPSHOT_COMPACTION:
+        tasks.append(asyncio.ensure_future(
+            compact_snapshots(config.SNAPSHOT_COMPACTION_INTERVAL)
+        ))
+    if config.PARTITION_MAINTENANCE:
+        tasks.append(asyncio.ensure_future(
+            maintain_partitions(config.PARTITION_MAINTENANCE_INTERVAL)
+        ))
+    if config.HASH_SEALING:
+        tasks.append(asyncio.ensure_future(seal_documents(config.HASH_SEAL_INTERVAL)))
+    if config.CACHE_INVALIDATION:
+        tasks.append(asyncio.ensure_future(listen_cache_invalidations()))
+    app.state.background_tasks = tasks
+
+
+async def stop_background_tasks(app):
+    """Cancel background tasks and wait until they are finished.
+    """
+    tasks = getattr(app.state, 'background_tasks', [])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
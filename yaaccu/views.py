@@ -1,25 +1,57 @@
+import hmac
 import logging
 import time
+import zlib
+from datetime import datetime
 from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import Depends, APIRouter, HTTPException
-from gino.exceptions import NoResultFound
+import orjson
+from fastapi import Depends, APIRouter, Header, HTTPException, Query, Response
 from pydantic import BaseModel
+from starlette.responses import PlainTextResponse, StreamingResponse
 
+import yaaccu.settings as config
+
+from .cache import cache_stats
+from .chain import inclusion_proof
 from .db import db
+from .export import FORMATS, MEDIA_TYPES, REPORTS, export, stream_rows
+from .lookup import cache_account, get_account, get_accounts, get_currencies, get_currency
+from .metrics import render_metrics
+from .replica import read_engine
 from .security import get_current_account
+from .sequencer import sequenced
 from .models.account import Account
+from .models.balance import Balance
 from .models.currency import Currency
-from .models.document import Document
+from .models.document import (
+    Document,
+    DocumentConflict,
+    InvalidDocumentException,
+    NonceReused,
+)
 from .models.operation import Operation
+from .retry import create_and_commit
 from .utils import pub_key_to_account
-from .signature import check_signature, InvalidSignature
+from .signature import (
+    InvalidSignature,
+    canonical_document,
+    check_signature_async,
+    check_signatures_async,
+    normalize_signature,
+)
 
 router = APIRouter()
 
 
 CREATE_ACCOUNT_TOKEN_EXPIRE_INTERVAL = 3600
 
+INVALID_DOCUMENT_DETAIL = "Document is invalid. Try again later if you're pretty sure " \
+                          "you meet all preconditions."
+INVALID_NONCE_DETAIL = "Signed documents require a single line nonce"
+NONCE_REUSED_DETAIL = "Nonce is already used"
+
 log = logging.getLogger(__name__)
 
 
@@ -29,15 +61,180 @@ async def root():
     return {"message": "Welcome to YAACCU!"}
 
 
+def check_token(token: Optional[str], secret, detail: str):
+    """Compare the token passed in a header with the configured secret.
+
+    :raises HTTPException: the secret is not configured or the token doesn't match it
+    """
+    if secret is None or token is None or not hmac.compare_digest(token, str(secret)):
+        raise HTTPException(status_code=403, detail=detail)
+
+
+@router.get('/stats')
+async def stats(x_stats_token: Optional[str] = Header(None)):
+    """Statistics of in-process caches.
+
+    Requires the `STATS_TOKEN` as the `X-Stats-Token` header.
+    """
+    check_token(x_stats_token, config.STATS_TOKEN, "Invalid stats token")
+    return {"caches": cache_stats()}
+
+
+async def read_db(x_min_document: Optional[int] = Header(None)):
+    """Bind for read-only queries of the request: a replica if available.
+
+    Pass id of your latest document as the `X-Min-Document` header to read your
+    own writes (see `yaaccu.replica`).
+    """
+    return await read_engine(x_min_document)
+
+
 @router.get('/balance')
-async def account_balance(account=Depends(get_current_account)):
-    balance = await db.select([
-        db.func.coalesce(db.func.sum(Operation.amount), 0)
-    ]).where(Operation.account == account.id).gino.scalar()
-    return {
+async def account_balance(response: Response,
+                          currency: Optional[str] = None,
+                          pending: bool = False,
+                          if_none_match: Optional[str] = Header(None),
+                          account=Depends(get_current_account),
+                          bind=Depends(read_db)):
+    """Committed balances of the current account by currency.
+
+    Pass `pending` to get amounts of documents not committed yet as well. Balances
+    are versioned with the `ETag` header, so pollers may pass it as `If-None-Match`
+    to get `304` while balances didn't change. Balances are read from a replica
+    if available (see `X-Min-Document`).
+    """
+    query = db.select([
+        Currency.symbol,
+        Balance.committed,
+        Balance.pending,
+        db.func.max(Balance.last_document).over().label('last_document'),
+    ]).select_from(
+        Balance.join(Currency)
+    ).where(Balance.account == account.id).order_by(Currency.symbol)
+    if currency is not None:
+        currency_obj = await get_currency(currency)
+        if currency_obj is None:
+            raise HTTPException(status_code=400, detail="Invalid currency")
+        query = query.where(Balance.currency == currency_obj.id)
+    rows = await bind.all(query)
+
+    result = {
         "account": account.address,
-        "balance": balance
+        "last_document": rows[0].last_document if rows else None,
+        "balances": {row.symbol: row.committed for row in rows},
     }
+    if pending:
+        result["pending"] = {row.symbol: row.pending for row in rows}
+    # commits of earlier documents change balances without changing the last document
+    etag = '"%s-%08x"' % (
+        result["last_document"] or 0, zlib.crc32(orjson.dumps(result, default=str))
+    )
+    if if_none_match is not None and etag in _etags(if_none_match):
+        return Response(status_code=304, headers={'etag': etag})
+    response.headers['etag'] = etag
+    return result
+
+
+def _etags(if_none_match: str) -> List[str]:
+    return [
+        tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip()
+        for tag in if_none_match.split(',')
+    ]
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+async def metrics(x_stats_token: Optional[str] = Header(None)):
+    """Metrics of the process in the Prometheus text format.
+
+    Requires the `STATS_TOKEN` as the `X-Stats-Token` header like `/stats`.
+    """
+    check_token(x_stats_token, config.STATS_TOKEN, "Invalid stats token")
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+@router.get('/history')
+async def history(currency: Optional[str] = None,
+                  after_commit: int = 0,
+                  after: int = 0,
+                  limit: Optional[int] = Query(None, ge=1, le=config.HISTORY_MAX_LIMIT),
+                  account=Depends(get_current_account),
+                  bind=Depends(read_db)):
+    """Stream committed operations of the current account as json lines.
+
+    Operations are ordered by commits of their documents (`commit_seq`) and by id. Pass
+    `commit_seq` and `id` of the last received operation as `after_commit` and `after`
+    to continue reading from it (e.g. to read history page by page with `limit`, up to
+    `HISTORY_MAX_LIMIT` operations per page). Documents of the account are numbered in
+    the order they are committed, so documents committed later never show up before
+    the last received operation.
+    History is read from a replica if available (see `X-Min-Document`).
+    """
+    query = db.select([
+        Operation.id,
+        Operation.document,
+        Document.commit_seq,
+        Currency.symbol.label('currency'),
+        Operation.amount,
+        Document.created_at,
+    ]).select_from(
+        Operation.join(Document).join(Currency)
+    ).where(db.and_(
+        Operation.account == account.id,
+        db.tuple_(Document.commit_seq, Operation.id) > db.tuple_(after_commit, after),
+        Document.committed.is_(True),
+    )).order_by(Document.commit_seq, Operation.id)
+    if currency is not None:
+        currency_obj = await get_currency(currency)
+        if currency_obj is None:
+            raise HTTPException(status_code=400, detail="Invalid currency")
+        query = query.where(Operation.currency == currency_obj.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return StreamingResponse(
+        stream_rows(query, 'ndjson', bind, config.HISTORY_CHUNK_SIZE),
+        media_type=MEDIA_TYPES['ndjson'],
+    )
+
+
+@router.get('/export')
+async def export_ledger(report: str = 'ledger',
+                        format: str = 'ndjson',  # pylint: disable=redefined-builtin
+                        commit: Optional[int] = None,
+                        timestamp: Optional[datetime] = None,
+                        x_export_token: Optional[str] = Header(None),
+                        bind=Depends(read_db)):
+    """Stream the ledger or the trial balance as json lines or csv.
+
+    `report` is `ledger` (committed documents and operations) or `trial-balance`
+    (committed balances per account and currency), both may be made as of the
+    `commit` (`commit_seq` of documents) or the `timestamp`. Requires the `EXPORT_TOKEN` as the
+    `X-Export-Token` header.
+    """
+    check_token(x_export_token, config.EXPORT_TOKEN, "Invalid export token")
+    if report not in REPORTS:
+        raise HTTPException(status_code=400, detail="Invalid report")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    return StreamingResponse(
+        export(report, format, commit, timestamp, bind), media_type=MEDIA_TYPES[format]
+    )
+
+
+@router.get('/proof/{document}')
+async def document_proof(document: int, account=Depends(get_current_account)):
+    """Merkle proof of inclusion of the sealed document into the latest checkpoint.
+
+    Returns the canonical content of the document, its hash (SHA3-256 of the hash of the
+    previous sealed document and the content), the index of its leaf in the tree, the
+    checkpoint root and the audit path (RFC 6962) of the leaf. Only documents involving
+    the current account are available.
+    """
+    proof = await inclusion_proof(document)
+    if proof is None or not await Operation.query.where(db.and_(
+            Operation.document == document, Operation.account == account.id
+    )).gino.first():
+        raise HTTPException(status_code=404, detail="Document is not sealed yet")
+    return proof
 
 
 class CreateAccountRequest(BaseModel):
@@ -62,7 +259,7 @@ async def create_account(create_request: CreateAccountRequest):
         if create_request.timestamp < time.time() - CREATE_ACCOUNT_TOKEN_EXPIRE_INTERVAL:
             raise InvalidSignature()
         content = ''.join([create_request.pub_key, str(create_request.timestamp)])
-        check_signature(content, create_request.sign, create_request.pub_key)
+        await check_signature_async(content, create_request.sign, create_request.pub_key)
     except InvalidSignature as e:
         raise HTTPException(status_code=400, detail="Invalid signature") from e
 
@@ -70,6 +267,7 @@ async def create_account(create_request: CreateAccountRequest):
         address=pub_key_to_account(create_request.pub_key),
         pub_key=create_request.pub_key,
     )
+    cache_account(account)
     return {
         "account": account.address,
         "pub_key": account.pub_key
@@ -80,33 +278,250 @@ class TransferInfo(BaseModel):
     receiver: str
     currency: str
     amount: Decimal
+    #: optional PSS signature of the document made with the sender key
+    #: (see `yaaccu.signature.canonical_document`)
+    signature: Optional[str] = None
+    #: nonce of the signed document, required along with the signature
+    nonce: Optional[str] = None
+
+
+def signed_content(operations, nonce: str) -> str:
+    """Content of the document with (account, currency, amount) operations signed by clients.
+    """
+    return canonical_document(
+        [(account.address, currency.symbol, amount) for account, currency, amount in operations],
+        nonce,
+    )
+
+
+def valid_nonce(nonce: Optional[str]) -> bool:
+    return nonce is not None and nonce != '' and '\n' not in nonce
+
+
+async def check_document_signature(operations, signature: Optional[str], nonce: Optional[str],
+                                   account) -> Optional[str]:
+    """Check the client signature of the document made with the key of the account.
+
+    :return: normalized signature (see `normalize_signature`)
+    """
+    if signature is None:
+        return None
+    if nonce is None or not valid_nonce(nonce):
+        raise HTTPException(status_code=400, detail=INVALID_NONCE_DETAIL)
+    try:
+        signature = normalize_signature(signature)
+        await check_signature_async(
+            signed_content(operations, nonce), signature, account.pub_key
+        )
+    except InvalidSignature as e:
+        raise HTTPException(status_code=400, detail="Invalid signature") from e
+    return signature
+
+
+async def commit_document(operations, response: Response, account,
+                          signature: Optional[str] = None, nonce: Optional[str] = None):
+    """Create and commit document with given operations retrying transient conflicts.
+
+    The nonce of the signed document must not be used by other documents of the account
+    (the signer). The number of attempts made is returned in the `X-Attempts` header.
+    """
+    signed = signature is not None
+    async with sequenced(acc.id for acc, _, _ in operations):
+        try:
+            doc, attempts = await create_and_commit(
+                operations,
+                signature=signature,
+                nonce=nonce if signed else None,
+                signer=account if signed else None,
+            )
+        except NonceReused as e:
+            raise HTTPException(
+                status_code=400,
+                detail=NONCE_REUSED_DETAIL,
+                headers={'X-Attempts': str(e.attempts)},
+            ) from e
+        except DocumentConflict as e:
+            raise HTTPException(
+                status_code=409,
+                detail="Document conflicts with documents not committed yet. Try again later.",
+                headers={'X-Attempts': str(e.attempts)},
+            ) from e
+        except InvalidDocumentException as e:
+            raise HTTPException(
+                status_code=400,
+                detail=INVALID_DOCUMENT_DETAIL,
+                headers={'X-Attempts': str(e.attempts)},
+            ) from e
+    response.headers['X-Attempts'] = str(attempts)
+    return doc.to_dict()
 
 
 @router.post('/transfer/')
-async def transfer(transfer_info: TransferInfo, account=Depends(get_current_account)):
+async def transfer(transfer_info: TransferInfo,
+                   response: Response,
+                   account=Depends(get_current_account)):
     """Transfer funds from one account to another.
+
+    Pass `signature` to prove the origin of the document: the signature of the
+    `nonce` and the operations of the transfer (the sender one goes first) made with
+    the sender key. Nonces can't be used twice.
     """
-    try:
-        currency = await Currency.query.where(Currency.symbol == transfer_info.currency).gino.one()
-    except NoResultFound as e:
-        raise HTTPException(status_code=400, detail="Invalid currency") from e
+    currency = await get_currency(transfer_info.currency)
+    if currency is None:
+        raise HTTPException(status_code=400, detail="Invalid currency")
 
-    try:
-        receiver = await Account.query.where(Account.address == transfer_info.receiver).gino.one()
-    except NoResultFound as e:
-        raise HTTPException(status_code=400, detail="Invalid receiver account") from e
-
-    doc = await Document.create_transfer(
-        sender=account,
-        receiver=receiver,
-        amount=transfer_info.amount,
-        currency=currency
+    receiver = await get_account(transfer_info.receiver)
+    if receiver is None:
+        raise HTTPException(status_code=400, detail="Invalid receiver account")
+
+    operations = [
+        (account, currency, -transfer_info.amount),
+        (receiver, currency, transfer_info.amount),
+    ]
+    signature = await check_document_signature(
+        operations, transfer_info.signature, transfer_info.nonce, account
+    )
+    return await commit_document(operations, response, account, signature, transfer_info.nonce)
+
+
+class TransferBatch(BaseModel):
+    transfers: List[TransferInfo]
+
+
+@router.post('/transfer/batch/')
+async def transfer_batch(batch: TransferBatch, account=Depends(get_current_account)):
+    """Transfer funds from the current account to several receivers at once.
+
+    Transfers are applied in order, each one in a separate document. Result of every
+    transfer is returned in the same order: the committed document or the error.
+    Signatures of transfers are checked at once in parallel.
+    """
+    if not batch.transfers:
+        return {"results": []}
+
+    currencies = await get_currencies(item.currency for item in batch.transfers)
+    receivers = await get_accounts(item.receiver for item in batch.transfers)
+
+    results: List[Optional[dict]] = [None] * len(batch.transfers)
+    # normalized signatures and nonces of signed transfers by index
+    signatures: Dict[int, Tuple[str, str]] = {}
+    transfers = []
+    for index, item in enumerate(batch.transfers):
+        if item.amount <= 0:
+            results[index] = {"status": "error", "detail": "Invalid amount"}
+        elif item.currency not in currencies:
+            results[index] = {"status": "error", "detail": "Invalid currency"}
+        elif item.receiver not in receivers:
+            results[index] = {"status": "error", "detail": "Invalid receiver account"}
+        elif item.signature is None:
+            transfers.append((index, (
+                receivers[item.receiver], item.amount, currencies[item.currency]
+            )))
+        elif item.nonce is None or not valid_nonce(item.nonce):
+            results[index] = {"status": "error", "detail": INVALID_NONCE_DETAIL}
+        else:
+            try:
+                signatures[index] = (normalize_signature(item.signature), item.nonce)
+            except InvalidSignature:
+                results[index] = {"status": "error", "detail": "Invalid signature"}
+                continue
+            transfers.append((index, (
+                receivers[item.receiver], item.amount, currencies[item.currency]
+            )))
+
+    signed = [
+        (index, signed_content(
+            [(account, currency, -amount), (receiver, currency, amount)], signatures[index][1]
+        ), signatures[index][0])
+        for index, (receiver, amount, currency) in transfers if index in signatures
+    ]
+    valid = await check_signatures_async([
+        (content, signature, account.pub_key) for _, content, signature in signed
+    ]) if signed else []
+    invalid = {index for (index, _, _), is_valid in zip(signed, valid) if not is_valid}
+    for index in invalid:
+        results[index] = {"status": "error", "detail": "Invalid signature"}
+    transfers = [(index, transfer) for index, transfer in transfers if index not in invalid]
+
+    # reused nonces are rejected by `Document.create_transfers` too, checked here to
+    # report them
+    used = await Document.used_nonces(
+        account.id, [signatures[index][1] for index, _ in transfers if index in signatures]
     )
-    if doc:
-        await doc.commit()
-        return doc.to_dict()
-    raise HTTPException(
-        status_code=400,
-        detail="Document is invalid. Try again later if you're pretty sure "
-               "you meet all preconditions."
+    unused = []
+    for index, transfer in transfers:
+        if index in signatures:
+            nonce = signatures[index][1]
+            if nonce in used:
+                results[index] = {"status": "error", "detail": NONCE_REUSED_DETAIL}
+                continue
+            used.add(nonce)
+        unused.append((index, transfer))
+    transfers = unused
+
+    async with sequenced([account.id] + [receiver.id for receiver in receivers.values()]):
+        docs = await Document.create_transfers(
+            account,
+            [transfer for _, transfer in transfers],
+            [signatures[index][0] if index in signatures else None for index, _ in transfers],
+            [signatures[index][1] if index in signatures else None for index, _ in transfers],
+        )
+        created = [(index, doc) for (index, _), doc in zip(transfers, docs) if doc]
+        committed = await Document.commit_many([doc for _, doc in created])
+        for (index, doc), is_committed in zip(created, committed):
+            if is_committed:
+                results[index] = {"status": "committed", "document": doc.to_dict()}
+            else:
+                await doc.abort()
+    for index, result in enumerate(results):
+        if result is None:
+            results[index] = {"status": "error", "detail": INVALID_DOCUMENT_DETAIL}
+    return {"results": results}
+
+
+class OperationInfo(BaseModel):
+    account: str
+    currency: str
+    amount: Decimal
+
+
+class DocumentInfo(BaseModel):
+    operations: List[OperationInfo]
+    #: optional PSS signature of the document made with the key of the current account
+    #: (see `yaaccu.signature.canonical_document`)
+    signature: Optional[str] = None
+    #: nonce of the signed document, required along with the signature
+    nonce: Optional[str] = None
+
+
+@router.post('/documents/')
+async def create_document(document_info: DocumentInfo,
+                          response: Response,
+                          account=Depends(get_current_account)):
+    """Create document with arbitrary operations (e.g. a fee split or exchange legs).
+
+    All operations are applied at once within a single document. Only the current account
+    may be charged (has negative operations), any account may receive funds. Pass
+    `signature` of the `nonce` and the operations made with the key of the current
+    account to prove the origin of the document. Nonces can't be used twice.
+    """
+    if not document_info.operations:
+        raise HTTPException(status_code=400, detail="Document has no operations")
+
+    currencies = await get_currencies(item.currency for item in document_info.operations)
+    accounts = await get_accounts(item.account for item in document_info.operations)
+
+    operations = []
+    for item in document_info.operations:
+        if item.currency not in currencies:
+            raise HTTPException(status_code=400, detail="Invalid currency")
+        if item.account not in accounts:
+            raise HTTPException(status_code=400, detail="Invalid account")
+        if item.amount < 0 and item.account != account.address:
+            raise HTTPException(status_code=403, detail="Only the current account may be charged")
+        operations.append((accounts[item.account], currencies[item.currency], item.amount))
+
+    signature = await check_document_signature(
+        operations, document_info.signature, document_info.nonce, account
     )
+    return await commit_document(operations, response, account, signature, document_info.nonce)